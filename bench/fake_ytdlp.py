@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Fake yt-dlp
+Answers the yt-dlp command lines web/app.py builds with synthetic audio, offline
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import struct
+import sys
+import time
+import zlib
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz: a silent frame is a header and zeros
+MP3_FRAME = b'\xff\xfb\x90\x00' + bytes(413)
+MP3_FRAMES_PER_SECOND = 44100 / 1152
+
+# Opus in WebM as YouTube serves it, roughly 160 kbps
+STREAM_BYTES_PER_SECOND = 20000
+
+# Seconds between progress lines, as often as yt-dlp's own
+PROGRESS_INTERVAL = 0.1
+
+# Playlist size when the list ID doesn't end in a number (list=BENCH500 has 500)
+DEFAULT_PLAYLIST_SIZE = 25
+
+
+def setting(name, default):
+    """Read a FAKE_YTDLP_* knob from the environment"""
+    return type(default)(os.environ.get(f'FAKE_YTDLP_{name}', default))
+
+
+def id3_tag(title, artist):
+    """A minimal ID3v2.3 tag with title and artist, as --embed-metadata leaves"""
+    frames = b''
+    for frame_id, text in (('TIT2', title), ('TPE1', artist)):
+        body = b'\x03' + text.encode('utf-8')
+        frames += frame_id.encode() + struct.pack('>I', len(body)) + b'\x00\x00' + body
+    size = len(frames)
+    # Tag sizes are synchsafe: 7 bits per byte
+    synchsafe = bytes((size >> shift) & 0x7f for shift in (21, 14, 7, 0))
+    return b'ID3\x03\x00\x00' + synchsafe + frames
+
+
+def write_mp3(path, seconds, title=None, artist=None):
+    """Write a silent MP3 that tag libraries and Navidrome accept"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        if title or artist:
+            f.write(id3_tag(title or '', artist or ''))
+        f.write(MP3_FRAME * int(seconds * MP3_FRAMES_PER_SECOND))
+
+
+def video_info(video_id):
+    """Stable title and uploader for a video ID"""
+    artist = int(hashlib.md5(video_id.encode()).hexdigest(), 16) % 50
+    return {
+        'id': video_id,
+        'title': f'Bench Track {video_id}',
+        'uploader': f'Bench Artist {artist:02d}',
+        'duration': setting('TRACK_SECONDS', 210.0),
+        'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+        'ext': 'webm',
+    }
+
+
+def fill_template(template, info, ext):
+    """Expand the %(field)s placeholders of an output template, --restrict-filenames style"""
+    def field(match):
+        value = ext if match.group(1) == 'ext' else str(info.get(match.group(1), 'NA'))
+        return re.sub(r'[^\w.-]', '_', value)
+    return re.sub(r'%\((\w+)\)s', field, template)
+
+
+def parse_args(argv):
+    """Pick out the options the fake needs; everything else is accepted and ignored"""
+    args = {'paths': {}, 'url': None}
+    takes_value = {
+        '-f', '-o', '-P', '--print', '--progress-template', '--load-info-json',
+        '--audio-format', '--audio-quality', '--ffmpeg-location',
+    }
+    index = 0
+    while index < len(argv):
+        arg = argv[index]
+        if arg in takes_value:
+            value = argv[index + 1]
+            index += 1
+            if arg == '-P':
+                kind, _, path = value.rpartition(':')
+                args['paths'][kind or 'home'] = path
+            else:
+                args[arg.lstrip('-')] = value
+        elif arg.startswith('-'):
+            args[arg.lstrip('-')] = True
+        else:
+            args['url'] = arg
+        index += 1
+    return args
+
+
+def emit(data):
+    print(json.dumps(data), flush=True)
+
+
+def maybe_fail(video_id):
+    """Fail like YouTube sometimes does, at FAKE_YTDLP_FAIL_RATE"""
+    if random.random() < setting('FAIL_RATE', 0.0):
+        print(f'ERROR: [youtube] {video_id}: HTTP Error 429: Too Many Requests', file=sys.stderr)
+        sys.exit(1)
+
+
+def dump_playlist(url):
+    """--flat-playlist --dump-single-json: a playlist sized by the number in its ID"""
+    list_id = re.search(r'list=([\w-]+)', url).group(1)
+    size = re.search(r'(\d+)$', list_id)
+    size = int(size.group(1)) if size else DEFAULT_PLAYLIST_SIZE
+    prefix = re.sub(r'[^\w]', '', list_id)[:4].ljust(4, 'x')
+    entries = []
+    for number in range(size):
+        info = video_info(f'{prefix}{number:07d}')
+        entries.append({'id': info['id'], 'title': info['title'], 'url': info['webpage_url']})
+    emit({'id': list_id, 'title': f'Bench Playlist {list_id}', 'entries': entries})
+
+
+def fetch(args):
+    """The fetch stage: 'download' the audio stream into staging with progress lines"""
+    video_id = re.search(r'v=([\w-]{11})', args['url']).group(1)
+    info = video_info(video_id)
+
+    # Extraction: yt-dlp talks to YouTube before the first progress line
+    time.sleep(setting('EXTRACT_SECONDS', 0.5))
+    maybe_fail(video_id)
+
+    path = os.path.join(args['paths'].get('home', '.'), fill_template(args['o'], info, 'webm'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    size = int(info['duration'] * STREAM_BYTES_PER_SECOND)
+    speed = setting('SPEED', 10_000_000.0)
+    chunk = max(1, int(speed * PROGRESS_INTERVAL))
+    block = os.urandom(chunk)
+
+    written = 0
+    with open(path, 'wb') as f:
+        while written < size:
+            started = time.monotonic()
+            part = block[:min(chunk, size - written)]
+            f.write(part)
+            written += len(part)
+            emit({
+                'progress': f'{written * 100 / size:5.1f}%',
+                'status': 'downloading' if written < size else 'finished',
+                'downloaded_bytes': str(written),
+                'speed': str(speed),
+                'playlist_index': 'NA',
+                'n_entries': 'NA',
+            })
+            time.sleep(max(0, len(part) / speed - (time.monotonic() - started)))
+
+    stem = os.path.splitext(path)[0]
+    with open(f'{stem}.info.json', 'w') as f:
+        json.dump(dict(info, filepath=path), f)
+    with open(f'{stem}.webp', 'wb') as f:
+        f.write(os.urandom(20000))
+    emit({'filepath': path, 'id': video_id, 'title': info['title']})
+
+
+def postprocess(args):
+    """The post-processing stage: 'transcode' and tag the staged stream into the library"""
+    with open(args['load-info-json']) as f:
+        info = json.load(f)
+    staged = info['filepath']
+    with open(staged, 'rb') as f:
+        stream = f.read()
+
+    # Stand-in for ffmpeg: CPU time proportional to the stream size
+    audio_format = args.get('audio-format', 'best')
+    ext = 'opus' if audio_format == 'best' else audio_format
+    if ext in ('mp3', 'flac'):
+        for _ in range(setting('TRANSCODE_PASSES', 1)):
+            zlib.compress(stream, 6)
+
+    path = os.path.join(args['paths'].get('home', '.'), fill_template(args['o'], info, ext))
+    if ext == 'mp3':
+        write_mp3(path, info['duration'], info['title'], info['uploader'])
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(stream)
+    if args.get('write-info-json'):
+        with open(os.path.splitext(path)[0] + '.info.json', 'w') as f:
+            json.dump(dict(info, filepath=path, acodec=ext), f)
+    os.remove(staged)
+    emit({'filepath': path, 'id': info['id'], 'title': info['title']})
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    if args.get('version'):
+        print('2099.01.01-fake')
+    elif args.get('dump-single-json'):
+        dump_playlist(args['url'])
+    elif args.get('load-info-json'):
+        postprocess(args)
+    elif args['url']:
+        fetch(args)
+    else:
+        print('ERROR: no URL given', file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
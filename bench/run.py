@@ -0,0 +1,588 @@
+#!/usr/bin/env python3
+"""
+Offline Benchmark Suite
+Runs the web app and the metadata enhancer against a fake yt-dlp and stub APIs
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode
+
+from fake_ytdlp import write_mp3
+from stubs import StubServers
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+SCENARIOS = ('burst', 'playlist', 'polling', 'enhance')
+
+ACTIVE_STATUSES = 'queued,starting,downloading,processing,retrying'
+
+# Seconds between looking at the jobs while waiting for a scenario to finish
+WAIT_INTERVAL = 0.5
+
+# Results where a bigger number is better; for everything else smaller is better
+HIGHER_IS_BETTER = ('tracks_per_hour', 'requests_per_second')
+
+# Results compared against a baseline; the rest are informational
+COMPARED = ('tracks_per_hour', 'requests_per_second', 'latency_p50', 'latency_p99', 'peak_rss_mb')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers, or None when it's empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(root):
+    """PIDs of a process and all its descendants"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; the parent PID follows its closing ')'
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    pids, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        pids.append(pid)
+        pending.extend(children.get(pid, []))
+    return pids
+
+
+def rss_kb(pid, field='VmRSS'):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler:
+    """Track the peak combined RSS of a process and its children (yt-dlp, writers)"""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, sum(rss_kb(pid) for pid in process_tree(self.pid)))
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return round(self.peak_kb / 1024, 1)
+
+
+def make_certificate(workdir):
+    """Self-signed certificate for the provider stubs, or None without openssl"""
+    if not shutil.which('openssl'):
+        return None
+    cert, key = os.path.join(workdir, 'stub-cert.pem'), os.path.join(workdir, 'stub-key.pem')
+    result = subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1',
+         '-keyout', key, '-out', cert],
+        capture_output=True
+    )
+    return (cert, key) if result.returncode == 0 else None
+
+
+def write_config(path, settings):
+    with open(path, 'w') as f:
+        for key, value in settings.items():
+            f.write(f'{key}={value}\n')
+
+
+class WebApp:
+    """web/app.py in a child process with its state in a scratch directory"""
+
+    def __init__(self, workdir, navidrome_url, fake, settings=None, workers=0):
+        self.workdir = workdir
+        self.workers = workers
+        self.port = free_port()
+        self.base = f'127.0.0.1:{self.port}'
+        bin_dir = os.path.join(workdir, 'bin')
+        os.makedirs(bin_dir, exist_ok=True)
+        os.makedirs(os.path.join(workdir, 'logs'), exist_ok=True)
+
+        # web/app.py runs the binary named yt-dlp from PATH
+        shim = os.path.join(bin_dir, 'yt-dlp')
+        with open(shim, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH_DIR, "fake_ytdlp.py")}" "$@"\n')
+        os.chmod(shim, 0o755)
+
+        config = {
+            'DOWNLOAD_ENGINE': 'subprocess',
+            'AUTO_UPDATE': 'false',
+            'JOBS_DB_PATH': os.path.join(workdir, 'jobs.db'),
+            'MONITOR_DB_PATH': os.path.join(workdir, 'monitor.db'),
+            'QUEUE_DB_PATH': os.path.join(workdir, 'queue.db'),
+            'QUEUE_FILE': os.path.join(workdir, 'queue', 'download_queue.txt'),
+            'ENHANCER_METRICS_PATH': os.path.join(workdir, 'enhancer.prom'),
+            'CATALOG_DB_PATH': os.path.join(workdir, 'catalog.db'),
+            'NAVIDROME_URL': navidrome_url,
+            'NAVIDROME_USERNAME': 'bench',
+            'NAVIDROME_PASSWORD': 'bench',
+            'LEADER_LOCK_PATH': os.path.join(workdir, 'leader.lock'),
+            'SCAN_WINDOW_SECONDS': '5',
+            'RETRY_BACKOFF_SECONDS': '1',
+            'MIN_FREE_SPACE_MB': '0',
+            'MAX_FINISHED_JOBS': '100000',
+        }
+        config.update(settings or {})
+        write_config(os.path.join(workdir, 'config.env'), config)
+
+        self.env = dict(
+            os.environ,
+            CONFIG_PATH=os.path.join(workdir, 'config.env'),
+            LOG_DIR=os.path.join(workdir, 'logs'),
+            LISTEN_PORT=str(self.port),
+            DOWNLOAD_PATH=os.path.join(workdir, 'music'),
+            PATH=f'{bin_dir}{os.pathsep}{os.environ.get("PATH", "")}',
+            **{f'FAKE_YTDLP_{name}': str(value) for name, value in fake.items()}
+        )
+        self.process = None
+
+    def start(self, timeout=30):
+        """Run the development server, or gunicorn when workers were asked for"""
+        if self.workers:
+            cmd = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app']
+        else:
+            cmd = [sys.executable, os.path.join(REPO_DIR, 'web', 'app.py')]
+        self.process = subprocess.Popen(
+            cmd,
+            cwd=os.path.join(REPO_DIR, 'web'),
+            env=dict(self.env, WEB_WORKERS=str(self.workers)),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'web app exited with {self.process.returncode}, see {self.workdir}/logs/web.log')
+            try:
+                self.request('GET', '/api/downloads?limit=1')
+                return self
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError('web app did not start')
+
+    def stop(self):
+        """Stop the app; returns its own peak RSS in MB"""
+        peak = round(rss_kb(self.process.pid, 'VmHWM') / 1024, 1)
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        return peak
+
+    def request(self, method, path, body=None):
+        """One request on a fresh connection; returns (status, parsed JSON body)"""
+        connection = http.client.HTTPConnection(self.base, timeout=60)
+        try:
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+            response = connection.getresponse()
+            data = response.read()
+            return response.status, json.loads(data) if data else None
+        finally:
+            connection.close()
+
+    def submit(self, url):
+        status, body = self.request('POST', '/download', {'url': url, 'format': 'mp3'})
+        if status != 200 or not body.get('success'):
+            raise RuntimeError(f'submit failed: {status} {body}')
+        return body['download_id']
+
+    def jobs(self, **filters):
+        """Every job matching /api/downloads filters, following the pages"""
+        records, cursor = [], None
+        while True:
+            query = dict(filters, limit=1000, fields='status,queued_time,end_time,parent_id')
+            if cursor:
+                query['cursor'] = cursor
+            _, body = self.request('GET', f'/api/downloads?{urlencode(query)}')
+            records.extend(body['downloads'])
+            cursor = body.get('next_cursor')
+            if not cursor:
+                return records
+
+    def wait_idle(self, timeout):
+        """Block until no job is waiting or running"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            _, body = self.request('GET', f'/api/downloads?status={ACTIVE_STATUSES}&fields=status&limit=1')
+            if not body['downloads']:
+                return True
+            time.sleep(WAIT_INTERVAL)
+        return False
+
+
+def track_results(tracks, seconds):
+    """Throughput and job latency (queued to finished) of track records"""
+    completed = [record for record in tracks if record.get('status') == 'completed']
+    latencies = [
+        (datetime.fromisoformat(record['end_time']) - datetime.fromisoformat(record['queued_time'])).total_seconds()
+        for record in completed if record.get('end_time') and record.get('queued_time')
+    ]
+    return {
+        'tracks': len(completed),
+        'failed': len(tracks) - len(completed),
+        'seconds': round(seconds, 1),
+        'tracks_per_hour': round(len(completed) * 3600 / seconds) if seconds else None,
+        'latency_p50': round(percentile(latencies, 0.5), 3) if latencies else None,
+        'latency_p99': round(percentile(latencies, 0.99), 3) if latencies else None,
+    }
+
+
+def run_app_scenario(name, args, stubs, navidrome_url, scenario):
+    """Start a fresh app, run one download scenario against it and measure it"""
+    workdir = os.path.join(args.workdir, name)
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    fake = {
+        'SPEED': args.speed,
+        'TRACK_SECONDS': args.track_seconds,
+        'EXTRACT_SECONDS': args.extract_seconds,
+        'FAIL_RATE': args.fail_rate,
+    }
+    settings = dict(setting.split('=', 1) for setting in args.set)
+    app = WebApp(workdir, navidrome_url, fake, settings, args.gunicorn_workers).start()
+    scans_before = stubs.requests['navidrome_scans']
+    sampler = RssSampler(app.process.pid).start()
+    try:
+        result = scenario(app, args)
+    finally:
+        result_rss = sampler.stop()
+        app_rss = app.stop()
+    result['peak_rss_mb'] = result_rss
+    result['app_peak_rss_mb'] = app_rss
+    result['navidrome_scans'] = stubs.requests['navidrome_scans'] - scans_before
+    return result
+
+
+def burst_scenario(app, args):
+    """Submit many single tracks at once and wait for all of them"""
+    urls = [f'https://www.youtube.com/watch?v=burst{number:06d}' for number in range(args.tracks)]
+    started = time.monotonic()
+    submit_times = []
+
+    def submit(url):
+        sent = time.monotonic()
+        app.submit(url)
+        submit_times.append(time.monotonic() - sent)
+
+    with ThreadPoolExecutor(max_workers=min(len(urls), 64)) as pool:
+        list(pool.map(submit, urls))
+    if not app.wait_idle(args.timeout):
+        logger.warning('burst: timed out waiting for downloads')
+    result = track_results(app.jobs(), time.monotonic() - started)
+    result['submit_p50'] = round(percentile(submit_times, 0.5), 4)
+    result['submit_p99'] = round(percentile(submit_times, 0.99), 4)
+    return result
+
+
+def playlist_scenario(app, args):
+    """Queue one large playlist and wait for every track"""
+    started = time.monotonic()
+    parent_id = app.submit(f'https://www.youtube.com/playlist?list=BENCH{args.playlist_size}')
+    if not app.wait_idle(args.timeout):
+        logger.warning('playlist: timed out waiting for downloads')
+    return track_results(app.jobs(playlist=parent_id), time.monotonic() - started)
+
+
+def polling_scenario(app, args):
+    """Hammer /api/status from many clients while a burst of downloads runs"""
+    ids = [app.submit(f'https://www.youtube.com/watch?v=polls{number:06d}') for number in range(args.tracks)]
+    latencies = []
+    errors = [0]
+    deadline = time.monotonic() + args.poll_seconds
+
+    def poller(offset):
+        index = offset
+        while time.monotonic() < deadline:
+            sent = time.monotonic()
+            try:
+                status, _ = app.request('GET', f'/api/status/{ids[index % len(ids)]}')
+                if status != 200:
+                    errors[0] += 1
+            except OSError:
+                errors[0] += 1
+            latencies.append(time.monotonic() - sent)
+            index += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=poller, args=(offset,), daemon=True) for offset in range(args.pollers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.monotonic() - started
+    app.wait_idle(args.timeout)
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'seconds': round(seconds, 1),
+        'requests_per_second': round(len(latencies) / seconds, 1),
+        'latency_p50': round(percentile(latencies, 0.5), 4) if latencies else None,
+        'latency_p99': round(percentile(latencies, 0.99), 4) if latencies else None,
+        'tracks': sum(1 for record in app.jobs() if record.get('status') == 'completed'),
+    }
+
+
+def read_textfile(path):
+    """Samples of a Prometheus text file as {name{labels}: value}"""
+    samples = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.strip() and not line.startswith('#'):
+                    name, _, value = line.strip().rpartition(' ')
+                    samples[name] = float(value)
+    except FileNotFoundError:
+        pass
+    return samples
+
+
+def histogram_quantile(samples, metric, fraction):
+    """Upper bound of the bucket holding a quantile, over every label set of a histogram"""
+    buckets = {}
+    for name, value in samples.items():
+        if name.startswith(f'{metric}_bucket{{'):
+            bound = name.rsplit('le="', 1)[1].rstrip('"}')
+            buckets[float(bound)] = buckets.get(float(bound), 0) + value
+    if not buckets:
+        return None
+    total = buckets[max(buckets)]
+    for bound in sorted(buckets):
+        if buckets[bound] >= fraction * total:
+            return bound
+    return None
+
+
+def make_library(path, size, seconds):
+    """Synthetic library of 'Artist - Title.mp3' files like the downloader leaves"""
+    for number in range(size):
+        artist = f'Bench Artist {number % 50:02d}'
+        write_mp3(os.path.join(path, artist, f'{artist} - Bench Song {number:05d}.mp3'), seconds)
+
+
+def run_enhancer(args, workdir, library, config_path, env, force):
+    """One enhancer run as a child process; returns its results"""
+    cmd = [args.enhancer_python, os.path.join(REPO_DIR, 'scripts', 'enhance_metadata.py'), library, '--config', config_path]
+    if force:
+        cmd.append('--force')
+    started = time.monotonic()
+    with open(os.path.join(workdir, 'enhancer.log'), 'a') as log:
+        process = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=log, stderr=log)
+        sampler = RssSampler(process.pid).start()
+        process.wait()
+        peak = sampler.stop()
+    seconds = time.monotonic() - started
+    if process.returncode != 0:
+        raise RuntimeError(f'enhancer exited with {process.returncode}, see {workdir}/enhancer.log')
+
+    samples = read_textfile(os.path.join(workdir, 'enhancer.prom'))
+    processed = samples.get('enhancer_files_total{result="processed"}', 0)
+    metric = 'enhancer_provider_request_duration_seconds'
+    return {
+        'tracks': int(processed),
+        'skipped': int(samples.get('enhancer_files_total{result="skipped"}', 0)),
+        'seconds': round(seconds, 1),
+        'tracks_per_hour': round(processed * 3600 / seconds) if processed else None,
+        'latency_p50': histogram_quantile(samples, metric, 0.5),
+        'latency_p99': histogram_quantile(samples, metric, 0.99),
+        'peak_rss_mb': peak,
+    }
+
+
+def enhance_scenario(args, stubs, provider_url, certificate):
+    """Enhance a whole synthetic library, then rerun over the unchanged library"""
+    workdir = os.path.join(args.workdir, 'enhance')
+    shutil.rmtree(workdir, ignore_errors=True)
+    library = os.path.join(workdir, 'library')
+    make_library(library, args.library_size, args.library_track_seconds)
+
+    config = {
+        'SPOTIFY_CLIENT_ID': 'bench',
+        'SPOTIFY_CLIENT_SECRET': 'bench',
+        'MUSICBRAINZ_URL': provider_url,
+        'SPOTIFY_API_URL': f'{provider_url}/v1/',
+        'SPOTIFY_TOKEN_URL': f'{provider_url}/api/token',
+        'LOOKUP_CACHE_PATH': os.path.join(workdir, 'metadata_cache.db'),
+        'ENHANCE_MANIFEST_PATH': os.path.join(workdir, 'enhance_manifest.db'),
+        'ENHANCER_METRICS_PATH': os.path.join(workdir, 'enhancer.prom'),
+    }
+    if certificate:
+        config.update(LASTFM_API_KEY='bench', LASTFM_API_URL=f'{provider_url}/2.0/')
+    else:
+        logger.warning('openssl not found: Last.fm needs HTTPS, so it is left out of the enhancer runs')
+    if not args.real_rate_limits:
+        for provider in ('MUSICBRAINZ', 'SPOTIFY', 'LASTFM'):
+            config[f'{provider}_RATE_LIMIT'] = str(args.provider_rate)
+    config_path = os.path.join(workdir, 'config.env')
+    write_config(config_path, config)
+
+    env = dict(os.environ)
+    if certificate:
+        env.update(SSL_CERT_FILE=certificate[0], REQUESTS_CA_BUNDLE=certificate[0])
+
+    results = {}
+    for name, force in (('enhance', True), ('enhance-rerun', False)):
+        before = dict(stubs.requests)
+        result = run_enhancer(args, workdir, library, config_path, env, force)
+        result['provider_requests'] = {
+            provider: stubs.requests[provider] - before.get(provider, 0)
+            for provider in ('musicbrainz', 'spotify', 'lastfm')
+        }
+        results[name] = result
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against a previous run's results, as printable lines"""
+    regressions = []
+    for scenario, result in results.items():
+        for key in COMPARED:
+            old, new = (baseline.get(scenario) or {}).get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if key in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                regressions.append(f'{scenario} {key}: {old} -> {new} ({change:+.0%})')
+    return regressions
+
+
+def print_results(results):
+    columns = ('tracks', 'failed', 'seconds', 'tracks_per_hour', 'requests_per_second',
+               'latency_p50', 'latency_p99', 'peak_rss_mb')
+    print()
+    print(f"{'scenario':<15}" + ''.join(f'{column:>20}' for column in columns))
+    for scenario, result in results.items():
+        cells = ('-' if result.get(column) is None else str(result[column]) for column in columns)
+        print(f'{scenario:<15}' + ''.join(f'{cell:>20}' for cell in cells))
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the downloader and the enhancer offline')
+    parser.add_argument('scenarios', nargs='*', help=f'scenarios to run (default: all of {", ".join(SCENARIOS)})')
+    parser.add_argument('--workdir', help='scratch directory (default: a temporary one, removed afterwards)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier run; exit 1 if anything got worse')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed change against the baseline (default: 0.15)')
+    parser.add_argument('--timeout', type=float, default=3600, help='seconds to wait for a scenario')
+    parser.add_argument('--gunicorn-workers', type=int, default=0, metavar='N',
+                        help='serve the app with gunicorn and N workers instead of the development server')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help='web app setting, e.g. MAX_CONCURRENT_DOWNLOADS=4')
+
+    fake = parser.add_argument_group('fake yt-dlp')
+    fake.add_argument('--tracks', type=int, default=50, help='tracks submitted at once by burst and polling')
+    fake.add_argument('--playlist-size', type=int, default=500)
+    fake.add_argument('--speed', type=float, default=10_000_000, help='download speed per track in bytes/s')
+    fake.add_argument('--track-seconds', type=float, default=210, help='length of each synthetic track')
+    fake.add_argument('--extract-seconds', type=float, default=0.5, help='time before a download starts')
+    fake.add_argument('--fail-rate', type=float, default=0.0, help='fraction of fetches failing with HTTP 429')
+
+    polling = parser.add_argument_group('polling')
+    polling.add_argument('--pollers', type=int, default=32, help='concurrent /api/status clients')
+    polling.add_argument('--poll-seconds', type=float, default=20)
+
+    enhance = parser.add_argument_group('enhancer and stubs')
+    enhance.add_argument('--library-size', type=int, default=500)
+    enhance.add_argument('--library-track-seconds', type=float, default=10)
+    enhance.add_argument('--latency-ms', type=float, default=50, help='provider stub latency')
+    enhance.add_argument('--jitter-ms', type=float, default=20)
+    enhance.add_argument('--error-rate', type=float, default=0.0, help='fraction of provider requests answered 503')
+    enhance.add_argument('--provider-rate', type=float, default=100, help='requests/s allowed per provider')
+    enhance.add_argument('--real-rate-limits', action='store_true', help="keep the enhancer's real rate limits")
+    enhance.add_argument('--enhancer-python', default=sys.executable, help='interpreter with the metadata requirements')
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenario: {", ".join(sorted(unknown))}')
+    args.scenarios = args.scenarios or list(SCENARIOS)
+
+    keep_workdir = bool(args.workdir)
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='msc-bench-'))
+    os.makedirs(args.workdir, exist_ok=True)
+
+    stubs = StubServers(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate)
+    navidrome_url = stubs.start()
+    certificate = make_certificate(args.workdir)
+    provider_url = stubs.start(certificate=certificate) if certificate else navidrome_url
+
+    app_scenarios = {'burst': burst_scenario, 'playlist': playlist_scenario, 'polling': polling_scenario}
+    results = {}
+    try:
+        for name in dict.fromkeys(args.scenarios):
+            logger.info(f'Running {name}')
+            if name == 'enhance':
+                results.update(enhance_scenario(args, stubs, provider_url, certificate))
+            else:
+                results[name] = run_app_scenario(name, args, stubs, navidrome_url, app_scenarios[name])
+    finally:
+        stubs.stop()
+        if not keep_workdir:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Benchmark Stub Servers
+MusicBrainz, Spotify, Last.fm and Navidrome Subsonic endpoints with configurable latency
+"""
+
+import hashlib
+import json
+import random
+import re
+import ssl
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+MB_NAMESPACE = 'http://musicbrainz.org/ns/mmd-2.0#'
+
+GENRES = ('rock', 'electronic', 'hip hop', 'jazz', 'pop', 'folk', 'metal', 'soul')
+
+
+def digest(*parts):
+    """Stable pseudo-random integer for a lookup, so reruns get the same answers"""
+    return int(hashlib.md5('|'.join(parts).encode()).hexdigest(), 16)
+
+
+def fake_id(*parts):
+    """A UUID-shaped ID derived from the lookup"""
+    value = f'{digest(*parts):032x}'[:32]
+    return f'{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}'
+
+
+def lucene_field(query, field):
+    """Pull one field out of a MusicBrainz Lucene query like artist:(x) recording:(y)"""
+    for name, value in re.findall(r'([\w-]+):\(((?:\\.|[^\\)])*)\)', query):
+        if name == field:
+            return re.sub(r'\\(.)', r'\1', value)
+    return ''
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        # TLS handshakes happen here, on the handler thread, not in the accept loop
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+        super().setup()
+
+    def do_GET(self):
+        self.handle_request(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        params = parse_qs(urlparse(self.path).query)
+        params.update(parse_qs(body))
+        self.handle_request(params)
+
+    def handle_request(self, params):
+        stubs = self.server.stubs
+        path = urlparse(self.path).path
+        params = {key: values[-1] for key, values in params.items()}
+        service = stubs.service_for(path)
+        stubs.count(service)
+
+        if service != 'navidrome':
+            stubs.delay()
+            if stubs.should_fail():
+                stubs.count(f'{service}_throttled')
+                return self.send(503, 'text/plain', 'Service busy', {'Retry-After': '1'})
+
+        try:
+            status, content_type, body = getattr(stubs, service)(path, params)
+        except Exception as e:
+            status, content_type, body = 500, 'text/plain', str(e)
+        self.send(status, content_type, body)
+
+    def send(self, status, content_type, body, headers=None):
+        data = body.encode() if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubServers:
+    """Answer the enhancer's provider APIs and the downloader's Navidrome scans.
+
+    One handler serves every service, picked by path: /ws/2 is MusicBrainz,
+    /v1 and /api/token Spotify, /2.0 Last.fm and /rest the Subsonic API.
+    Provider requests wait `latency_ms` (plus up to `jitter_ms`), fail with
+    503 at `error_rate` and find nothing at `miss_rate`. A Navidrome scan
+    reports itself busy for `scan_seconds`.
+    """
+
+    def __init__(self, latency_ms=50, jitter_ms=20, error_rate=0.0, miss_rate=0.1, scan_seconds=1.0):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.miss_rate = miss_rate
+        self.scan_seconds = scan_seconds
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._scan_until = 0
+        self._servers = []
+
+    def start(self, port=0, certificate=None):
+        """Serve on 127.0.0.1, over TLS when given a (cert, key) pair; returns the base URL"""
+        server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+        server.daemon_threads = True
+        server.stubs = self
+        scheme = 'http'
+        if certificate:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*certificate)
+            server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+            scheme = 'https'
+        threading.Thread(target=server.serve_forever, name='stub-server', daemon=True).start()
+        self._servers.append(server)
+        return f'{scheme}://127.0.0.1:{server.server_address[1]}'
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+    def service_for(self, path):
+        if path.startswith('/ws/2/'):
+            return 'musicbrainz'
+        if path.startswith('/v1/') or path == '/api/token':
+            return 'spotify'
+        if path.startswith('/2.0'):
+            return 'lastfm'
+        if path.startswith('/rest/'):
+            return 'navidrome'
+        return 'unknown'
+
+    def count(self, name):
+        with self._lock:
+            self.requests[name] += 1
+
+    def delay(self):
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def should_fail(self):
+        return random.random() < self.error_rate
+
+    def missing(self, *parts):
+        """Whether this lookup is one the provider doesn't know"""
+        return digest('miss', *parts) % 1000 < self.miss_rate * 1000
+
+    def unknown(self, path, params):
+        return 404, 'text/plain', 'Not found'
+
+    def musicbrainz(self, path, params):
+        """search_recordings and get_recording_by_id, in MusicBrainz XML"""
+        if path.rstrip('/') == '/ws/2/recording':
+            query = params.get('query', '')
+            artist, title = lucene_field(query, 'artist'), lucene_field(query, 'recording')
+            if self.missing(artist, title):
+                recordings = ''
+            else:
+                recordings = self._mb_recording(fake_id('recording', artist, title), artist, title)
+            count = 1 if recordings else 0
+            body = f'<recording-list count="{count}" offset="0">{recordings}</recording-list>'
+        else:
+            recording_id = path.rstrip('/').rsplit('/', 1)[-1]
+            number = digest(recording_id)
+            release = (
+                f'<release-list count="1"><release id="{fake_id("release", recording_id)}">'
+                f'<title>Bench Album {number % 200}</title><date>{1970 + number % 55}</date>'
+                f'<country>GB</country></release></release-list>'
+            )
+            tags = ''.join(
+                f'<tag count="{number % 7 + 1}"><name>{GENRES[(number >> shift) % len(GENRES)]}</name></tag>'
+                for shift in (0, 8)
+            )
+            body = self._mb_recording(
+                recording_id, 'Bench Artist', 'Bench Track', extra=release + f'<tag-list>{tags}</tag-list>'
+            )
+        return 200, 'application/xml', f'<?xml version="1.0" encoding="UTF-8"?><metadata xmlns="{MB_NAMESPACE}">{body}</metadata>'
+
+    def _mb_recording(self, recording_id, artist, title, extra=''):
+        return (
+            f'<recording id="{recording_id}"><title>{escape(title)}</title>'
+            f'<length>{180000 + digest(recording_id) % 120000}</length>'
+            f'<artist-credit><name-credit><artist id="{fake_id("artist", artist)}">'
+            f'<name>{escape(artist)}</name><sort-name>{escape(artist)}</sort-name></artist>'
+            f'</name-credit></artist-credit>{extra}</recording>'
+        )
+
+    def spotify(self, path, params):
+        """Client credentials token, track search, audio features and artists, in Spotify JSON"""
+        path = path.rstrip('/')
+        if path == '/api/token':
+            body = {'access_token': 'bench-token', 'token_type': 'Bearer', 'expires_in': 3600}
+        elif path == '/v1/search':
+            query = params.get('q', '')
+            artist = query.partition('artist:')[2].partition(' track:')[0]
+            title = query.partition(' track:')[2]
+            items = [] if self.missing(artist, title) else [self._spotify_track(artist, title)]
+            body = {'tracks': {'items': items, 'total': len(items)}}
+        elif path == '/v1/audio-features':
+            body = {'audio_features': [self._audio_features(track_id) for track_id in params.get('ids', '').split(',')]}
+        elif path == '/v1/artists':
+            body = {'artists': [
+                {'id': artist_id, 'genres': [GENRES[digest(artist_id) % len(GENRES)]]}
+                for artist_id in params.get('ids', '').split(',')
+            ]}
+        else:
+            return 404, 'application/json', json.dumps({'error': {'status': 404, 'message': 'Not found'}})
+        return 200, 'application/json', json.dumps(body)
+
+    def _spotify_track(self, artist, title):
+        number = digest(artist, title)
+        track_id = f'{number:022x}'[:22]
+        return {
+            'id': track_id,
+            'name': title,
+            'popularity': number % 100,
+            'duration_ms': 180000 + number % 120000,
+            'explicit': bool(number % 2),
+            'album': {'name': f'Bench Album {number % 200}', 'release_date': f'{1970 + number % 55}-01-01'},
+            'artists': [{'id': f'{digest(artist):022x}'[:22], 'name': artist}],
+        }
+
+    def _audio_features(self, track_id):
+        number = digest(track_id)
+        return {
+            'id': track_id,
+            'danceability': number % 100 / 100,
+            'energy': (number >> 8) % 100 / 100,
+            'valence': (number >> 16) % 100 / 100,
+            'tempo': 60 + number % 120,
+            'key': number % 12,
+            'mode': number % 2,
+            'acousticness': (number >> 24) % 100 / 100,
+            'instrumentalness': (number >> 32) % 100 / 100,
+            'speechiness': (number >> 40) % 100 / 100,
+        }
+
+    def lastfm(self, path, params):
+        """track.getInfo, getTopTags and getSimilar, in Last.fm XML"""
+        method = params.get('method', '')
+        artist, title = params.get('artist', ''), params.get('track', '')
+        if self.missing(artist, title):
+            return 200, 'text/xml', '<?xml version="1.0"?><lfm status="failed"><error code="6">Track not found</error></lfm>'
+
+        number = digest(artist, title)
+        if method == 'track.getInfo':
+            body = (
+                f'<track><name>{escape(title)}</name><listeners>{number % 100000}</listeners>'
+                f'<playcount>{number % 1000000}</playcount><artist><name>{escape(artist)}</name></artist></track>'
+            )
+        elif method == 'track.getTopTags':
+            body = '<toptags>' + ''.join(
+                f'<tag><name>{GENRES[(number >> shift) % len(GENRES)]}</name><count>{100 - shift}</count></tag>'
+                for shift in range(0, 40, 4)
+            ) + '</toptags>'
+        elif method == 'track.getSimilar':
+            body = '<similartracks>' + ''.join(
+                f'<track><name>Similar Track {(number >> shift) % 1000}</name><match>0.{9 - index}</match>'
+                f'<artist><name>Bench Artist {(number >> shift) % 50:02d}</name></artist></track>'
+                for index, shift in enumerate(range(0, 25, 5))
+            ) + '</similartracks>'
+        else:
+            return 200, 'text/xml', '<?xml version="1.0"?><lfm status="failed"><error code="3">Invalid method</error></lfm>'
+        return 200, 'text/xml', f'<?xml version="1.0" encoding="utf-8"?><lfm status="ok">{body}</lfm>'
+
+    def navidrome(self, path, params):
+        """ping, startScan and getScanStatus of the Subsonic API"""
+        method = path.rsplit('/', 1)[-1].replace('.view', '')
+        with self._lock:
+            if method == 'startScan':
+                self._scan_until = time.monotonic() + self.scan_seconds
+                self.requests['navidrome_scans'] += 1
+            scanning = time.monotonic() < self._scan_until
+        body = {'status': 'ok', 'version': '1.16.1'}
+        if method in ('startScan', 'getScanStatus'):
+            body['scanStatus'] = {'scanning': scanning, 'count': 0}
+        return 200, 'application/json', json.dumps({'subsonic-response': body})
@@ -12,6 +12,10 @@ DOWNLOAD_DIR="/home/pi/music"
 QUALITY="${2:-best}"
 FORMAT="${3:-mp3}"
 LOG_FILE="/tmp/download.log"
+# Shared with the web interface (mounted there as /downloads)
+ARCHIVE_DB="$DOWNLOAD_DIR/.download-archive.db"
+# Library scans are coalesced by the web interface
+SCAN_API_URL="${SCAN_API_URL:-http://localhost:8080/api/scan}"
 
 # Colors for output
 RED='\033[0;31m'
@@ -37,6 +41,20 @@ print_error() {
     echo -e "${RED}[ERROR]${NC} $1"
 }
 
+# Ask the web interface for a library scan, so it is folded into its next
+# scan window; scan directly only when the web interface isn't running
+request_library_scan() {
+    print_status "Requesting library scan..."
+    if curl -fsS -X POST -H 'Content-Type: application/json' \
+            -d '{"source": "download_music.sh"}' "$SCAN_API_URL" >/dev/null 2>&1; then
+        print_success "Library scan scheduled"
+    elif docker exec navidrome /app/navidrome --configfile /data/navidrome.toml scan >/dev/null 2>&1; then
+        print_success "Library scan completed"
+    else
+        print_warning "Library scan failed (Navidrome may not be running)"
+    fi
+}
+
 # Function to validate YouTube URL
 validate_url() {
     local url="$1"
@@ -48,10 +66,81 @@ validate_url() {
     fi
 }
 
+# Download archive helpers (same schema as web/archive.py). Paths are stored
+# relative to the library, which the web interface sees at another mount
+sql_escape() {
+    printf '%s' "$1" | sed "s/'/''/g"
+}
+
+archive_available() {
+    command -v sqlite3 &> /dev/null
+}
+
+archive_init() {
+    sqlite3 "$ARCHIVE_DB" "CREATE TABLE IF NOT EXISTS archive (
+        video_id TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        format TEXT,
+        title TEXT,
+        added_at REAL NOT NULL
+    );" > /dev/null
+    # Entries from before paths were relative, written under this mount
+    local prefix
+    prefix=$(sql_escape "$DOWNLOAD_DIR/")
+    sqlite3 "$ARCHIVE_DB" "UPDATE archive SET path = substr(path, length('$prefix') + 1)
+        WHERE substr(path, 1, length('$prefix')) = '$prefix';" > /dev/null
+}
+
+# File extension yt-dlp gives an --audio-format (same map as web/archive.py)
+format_extension() {
+    case "$1" in
+        vorbis) echo ogg ;;
+        aac|alac) echo m4a ;;
+        *) echo "$1" ;;
+    esac
+}
+
+# Print the archived file of a video if it still exists in the requested format
+archive_lookup() {
+    local video_id
+    video_id=$(sql_escape "$1")
+    local format
+    format=$(sql_escape "$(format_extension "$FORMAT")")
+    local path
+    path=$(sqlite3 "$ARCHIVE_DB" "SELECT path FROM archive WHERE video_id = '$video_id'
+        AND ('$format' IN ('best', 'native') OR format = '$format');")
+    
+    if [ -n "$path" ] && [ -f "$DOWNLOAD_DIR/$path" ]; then
+        echo "$DOWNLOAD_DIR/$path"
+        return 0
+    fi
+    return 1
+}
+
+# Record the files listed by yt-dlp --print-to-file (id, path, title; tab separated)
+archive_record() {
+    local list_file="$1"
+    [ -f "$list_file" ] || return 0
+    
+    while IFS=$'\t' read -r video_id filepath title; do
+        [ -z "$video_id" ] && continue
+        sqlite3 "$ARCHIVE_DB" "INSERT OR REPLACE INTO archive (video_id, path, format, title, added_at)
+            VALUES ('$(sql_escape "$video_id")', '$(sql_escape "${filepath#"$DOWNLOAD_DIR"/}")',
+                    '$(sql_escape "${filepath##*.}")', '$(sql_escape "$title")', strftime('%s', 'now'));"
+    done < "$list_file"
+}
+
+extract_video_id() {
+    echo "$1" | sed -nE 's#.*(v=|youtu\.be/|shorts/)([A-Za-z0-9_-]{11}).*#\2#p'
+}
+
 # Function to download video/playlist
 download_content() {
     local url="$1"
     local output_template="$DOWNLOAD_DIR/%(uploader)s/%(title)s.%(ext)s"
+    local targets=("$url")
+    local record_file
+    record_file=$(mktemp)
     
     print_status "Starting download..."
     print_status "URL: $url"
@@ -59,11 +148,61 @@ download_content() {
     print_status "Output: $DOWNLOAD_DIR"
     echo
     
+    # Skip anything that is already in the library
+    if archive_available; then
+        archive_init
+        
+        if [[ $url == *"playlist"* ]]; then
+            print_status "Checking playlist against the download archive..."
+            local missing=()
+            local skipped=0
+            while read -r video_id; do
+                [ -z "$video_id" ] && continue
+                if archive_lookup "$video_id" > /dev/null; then
+                    skipped=$((skipped + 1))
+                else
+                    missing+=("https://www.youtube.com/watch?v=$video_id")
+                fi
+            done < <(yt-dlp --flat-playlist --no-warnings --print id "$url")
+            
+            print_status "$skipped tracks already downloaded, ${#missing[@]} to fetch"
+            if [ ${#missing[@]} -eq 0 ]; then
+                print_success "Nothing new to download"
+                return 0
+            fi
+            targets=("${missing[@]}")
+        else
+            local archived
+            if archived=$(archive_lookup "$(extract_video_id "$url")"); then
+                print_success "Already downloaded: $archived"
+                return 0
+            fi
+        fi
+    else
+        print_warning "sqlite3 not found, download archive disabled"
+    fi
+    
+    # Prefer a stream already in the requested codec, which yt-dlp copies
+    # instead of re-encoding; best/native keeps whatever YouTube serves
+    local audio_args=()
+    case "$FORMAT" in
+        best|native) audio_args=(-f 'bestaudio/best' --audio-format best) ;;
+        opus) audio_args=(-f 'bestaudio[acodec=opus]/bestaudio/best' --audio-format opus) ;;
+        vorbis) audio_args=(-f 'bestaudio[acodec=vorbis]/bestaudio/best' --audio-format vorbis) ;;
+        m4a|aac) audio_args=(-f 'bestaudio[ext=m4a]/bestaudio/best' --audio-format "$FORMAT") ;;
+        *) audio_args=(-f 'bestaudio/best' --audio-format "$FORMAT") ;;
+    esac
+    if [ "$QUALITY" = "best" ]; then
+        audio_args+=(--audio-quality 0)
+    else
+        audio_args+=(--audio-quality "$QUALITY")
+    fi
+    
     # Execute yt-dlp with progress
+    local exit_code=0
     yt-dlp \
         --extract-audio \
-        --audio-format "$FORMAT" \
-        --audio-quality "$QUALITY" \
+        "${audio_args[@]}" \
         --embed-metadata \
         --embed-thumbnail \
         --add-metadata \
@@ -71,22 +210,22 @@ download_content() {
         --no-warnings \
         --progress \
         --newline \
+        --print-to-file $'after_move:%(id)s\t%(filepath)s\t%(title)s' "$record_file" \
         -o "$output_template" \
-        "$url"
+        "${targets[@]}" || exit_code=$?
     
-    local exit_code=$?
     echo
     
+    # Keep whatever finished, even if some videos failed
+    if archive_available; then
+        archive_record "$record_file"
+    fi
+    rm -f "$record_file"
+    
     if [ $exit_code -eq 0 ]; then
         print_success "Download completed successfully!"
         
-        # Trigger Navidrome library scan
-        print_status "Triggering library scan..."
-        if docker exec navidrome /app/navidrome --configfile /data/navidrome.toml scan >/dev/null 2>&1; then
-            print_success "Library scan completed"
-        else
-            print_warning "Library scan failed (Navidrome may not be running)"
-        fi
+        request_library_scan
         
         return 0
     else
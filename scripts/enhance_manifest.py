@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Enhancer File Manifest
+Remembers which music files enhance_metadata.py has already processed
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    processed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+# Custom tag written by the enhancer
+ENHANCED_MARKER = b'ENHANCED_METADATA'
+
+FLAC_VORBIS_COMMENT = 4
+MAX_MOOV_READ = 16 * 1024 * 1024
+OGG_HEAD_READ = 64 * 1024
+
+
+def read_id3_tag(filepath):
+    """Return the raw ID3v2 tag at the start of a file, or b'' if there is none"""
+    with open(filepath, 'rb') as f:
+        header = f.read(10)
+        if len(header) < 10 or header[:3] != b'ID3':
+            return b''
+        # The tag size is a 28-bit syncsafe integer
+        size = 0
+        for byte in header[6:10]:
+            size = (size << 7) | (byte & 0x7f)
+        return f.read(size)
+
+
+def read_flac_comments(filepath):
+    """Return the raw Vorbis comment block of a FLAC file, or b''"""
+    with open(filepath, 'rb') as f:
+        if f.read(4) != b'fLaC':
+            return b''
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return b''
+            last, block_type = header[0] & 0x80, header[0] & 0x7f
+            length = int.from_bytes(header[1:4], 'big')
+            if block_type == FLAC_VORBIS_COMMENT:
+                return f.read(length)
+            if last:
+                return b''
+            f.seek(length, os.SEEK_CUR)
+
+
+def read_mp4_moov(filepath):
+    """Return the moov atom (where iTunes tags live) of an MP4 file, or b''"""
+    with open(filepath, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return b''
+            size, kind = int.from_bytes(header[:4], 'big'), header[4:]
+            header_size = 8
+            if size == 1:
+                size = int.from_bytes(f.read(8), 'big')
+                header_size = 16
+            if kind == b'moov':
+                return f.read(min(size - header_size, MAX_MOOV_READ)) if size else f.read(MAX_MOOV_READ)
+            if size < header_size:
+                return b''
+            f.seek(size - header_size, os.SEEK_CUR)
+
+
+def read_ogg_head(filepath):
+    """Return the first pages of an Ogg file, which hold the comment header"""
+    with open(filepath, 'rb') as f:
+        return f.read(OGG_HEAD_READ)
+
+
+def has_enhanced_tag(filepath):
+    """Whether a file already carries the ENHANCED_METADATA tag.
+
+    Only the tag header is read, the audio data and frames are never parsed.
+    """
+    readers = {
+        '.mp3': read_id3_tag,
+        '.flac': read_flac_comments,
+        '.m4a': read_mp4_moov,
+        '.ogg': read_ogg_head,
+    }
+    reader = readers.get(os.path.splitext(filepath)[1].lower())
+    try:
+        return bool(reader) and ENHANCED_MARKER in reader(filepath)
+    except OSError:
+        return False
+
+
+class FileManifest:
+    """Processed files keyed by path, with the size and mtime they had then.
+
+    A file whose size and mtime still match its entry hasn't changed since it
+    was enhanced and can be skipped without being opened.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def unchanged(self, path, stat):
+        """Whether the file is recorded with this exact size and mtime"""
+        row = self._connection().execute(
+            'SELECT size, mtime_ns FROM files WHERE path = ?', (path,)
+        ).fetchone()
+        return row is not None and row == (stat.st_size, stat.st_mtime_ns)
+
+    def record(self, path, stat=None):
+        """Remember a file as processed in its current state"""
+        stat = stat or os.stat(path)
+        self._connection().execute(
+            'INSERT OR REPLACE INTO files (path, size, mtime_ns, processed_at) VALUES (?, ?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime_ns, time.time())
+        )
+
+    def forget(self, path):
+        """Drop a file so the next run processes it again"""
+        self._connection().execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def last_run(self):
+        """Start time of the last run that finished, or None"""
+        row = self._connection().execute(
+            "SELECT value FROM runs WHERE name = 'last_run'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def finish_run(self, started_at):
+        """Record a completed run that started at started_at"""
+        self._connection().execute(
+            "INSERT OR REPLACE INTO runs (name, value) VALUES ('last_run', ?)", (started_at,)
+        )
+
+    def count(self):
+        """Number of files in the manifest"""
+        return self._connection().execute('SELECT COUNT(*) FROM files').fetchone()[0]
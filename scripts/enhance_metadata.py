@@ -6,25 +6,185 @@ Uses MusicBrainz, Spotify API, and Last.fm for comprehensive metadata
 
 import os
 import sys
-import json
+import argparse
+import re
+import multiprocessing
+import queue
+import random
+import threading
+import time
 import requests
-import mutagen
-from mutagen.id3 import ID3, TALB, TIT2, TPE1, TPE2, TDRC, TCON, APIC
-from mutagen.mp3 import MP3
 import musicbrainzngs
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
 import pylast
 import logging
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+from lookup_cache import LookupCache
+from enhance_manifest import FileManifest, has_enhanced_tag
+from tag_writer import DEFAULT_PADDING, write_tags
+from enhance_metrics import ProviderMetrics
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Requests per second allowed per provider (MusicBrainz asks for at most 1)
+DEFAULT_RATE_LIMITS = {
+    'musicbrainz': 1.0,
+    'spotify': 10.0,
+    'lastfm': 5.0,
+}
+
+# HTTP statuses that mean "slow down", and the Last.fm error codes for the same
+RETRY_HTTP_STATUSES = (429, 503)
+RETRY_LASTFM_CODES = ('11', '16', '29')
+LASTFM_NOT_FOUND = '6'
+
+# Most IDs Spotify accepts per audio-features and artists request
+SPOTIFY_FEATURES_BATCH = 100
+SPOTIFY_ARTISTS_BATCH = 50
+
+MUSIC_EXTENSIONS = ('.mp3', '.m4a', '.flac', '.ogg')
+
+# Seconds to wait for more scanned files before looking up a partial batch
+BATCH_WAIT = 0.5
+
+# Providers in the order their answers are merged; later ones win
+PROVIDERS = (
+    ('musicbrainz', 'ENABLE_MUSICBRAINZ_LOOKUP'),
+    ('spotify', 'ENABLE_SPOTIFY_METADATA'),
+    ('lastfm', 'ENABLE_LASTFM_METADATA'),
+)
+
+class RateLimiter:
+    """Token bucket shared by every thread calling one provider"""
+    
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+    
+    def backoff(self, seconds):
+        """Hold back every caller of this provider for a while"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+def retry_delay(error):
+    """Return the server-requested delay for a throttling error, 0 if none was given, or None"""
+    status = getattr(error, 'http_status', None)  # spotipy
+    headers = getattr(error, 'headers', None) or {}
+    if status is None:
+        cause = getattr(error, 'cause', None)  # musicbrainzngs
+        status = getattr(cause, 'code', None)
+        headers = getattr(cause, 'headers', None) or headers
+    if status is None:
+        response = getattr(error, 'response', None)  # requests
+        status = getattr(response, 'status_code', None)
+        headers = getattr(response, 'headers', None) or headers
+    
+    if status in RETRY_HTTP_STATUSES:
+        try:
+            return float(headers.get('Retry-After', 0))
+        except (TypeError, ValueError):
+            return 0
+    if isinstance(error, pylast.WSError) and error.status in RETRY_LASTFM_CODES:
+        return 0
+    return None
+
+def error_cause(error, delay=None):
+    """Short cause of a failed provider request for the error metrics"""
+    if delay is not None:
+        return 'throttled'
+    if isinstance(error, pylast.WSError) and error.status == LASTFM_NOT_FOUND:
+        return 'not_found'
+    if 'timeout' in type(error).__name__.lower():
+        return 'timeout'
+    if isinstance(error, (requests.ConnectionError, ConnectionError)):
+        return 'connection'
+    return 'error'
+
+def scan_music_files(directory):
+    """Yield (path, stat) of the music files below a directory as they are found"""
+    pending = [directory]
+    while pending:
+        path = pending.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            # Hidden dirs hold downloads still being processed (.staging)
+                            if not entry.name.startswith('.'):
+                                pending.append(entry.path)
+                        elif entry.name.lower().endswith(MUSIC_EXTENSIONS):
+                            yield entry.path, entry.stat()
+                    except OSError as e:
+                        logger.error(f"Error reading {entry.path}: {e}")
+        except OSError as e:
+            logger.error(f"Error scanning {path}: {e}")
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most size items"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def parse_since(value):
+    """Parse --since as a duration (30m, 12h, 7d) or an ISO date into a timestamp"""
+    match = re.fullmatch(r'(\d+)([mhd])', value.strip())
+    if match:
+        seconds = int(match.group(1)) * {'m': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+        return time.time() - seconds
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a duration like 12h/7d or an ISO date, got {value!r}")
+
+def changed_at(stat):
+    """When a file last changed; ctime too, as yt-dlp backdates mtime to the upload date"""
+    return max(stat.st_mtime, stat.st_ctime)
+
 class MetadataEnhancer:
-    def __init__(self, config_path="/app/config/config.env"):
+    def __init__(self, config_path="/app/config/config.env", force=False, dry_run=False, jobs=None):
         self.config = self.load_config(config_path)
+        self.force = force
+        self.dry_run = dry_run
+        self.jobs = jobs or int(self.config.get('ENHANCE_JOBS', os.cpu_count() or 1))
+        self.tag_padding = int(self.config.get('TAG_PADDING', DEFAULT_PADDING))
+        self.max_retries = int(self.config.get('LOOKUP_MAX_RETRIES', '4'))
+        self.workers = int(self.config.get('LOOKUP_WORKERS', '4'))
+        self.batch_size = min(int(self.config.get('SPOTIFY_BATCH_SIZE', SPOTIFY_FEATURES_BATCH)), SPOTIFY_FEATURES_BATCH)
+        self.limiters = {
+            provider: RateLimiter(float(self.config.get(f'{provider.upper()}_RATE_LIMIT', rate)))
+            for provider, rate in DEFAULT_RATE_LIMITS.items()
+        }
+        self.cache = self.setup_cache()
+        self.manifest = self.setup_manifest()
+        self.metrics = ProviderMetrics()
+        self.metrics_path = self.config.get('ENHANCER_METRICS_PATH', '/app/config/enhancer.prom')
+        # Provider lookups of all files in flight share this pool
+        self.lookup_pool = ThreadPoolExecutor(
+            max_workers=len(self.limiters) * self.workers,
+            thread_name_prefix='lookup'
+        )
         self.setup_apis()
     
     def load_config(self, config_path):
@@ -40,11 +200,38 @@ class MetadataEnhancer:
             logger.warning(f"Config file not found: {config_path}")
         return config
     
+    def setup_cache(self):
+        """Open the on-disk lookup cache, or run without one if it can't be opened"""
+        try:
+            return LookupCache(
+                self.config.get('LOOKUP_CACHE_PATH', '/app/config/metadata_cache.db'),
+                ttl_days=float(self.config.get('LOOKUP_CACHE_TTL_DAYS', '30')),
+                negative_ttl_days=float(self.config.get('LOOKUP_CACHE_NEGATIVE_TTL_DAYS', '7')),
+                max_entries=int(self.config.get('LOOKUP_CACHE_MAX_ENTRIES', '100000'))
+            )
+        except Exception as e:
+            logger.warning(f"Lookup cache unavailable, every lookup goes to the network: {e}")
+            return None
+    
+    def setup_manifest(self):
+        """Open the manifest of processed files, or run without one if it can't be opened"""
+        try:
+            return FileManifest(self.config.get('ENHANCE_MANIFEST_PATH', '/app/config/enhance_manifest.db'))
+        except Exception as e:
+            logger.warning(f"File manifest unavailable, every file will be checked: {e}")
+            return None
+    
     def setup_apis(self):
         """Initialize API connections"""
         try:
             # MusicBrainz setup
             musicbrainzngs.set_useragent("MusicServer", "2.0", "your-email@example.com")
+            # Throttling is done by our own limiter so it holds across threads
+            musicbrainzngs.set_rate_limit(False)
+            musicbrainz_url = self.config.get('MUSICBRAINZ_URL')
+            if musicbrainz_url:
+                parsed = urlparse(musicbrainz_url)
+                musicbrainzngs.set_hostname(parsed.netloc, use_https=parsed.scheme == 'https')
             
             # Spotify setup (requires API keys)
             spotify_client_id = self.config.get('SPOTIFY_CLIENT_ID')
@@ -55,7 +242,15 @@ class MetadataEnhancer:
                     client_id=spotify_client_id,
                     client_secret=spotify_client_secret
                 )
-                self.spotify = spotipy.Spotify(client_credentials_manager=client_credentials_manager)
+                if self.config.get('SPOTIFY_TOKEN_URL'):
+                    client_credentials_manager.OAUTH_TOKEN_URL = self.config['SPOTIFY_TOKEN_URL']
+                # Leave 429 handling to call_provider so the limiter sees it
+                self.spotify = spotipy.Spotify(
+                    client_credentials_manager=client_credentials_manager,
+                    status_retries=0
+                )
+                if self.config.get('SPOTIFY_API_URL'):
+                    self.spotify.prefix = self.config['SPOTIFY_API_URL'].rstrip('/') + '/'
             else:
                 self.spotify = None
                 logger.warning("Spotify API credentials not found")
@@ -64,6 +259,11 @@ class MetadataEnhancer:
             lastfm_api_key = self.config.get('LASTFM_API_KEY')
             if lastfm_api_key:
                 self.lastfm = pylast.LastFMNetwork(api_key=lastfm_api_key)
+                lastfm_url = self.config.get('LASTFM_API_URL')
+                if lastfm_url:
+                    # pylast always speaks HTTPS; only the host and path can change
+                    parsed = urlparse(lastfm_url)
+                    self.lastfm.ws_server = (parsed.netloc, parsed.path or '/2.0/')
             else:
                 self.lastfm = None
                 logger.warning("Last.fm API key not found")
@@ -71,6 +271,41 @@ class MetadataEnhancer:
         except Exception as e:
             logger.error(f"Error setting up APIs: {e}")
     
+    def call_provider(self, provider, func, *args, **kwargs):
+        """Call a provider API within its rate limit, backing off when throttled"""
+        limiter = self.limiters[provider]
+        for attempt in range(self.max_retries + 1):
+            limiter.acquire()
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = retry_delay(e)
+                self.metrics.error(provider, error_cause(e, delay))
+                if delay is None or attempt == self.max_retries:
+                    raise
+                # Exponential backoff with jitter unless the server named a delay
+                delay = delay or (2 ** attempt) + random.uniform(0, 1)
+                logger.warning(f"{provider} throttled, retrying in {delay:.1f}s")
+                limiter.backoff(delay)
+            finally:
+                self.metrics.observe(provider, time.monotonic() - started)
+    
+    def cached_lookup(self, provider, lookup, artist, title):
+        """Answer a provider lookup from the cache, querying the provider on a miss"""
+        if self.cache:
+            cached = self.cache.get(provider, artist, title)
+            if cached is not None:
+                return cached
+        
+        result = lookup(artist, title)
+        if result is None:
+            # The lookup failed; try again next run instead of caching it
+            return {}
+        if self.cache:
+            self.cache.put(provider, artist, title, result)
+        return result
+    
     def extract_youtube_metadata(self, filename):
         """Extract basic metadata from YouTube filename"""
         # Parse common YouTube filename patterns
@@ -84,7 +319,6 @@ class MetadataEnhancer:
         ]
         
         for pattern in patterns:
-            import re
             match = re.match(pattern, basename)
             if match:
                 return {
@@ -95,10 +329,12 @@ class MetadataEnhancer:
         return {'title': basename, 'artist': 'Unknown Artist'}
     
     def enhance_with_musicbrainz(self, artist, title):
-        """Get enhanced metadata from MusicBrainz"""
+        """Get enhanced metadata from MusicBrainz ({} if unknown, None if the lookup failed)"""
         try:
             # Search for recording
-            result = musicbrainzngs.search_recordings(
+            result = self.call_provider(
+                'musicbrainz',
+                musicbrainzngs.search_recordings,
                 artist=artist, 
                 recording=title, 
                 limit=1
@@ -109,8 +345,10 @@ class MetadataEnhancer:
                 
                 # Get additional details
                 recording_id = recording['id']
-                detailed = musicbrainzngs.get_recording_by_id(
-                    recording_id, 
+                detailed = self.call_provider(
+                    'musicbrainz',
+                    musicbrainzngs.get_recording_by_id,
+                    recording_id,
                     includes=['artists', 'releases', 'tags']
                 )
                 
@@ -134,188 +372,380 @@ class MetadataEnhancer:
                 
         except Exception as e:
             logger.warning(f"MusicBrainz lookup failed: {e}")
+            return None
         
         return {}
     
     def enhance_with_spotify(self, artist, title):
-        """Get enhanced metadata from Spotify"""
+        """Get enhanced metadata from Spotify ({} if unknown, None if the lookup failed)"""
+        track = self.search_spotify(artist, title)
+        if not track:
+            return track
+        return self.fetch_spotify_details([track])[0]
+    
+    def search_spotify(self, artist, title):
+        """Find the Spotify track for a file ({} if unknown, None if the search failed)"""
         if not self.spotify:
-            return {}
+            return None
         
         try:
-            # Search for track
             query = f"artist:{artist} track:{title}"
-            results = self.spotify.search(q=query, type='track', limit=1)
-            
+            results = self.call_provider('spotify', self.spotify.search, q=query, type='track', limit=1)
             if results['tracks']['items']:
-                track = results['tracks']['items'][0]
-                
-                # Get audio features
-                audio_features = self.spotify.audio_features(track['id'])[0]
-                
-                metadata = {
-                    'spotify_id': track['id'],
-                    'popularity': track['popularity'],
-                    'album': track['album']['name'],
-                    'release_date': track['album']['release_date'],
-                    'genres': track['artists'][0].get('genres', []),
-                    'duration_ms': track['duration_ms'],
-                    'explicit': track['explicit']
-                }
-                
-                # Add audio features
-                if audio_features:
-                    metadata.update({
-                        'danceability': audio_features['danceability'],
-                        'energy': audio_features['energy'],
-                        'valence': audio_features['valence'],
-                        'tempo': audio_features['tempo'],
-                        'key': audio_features['key'],
-                        'mode': audio_features['mode'],
-                        'acousticness': audio_features['acousticness'],
-                        'instrumentalness': audio_features['instrumentalness'],
-                        'speechiness': audio_features['speechiness']
-                    })
-                
-                return metadata
-                
+                return results['tracks']['items'][0]
         except Exception as e:
             logger.warning(f"Spotify lookup failed: {e}")
+            return None
         
         return {}
     
+    def fetch_spotify_details(self, tracks):
+        """Fetch audio features and artist genres for many tracks in batched requests.
+        
+        Returns the metadata of each track in order, or None for every track
+        if the requests failed.
+        """
+        try:
+            features = {}
+            track_ids = [track['id'] for track in tracks]
+            for chunk in chunked(track_ids, SPOTIFY_FEATURES_BATCH):
+                for item in self.call_provider('spotify', self.spotify.audio_features, chunk) or []:
+                    if item:
+                        features[item['id']] = item
+            
+            # Search results only carry simplified artists, without genres
+            artists = {}
+            artist_ids = list(dict.fromkeys(track['artists'][0]['id'] for track in tracks if track['artists']))
+            for chunk in chunked(artist_ids, SPOTIFY_ARTISTS_BATCH):
+                for item in self.call_provider('spotify', self.spotify.artists, chunk)['artists']:
+                    if item:
+                        artists[item['id']] = item
+        
+        except Exception as e:
+            logger.warning(f"Spotify lookup failed: {e}")
+            return [None] * len(tracks)
+        
+        return [
+            self.spotify_metadata(
+                track,
+                features.get(track['id']),
+                artists.get(track['artists'][0]['id']) if track['artists'] else None
+            )
+            for track in tracks
+        ]
+    
+    def spotify_metadata(self, track, audio_features, artist):
+        """Build the Spotify metadata of a track"""
+        metadata = {
+            'spotify_id': track['id'],
+            'popularity': track['popularity'],
+            'album': track['album']['name'],
+            'release_date': track['album']['release_date'],
+            'genres': (artist or {}).get('genres', []),
+            'duration_ms': track['duration_ms'],
+            'explicit': track['explicit']
+        }
+        
+        # Add audio features
+        if audio_features:
+            metadata.update({
+                'danceability': audio_features['danceability'],
+                'energy': audio_features['energy'],
+                'valence': audio_features['valence'],
+                'tempo': audio_features['tempo'],
+                'key': audio_features['key'],
+                'mode': audio_features['mode'],
+                'acousticness': audio_features['acousticness'],
+                'instrumentalness': audio_features['instrumentalness'],
+                'speechiness': audio_features['speechiness']
+            })
+        
+        return metadata
+    
     def enhance_with_lastfm(self, artist, title):
-        """Get enhanced metadata from Last.fm"""
+        """Get enhanced metadata from Last.fm ({} if unknown, None if the lookup failed)"""
         if not self.lastfm:
-            return {}
+            return None
         
         try:
             track = self.lastfm.get_track(artist, title)
             
             metadata = {
-                'lastfm_tags': [tag.item.get_name() for tag in track.get_top_tags(limit=10)],
-                'lastfm_listeners': track.get_listener_count(),
-                'lastfm_playcount': track.get_playcount(),
+                'lastfm_tags': [
+                    tag.item.get_name()
+                    for tag in self.call_provider('lastfm', track.get_top_tags, limit=10)
+                ],
+                'lastfm_listeners': self.call_provider('lastfm', track.get_listener_count),
+                'lastfm_playcount': self.call_provider('lastfm', track.get_playcount),
                 'lastfm_url': track.get_url()
             }
             
             # Get similar tracks
-            similar = track.get_similar(limit=5)
+            similar = self.call_provider('lastfm', track.get_similar, limit=5)
             metadata['similar_tracks'] = [
                 f"{s.item.artist} - {s.item.title}" for s in similar
             ]
             
             return metadata
             
+        except pylast.WSError as e:
+            if e.status == LASTFM_NOT_FOUND:
+                return {}
+            logger.warning(f"Last.fm lookup failed: {e}")
+            return None
         except Exception as e:
             logger.warning(f"Last.fm lookup failed: {e}")
-        
-        return {}
+            return None
     
     def write_enhanced_metadata(self, filepath, metadata):
         """Write enhanced metadata to music file"""
         try:
-            audio_file = MP3(filepath, ID3=ID3)
-            
-            # Add or update ID3 tags
-            if 'title' in metadata:
-                audio_file.tags.add(TIT2(encoding=3, text=metadata['title']))
-            
-            if 'artist' in metadata:
-                audio_file.tags.add(TPE1(encoding=3, text=metadata['artist']))
-            
-            if 'album' in metadata:
-                audio_file.tags.add(TALB(encoding=3, text=metadata['album']))
-            
-            if 'date' in metadata or 'release_date' in metadata:
-                year = metadata.get('date', metadata.get('release_date', ''))[:4]
-                if year:
-                    audio_file.tags.add(TDRC(encoding=3, text=year))
-            
-            # Add genre from tags or Spotify
-            genres = []
-            if 'tags' in metadata:
-                genres.extend(metadata['tags'][:3])  # Top 3 MusicBrainz tags
-            if 'genres' in metadata:
-                genres.extend(metadata['genres'][:2])  # Top 2 Spotify genres
-            if 'lastfm_tags' in metadata:
-                genres.extend(metadata['lastfm_tags'][:2])  # Top 2 Last.fm tags
-            
-            if genres:
-                audio_file.tags.add(TCON(encoding=3, text='; '.join(genres[:5])))
-            
-            # Save custom metadata as comments
-            custom_data = {
-                'enhanced_metadata': True,
-                'spotify_data': {k: v for k, v in metadata.items() if k.startswith('spotify_') or k in ['popularity', 'danceability', 'energy', 'valence']},
-                'lastfm_data': {k: v for k, v in metadata.items() if k.startswith('lastfm_')},
-                'musicbrainz_data': {k: v for k, v in metadata.items() if k in ['tags', 'duration']}
-            }
-            
-            # Store as JSON in a custom frame for later use by recommendation engine
-            from mutagen.id3 import TXXX
-            audio_file.tags.add(TXXX(encoding=3, desc='ENHANCED_METADATA', text=json.dumps(custom_data)))
-            
-            audio_file.save()
-            logger.info(f"Enhanced metadata written to: {filepath}")
+            changes = write_tags(filepath, metadata, dry_run=self.dry_run, padding=self.tag_padding)
+            self.report_changes(filepath, changes)
+            return True
             
         except Exception as e:
             logger.error(f"Error writing metadata to {filepath}: {e}")
+            return False
     
-    def process_file(self, filepath):
-        """Process a single music file"""
-        logger.info(f"Processing: {filepath}")
+    def report_changes(self, filepath, changes):
+        """Log the outcome of a tag write"""
+        if not changes:
+            logger.info(f"Tags already up to date: {filepath}")
+        elif self.dry_run:
+            for field, (old, new) in changes.items():
+                logger.info(f"Would change {field} of {filepath}: {old!r} -> {new!r}")
+        else:
+            logger.info(f"Enhanced metadata written to: {filepath}")
+    
+    def needs_processing(self, filepath, stat):
+        """Whether a file still has to be enhanced"""
+        if self.force:
+            return True
+        if self.manifest and self.manifest.unchanged(filepath, stat):
+            return False
+        # Enhanced before the manifest existed, or by another copy of the library
+        if has_enhanced_tag(filepath):
+            if self.manifest:
+                self.manifest.record(filepath, stat)
+            return False
+        return True
+    
+    def lookup_file(self, filepath, batch_spotify=False):
+        """Query the enabled providers for a file in parallel.
         
+        With batch_spotify a Spotify cache miss only runs the search; the
+        track is returned as spotify_track for fetch_spotify_details().
+        """
         # Extract basic info from filename
         basic_metadata = self.extract_youtube_metadata(filepath)
         artist = basic_metadata['artist']
         title = basic_metadata['title']
         
-        # Enhance with external APIs
-        enhanced_metadata = basic_metadata.copy()
-        
-        if self.config.get('ENABLE_MUSICBRAINZ_LOOKUP', 'true').lower() == 'true':
-            mb_data = self.enhance_with_musicbrainz(artist, title)
-            enhanced_metadata.update(mb_data)
+        entry = {'filepath': filepath, 'basic': basic_metadata, 'results': {}, 'spotify_track': None}
+        lookups = {}
+        for provider, setting in PROVIDERS:
+            if self.config.get(setting, 'true').lower() != 'true':
+                continue
+            if provider == 'spotify' and batch_spotify:
+                cached = self.cache.get(provider, artist, title) if self.cache else None
+                if cached is not None:
+                    entry['results'][provider] = cached
+                else:
+                    lookups[provider] = self.lookup_pool.submit(self.search_spotify, artist, title)
+                continue
+            lookup = getattr(self, f'enhance_with_{provider}')
+            lookups[provider] = self.lookup_pool.submit(self.cached_lookup, provider, lookup, artist, title)
         
-        if self.config.get('ENABLE_SPOTIFY_METADATA', 'true').lower() == 'true':
-            spotify_data = self.enhance_with_spotify(artist, title)
-            enhanced_metadata.update(spotify_data)
+        for provider, future in lookups.items():
+            entry['results'][provider] = future.result()
         
-        if self.config.get('ENABLE_LASTFM_METADATA', 'true').lower() == 'true':
-            lastfm_data = self.enhance_with_lastfm(artist, title)
-            enhanced_metadata.update(lastfm_data)
+        if batch_spotify and 'spotify' in lookups:
+            track = entry['results']['spotify']
+            if track:
+                entry['spotify_track'] = track
+                entry['results']['spotify'] = {}
+            elif track is None:
+                entry['results']['spotify'] = {}
+            elif self.cache:
+                self.cache.put('spotify', artist, title, {})
+        return entry
+    
+    def merge_metadata(self, entry):
+        """Merge a file's provider answers over its filename metadata"""
+        enhanced_metadata = entry['basic'].copy()
+        # Merge in provider order so later providers still win
+        for provider, _ in PROVIDERS:
+            enhanced_metadata.update(entry['results'].get(provider) or {})
+        return enhanced_metadata
+    
+    def process_file(self, filepath):
+        """Process a single music file"""
+        logger.info(f"Processing: {filepath}")
+        enhanced_metadata = self.merge_metadata(self.lookup_file(filepath))
         
         # Write enhanced metadata
-        self.write_enhanced_metadata(filepath, enhanced_metadata)
+        if self.write_enhanced_metadata(filepath, enhanced_metadata) and self.manifest and not self.dry_run:
+            self.manifest.record(filepath)
         
         return enhanced_metadata
     
-    def process_directory(self, directory):
-        """Process all music files in a directory"""
-        music_extensions = ['.mp3', '.m4a', '.flac', '.ogg']
+    def lookup_batch(self, filepaths, pool):
+        """Look up a batch of files, fetching their Spotify details in batched requests"""
+        entries = []
+        for filepath, future in [(path, pool.submit(self.lookup_file, path, True)) for path in filepaths]:
+            try:
+                entries.append(future.result())
+            except Exception as e:
+                logger.error(f"Error processing {filepath}: {e}")
         
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if any(file.lower().endswith(ext) for ext in music_extensions):
-                    filepath = os.path.join(root, file)
-                    try:
-                        self.process_file(filepath)
-                    except Exception as e:
-                        logger.error(f"Error processing {filepath}: {e}")
+        pending = [entry for entry in entries if entry['spotify_track']]
+        if pending:
+            details = self.fetch_spotify_details([entry['spotify_track'] for entry in pending])
+            for entry, metadata in zip(pending, details):
+                if metadata is None:
+                    continue
+                entry['results']['spotify'] = metadata
+                if self.cache:
+                    self.cache.put('spotify', entry['basic']['artist'], entry['basic']['title'], metadata)
+        return entries
+    
+    def submit_writes(self, entries, writer):
+        """Start writing the tags of looked-up files, in worker processes if there are any"""
+        writes = []
+        for entry in entries:
+            filepath, metadata = entry['filepath'], self.merge_metadata(entry)
+            if writer:
+                writes.append((filepath, writer.submit(write_tags, filepath, metadata, self.dry_run, self.tag_padding)))
+            elif self.write_enhanced_metadata(filepath, metadata):
+                writes.append((filepath, None))
+        return writes
+    
+    def finish_writes(self, writes):
+        """Wait for submitted tag writes and record the written files"""
+        for filepath, future in writes:
+            if future is not None:
+                try:
+                    self.report_changes(filepath, future.result())
+                except Exception as e:
+                    logger.error(f"Error writing metadata to {filepath}: {e}")
+                    continue
+            if self.manifest and not self.dry_run:
+                self.manifest.record(filepath)
+    
+    def scan_directory(self, directory, since, files, counts):
+        """Feed the files that need processing into a bounded queue, ending with None"""
+        try:
+            for filepath, stat in scan_music_files(directory):
+                if (since and changed_at(stat) < since) or not self.needs_processing(filepath, stat):
+                    counts['skipped'] += 1
+                    continue
+                files.put(filepath)
+        except Exception as e:
+            logger.error(f"Error scanning {directory}: {e}")
+        finally:
+            files.put(None)
+    
+    def next_batch(self, files):
+        """Take up to batch_size queued files; returns (batch, scan_finished).
+        
+        A partial batch is returned once the scanner falls behind, so
+        processing never waits for the scan to finish.
+        """
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                filepath = files.get(timeout=BATCH_WAIT if batch else None)
+            except queue.Empty:
+                return batch, False
+            if filepath is None:
+                return batch, True
+            batch.append(filepath)
+        return batch, False
+    
+    def process_directory(self, directory, since=None):
+        """Process the music files in a directory that changed since they were enhanced"""
+        started_at = time.time()
+        processed = 0
+        counts = {'skipped': 0}
+        
+        # The scanner streams into a bounded queue, so memory stays flat however
+        # large the library is, and lookups start with the first files found
+        files = queue.Queue(maxsize=self.batch_size * 2)
+        scanner = threading.Thread(
+            target=self.scan_directory,
+            args=(directory, since, files, counts),
+            name='scanner',
+            daemon=True
+        )
+        scanner.start()
+        
+        # Lookups run on threads, a batch at a time so Spotify details take one
+        # request per batch; tag parsing and writing runs on --jobs processes
+        writer = ProcessPoolExecutor(self.jobs, mp_context=multiprocessing.get_context('spawn')) if self.jobs > 1 else None
+        writes = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='enhance') as pool:
+                finished = False
+                while not finished:
+                    batch, finished = self.next_batch(files)
+                    if not batch:
+                        continue
+                    for filepath in batch:
+                        logger.info(f"Processing: {filepath}")
+                    entries = self.lookup_batch(batch, pool)
+                    # The previous batch was written while this one was looked up
+                    self.finish_writes(writes)
+                    writes = self.submit_writes(entries, writer)
+                    processed += len(entries)
+                self.finish_writes(writes)
+        finally:
+            if writer:
+                writer.shutdown()
+        scanner.join()
+        
+        if self.manifest and not self.dry_run:
+            self.manifest.finish_run(started_at)
+        logger.info(f"Processed {processed} files, skipped {counts['skipped']} unchanged files")
+        if self.cache:
+            logger.info(f"Lookup cache: {self.cache.stats()}")
+        self.write_metrics({'processed': processed, 'skipped': counts['skipped']})
+    
+    def write_metrics(self, files=None):
+        """Leave this run's provider metrics where the web service's /metrics picks them up"""
+        if not self.metrics_path or self.dry_run:
+            return
+        try:
+            self.metrics.write(self.metrics_path, files, self.cache.stats() if self.cache else None)
+        except OSError as e:
+            logger.warning(f"Could not write enhancer metrics: {e}")
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python enhance_metadata.py <file_or_directory>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Add MusicBrainz, Spotify and Last.fm metadata to music files')
+    parser.add_argument('path', help='music file or directory')
+    parser.add_argument('--config', default='/app/config/config.env', help='path to config.env')
+    parser.add_argument('--force', action='store_true', help='process files even if they were enhanced before')
+    parser.add_argument('--since', type=parse_since, help='only files changed within a duration (12h, 7d) or since an ISO date')
+    parser.add_argument('--changed-only', action='store_true', help='only files changed since the last completed run')
+    parser.add_argument('--dry-run', action='store_true', help='show the tag changes without writing them')
+    parser.add_argument('--jobs', '-j', type=int, help='processes parsing and writing tags (default: CPU count)')
+    args = parser.parse_args()
+    
+    path = args.path
+    enhancer = MetadataEnhancer(args.config, force=args.force, dry_run=args.dry_run, jobs=args.jobs)
     
-    path = sys.argv[1]
-    enhancer = MetadataEnhancer()
+    since = args.since
+    if args.changed_only and enhancer.manifest:
+        since = max(since or 0, enhancer.manifest.last_run() or 0) or None
     
     if os.path.isfile(path):
-        enhancer.process_file(path)
+        if enhancer.needs_processing(path, os.stat(path)):
+            enhancer.process_file(path)
+            enhancer.write_metrics({'processed': 1})
+        else:
+            logger.info(f"Already enhanced, use --force to process again: {path}")
     elif os.path.isdir(path):
-        enhancer.process_directory(path)
+        enhancer.process_directory(path, since=since)
     else:
         logger.error(f"Path not found: {path}")
         sys.exit(1)
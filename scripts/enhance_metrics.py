@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Enhancer Run Metrics
+Provider latency and error counts, written as a Prometheus text file for /metrics
+"""
+
+import os
+import sys
+import time
+
+# The web service's metrics module; scripts/ and web/ ship side by side in the checkout
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'web'))
+from metrics import Counter, Histogram, Registry
+
+# Seconds; MusicBrainz at one request per second sits in the middle
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class ProviderMetrics:
+    """Collects the provider calls of one enhancer run.
+
+    The web service appends the file written by `write()` to its /metrics
+    output, node_exporter textfile style, so the values are those of the
+    last run; Prometheus treats the drop at the start of a run as a reset.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.latency = Histogram(
+            'enhancer_provider_request_duration_seconds', 'Latency of metadata provider requests',
+            ['provider'], buckets=LATENCY_BUCKETS
+        )
+        self.errors = Counter(
+            'enhancer_provider_errors_total', 'Failed metadata provider requests by cause',
+            ['provider', 'cause']
+        )
+
+    def observe(self, provider, seconds):
+        """Record the latency of one provider request"""
+        self.latency.observe(seconds, provider=provider)
+
+    def error(self, provider, cause):
+        """Count a failed provider request"""
+        self.errors.inc(provider=provider, cause=cause)
+
+    def render(self, files=None, cache=None):
+        """The run's metrics in Prometheus text format"""
+        registry = Registry()
+        registry.register(self.latency)
+        registry.register(self.errors)
+
+        if files:
+            files_total = registry.counter(
+                'enhancer_files_total', 'Files looked at by the last enhancer run', ['result']
+            )
+            for result, count in files.items():
+                files_total.inc(count, result=result)
+
+        if cache:
+            cache_total = registry.counter(
+                'enhancer_lookup_cache_requests_total', 'Lookup cache hits and misses of the last run', ['result']
+            )
+            cache_total.inc(cache['hits'], result='hit')
+            cache_total.inc(cache['misses'], result='miss')
+
+        finished = time.time()
+        registry.gauge(
+            'enhancer_last_run_timestamp_seconds', 'When the last enhancer run finished'
+        ).set(round(finished))
+        registry.gauge(
+            'enhancer_last_run_duration_seconds', 'How long the last enhancer run took'
+        ).set(round(finished - self.started, 3))
+        return registry.render()
+
+    def write(self, path, files=None, cache=None):
+        """Atomically replace the metrics file, so a scrape never reads half of it"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.render(files, cache))
+        os.replace(tmp_path, path)
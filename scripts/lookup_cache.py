@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Metadata Lookup Cache
+On-disk cache of MusicBrainz, Spotify and Last.fm answers for enhance_metadata.py
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lookups (
+    provider TEXT NOT NULL,
+    artist TEXT NOT NULL,
+    title TEXT NOT NULL,
+    value TEXT NOT NULL,
+    negative INTEGER NOT NULL DEFAULT 0,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (provider, artist, title)
+);
+CREATE INDEX IF NOT EXISTS idx_lookups_accessed ON lookups (accessed_at);
+CREATE INDEX IF NOT EXISTS idx_lookups_expires ON lookups (expires_at);
+"""
+
+# Writes between checks of the size bound
+EVICT_EVERY = 100
+
+
+def normalize(text):
+    """Fold a name so trivial spelling differences share a cache entry"""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+class LookupCache:
+    """Provider answers keyed by normalized (provider, artist, title).
+
+    Empty answers are cached too, with their own (usually shorter) TTL, so
+    tracks a provider doesn't know are not asked about on every run. Once
+    the cache grows past max_entries the least recently used entries go.
+    """
+
+    def __init__(self, db_path, ttl_days=30, negative_ttl_days=7, max_entries=100000):
+        self.db_path = db_path
+        self.ttl = ttl_days * 86400
+        self.negative_ttl = negative_ttl_days * 86400
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, provider, artist, title):
+        """Return the cached answer, or None when there is no fresh entry"""
+        key = (provider, normalize(artist), normalize(title))
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute(
+            'SELECT value FROM lookups WHERE provider = ? AND artist = ? AND title = ? AND expires_at > ?',
+            (*key, now)
+        ).fetchone()
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if row is None:
+            return None
+
+        conn.execute(
+            'UPDATE lookups SET accessed_at = ? WHERE provider = ? AND artist = ? AND title = ?',
+            (now, *key)
+        )
+        return json.loads(row['value'])
+
+    def put(self, provider, artist, title, value):
+        """Store an answer; an empty dict is cached as a negative result"""
+        now = time.time()
+        negative = not value
+        self._connection().execute(
+            'INSERT OR REPLACE INTO lookups '
+            '(provider, artist, title, value, negative, expires_at, accessed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (provider, normalize(artist), normalize(title), json.dumps(value or {}),
+             int(negative), now + (self.negative_ttl if negative else self.ttl), now)
+        )
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones over the size bound"""
+        conn = self._connection()
+        removed = conn.execute('DELETE FROM lookups WHERE expires_at <= ?', (time.time(),)).rowcount
+        removed += conn.execute(
+            'DELETE FROM lookups WHERE rowid IN ('
+            'SELECT rowid FROM lookups ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        ).rowcount
+        if removed:
+            logger.info(f"Evicted {removed} entries from the lookup cache")
+        return removed
+
+    def clear(self, provider=None):
+        """Forget every cached answer, or those of one provider"""
+        if provider:
+            self._connection().execute('DELETE FROM lookups WHERE provider = ?', (provider,))
+        else:
+            self._connection().execute('DELETE FROM lookups')
+
+    def stats(self):
+        """Hit/miss counts of this run and the size of the cache"""
+        row = self._connection().execute(
+            'SELECT COUNT(*) AS entries, COALESCE(SUM(negative), 0) AS negative FROM lookups'
+        ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': row['entries'],
+            'negative_entries': row['negative'],
+        }
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Enhanced Metadata Tag Writer
+Writes enhancer tags to MP3 (ID3), M4A (MP4 atoms), FLAC and Ogg (Vorbis comments)
+"""
+
+import json
+import logging
+
+import mutagen
+from mutagen._vorbis import VCommentDict
+from mutagen.id3 import ID3, TALB, TCON, TDRC, TIT2, TPE1, TXXX
+from mutagen.mp4 import MP4FreeForm, MP4Tags
+
+logger = logging.getLogger(__name__)
+
+# Spare room left in a tag whenever it has to grow, so later runs can
+# rewrite it in place instead of moving the audio data
+DEFAULT_PADDING = 16 * 1024
+
+ENHANCED_KEY = 'ENHANCED_METADATA'
+
+# Tag field names per container
+ID3_FRAMES = {
+    'title': TIT2,
+    'artist': TPE1,
+    'album': TALB,
+    'date': TDRC,
+    'genre': TCON,
+}
+MP4_ATOMS = {
+    'title': '\xa9nam',
+    'artist': '\xa9ART',
+    'album': '\xa9alb',
+    'date': '\xa9day',
+    'genre': '\xa9gen',
+    'enhanced': f'----:com.apple.iTunes:{ENHANCED_KEY}',
+}
+VORBIS_FIELDS = {
+    'title': 'TITLE',
+    'artist': 'ARTIST',
+    'album': 'ALBUM',
+    'date': 'DATE',
+    'genre': 'GENRE',
+    'enhanced': ENHANCED_KEY,
+}
+
+
+def build_tags(metadata):
+    """Turn enhancer metadata into the tag values to write"""
+    tags = {}
+    for field in ('title', 'artist', 'album'):
+        if metadata.get(field):
+            tags[field] = str(metadata[field])
+
+    year = (metadata.get('date') or metadata.get('release_date') or '')[:4]
+    if year:
+        tags['date'] = year
+
+    # Add genre from tags or Spotify
+    genres = []
+    genres.extend(metadata.get('tags', [])[:3])  # Top 3 MusicBrainz tags
+    genres.extend(metadata.get('genres', [])[:2])  # Top 2 Spotify genres
+    genres.extend(metadata.get('lastfm_tags', [])[:2])  # Top 2 Last.fm tags
+    if genres:
+        tags['genre'] = '; '.join(genres[:5])
+
+    # Custom metadata for later use by the recommendation engine
+    tags['enhanced'] = json.dumps({
+        'enhanced_metadata': True,
+        'spotify_data': {k: v for k, v in metadata.items() if k.startswith('spotify_') or k in ['popularity', 'danceability', 'energy', 'valence']},
+        'lastfm_data': {k: v for k, v in metadata.items() if k.startswith('lastfm_')},
+        'musicbrainz_data': {k: v for k, v in metadata.items() if k in ['tags', 'duration']}
+    })
+    return tags
+
+
+def reserve_padding(reserve):
+    """mutagen padding callback: keep the tag in place when it fits, else grow it with room to spare"""
+    def padding(info):
+        if info.padding >= 0:
+            return info.padding
+        return reserve
+    return padding
+
+
+def _read_id3(tags):
+    values = {field: str(tags[frame.__name__]) for field, frame in ID3_FRAMES.items() if frame.__name__ in tags}
+    enhanced = tags.get(f'TXXX:{ENHANCED_KEY}')
+    if enhanced:
+        values['enhanced'] = str(enhanced)
+    return values
+
+
+def _write_id3(tags, values):
+    for field, frame in ID3_FRAMES.items():
+        if field in values:
+            tags.add(frame(encoding=3, text=values[field]))
+    tags.add(TXXX(encoding=3, desc=ENHANCED_KEY, text=values['enhanced']))
+
+
+def _read_mp4(tags):
+    values = {}
+    for field, atom in MP4_ATOMS.items():
+        if atom in tags and tags[atom]:
+            value = tags[atom][0]
+            values[field] = bytes(value).decode('utf-8') if isinstance(value, bytes) else str(value)
+    return values
+
+
+def _write_mp4(tags, values):
+    for field, atom in MP4_ATOMS.items():
+        if field == 'enhanced':
+            tags[atom] = [MP4FreeForm(values[field].encode('utf-8'))]
+        elif field in values:
+            tags[atom] = [values[field]]
+
+
+def _read_vorbis(tags):
+    return {field: tags[key][0] for field, key in VORBIS_FIELDS.items() if key in tags and tags[key]}
+
+
+def _write_vorbis(tags, values):
+    for field, key in VORBIS_FIELDS.items():
+        if field in values:
+            tags[key] = [values[field]]
+
+
+def _codec(tags):
+    if isinstance(tags, ID3):
+        return _read_id3, _write_id3
+    if isinstance(tags, MP4Tags):
+        return _read_mp4, _write_mp4
+    if isinstance(tags, VCommentDict):
+        return _read_vorbis, _write_vorbis
+    raise ValueError(f"unsupported tag type {type(tags).__name__}")
+
+
+def write_tags(filepath, metadata, dry_run=False, padding=DEFAULT_PADDING):
+    """Write enhancer metadata to a music file of any supported format.
+
+    Returns the changed fields as {field: (old, new)}. Nothing is saved if
+    no field changed or dry_run is set, so unchanged files are never touched.
+    """
+    audio_file = mutagen.File(filepath)
+    if audio_file is None:
+        raise ValueError('unsupported audio format')
+    if audio_file.tags is None:
+        audio_file.add_tags()
+
+    read, write = _codec(audio_file.tags)
+    current = read(audio_file.tags)
+    wanted = build_tags(metadata)
+    changes = {
+        field: (current.get(field), value)
+        for field, value in wanted.items()
+        if current.get(field) != value
+    }
+
+    if changes and not dry_run:
+        write(audio_file.tags, wanted)
+        audio_file.save(padding=reserve_padding(padding))
+    return changes
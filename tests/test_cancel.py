@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Cancel and Retry Tests
+Cancelling a track in its retry backoff or after its hand-off to post-processing, and
+retrying a failed playlist track, through the web API
+"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'web'))
+
+WORKDIR = tempfile.TemporaryDirectory()
+
+
+def configure(workdir):
+    """Point every path the app uses into workdir, before it is imported"""
+    settings = {
+        'AUTO_UPDATE': 'false',
+        'DOWNLOAD_ENGINE': 'subprocess',
+        'RETRY_BACKOFF_SECONDS': '1',
+        'MIN_FREE_SPACE_MB': '0',
+        'DUPLICATE_ACTION': 'off',
+    }
+    for name in ('JOBS', 'MONITOR', 'QUEUE', 'CATALOG', 'FINGERPRINT', 'ARCHIVE'):
+        settings[f'{name}_DB_PATH'] = os.path.join(workdir, f'{name.lower()}.db')
+    settings.update(
+        ARCHIVE_PATH=os.path.join(workdir, 'archive.db'),
+        QUEUE_FILE=os.path.join(workdir, 'queue', 'download_queue.txt'),
+        ENHANCER_METRICS_PATH=os.path.join(workdir, 'enhancer.prom'),
+        LEADER_LOCK_PATH=os.path.join(workdir, 'leader.lock'),
+    )
+    with open(os.path.join(workdir, 'config.env'), 'w') as f:
+        f.writelines(f'{name}={value}\n' for name, value in settings.items())
+    for directory in ('logs', 'music'):
+        os.makedirs(os.path.join(workdir, directory), exist_ok=True)
+    os.environ.update(
+        CONFIG_PATH=os.path.join(workdir, 'config.env'),
+        LOG_DIR=os.path.join(workdir, 'logs'),
+        DOWNLOAD_PATH=os.path.join(workdir, 'music'),
+    )
+
+
+try:
+    import flask  # noqa: F401
+except ImportError:
+    app = None
+else:
+    configure(WORKDIR.name)
+    import app
+
+URL = 'https://www.youtube.com/watch?v=aaaaaaaaaaa'
+
+
+def tearDownModule():
+    WORKDIR.cleanup()
+
+
+@unittest.skipIf(app is None, 'the web app needs Flask')
+class CancelTest(unittest.TestCase):
+    """The schedulers are never started here, so submitted jobs stay visible in their backlogs"""
+
+    @classmethod
+    def setUpClass(cls):
+        app.leader.is_leader = True
+        cls.client = app.app.test_client()
+
+    def setUp(self):
+        self.job_id = f'{self._testMethodName}_{time.monotonic_ns()}'
+
+    def cancel(self, download_id):
+        return self.client.post(f'/api/downloads/{download_id}/cancel')
+
+    def status(self, download_id):
+        return app.job_store.get(download_id)['status']
+
+    def test_cancel_during_retry_backoff_stops_the_retry(self):
+        app.job_store.create(self.job_id, status='downloading', url=URL)
+        app.retry_or_fail(URL, self.job_id, {}, None, 1, 'HTTP Error 503', 'fetch')
+        self.assertEqual(self.status(self.job_id), 'retrying')
+        self.assertIn(self.job_id, app.retry_timers)
+
+        response = self.cancel(self.job_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['was'], 'retrying')
+        self.assertEqual(self.status(self.job_id), 'cancelled')
+        self.assertNotIn(self.job_id, app.retry_timers)
+
+        # Past the backoff, nothing was resubmitted
+        time.sleep(1.5)
+        self.assertNotIn(self.job_id, app.download_scheduler.snapshot()['queued'])
+        self.assertEqual(self.status(self.job_id), 'cancelled')
+
+    def test_retry_fires_when_not_cancelled(self):
+        app.job_store.create(self.job_id, status='downloading', url=URL)
+        app.retry_or_fail(URL, self.job_id, {}, None, 1, 'HTTP Error 503', 'fetch')
+        deadline = time.monotonic() + 5
+        while self.job_id not in app.download_scheduler.snapshot()['queued'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertIn(self.job_id, app.download_scheduler.snapshot()['queued'])
+        app.download_scheduler.cancel(self.job_id)
+
+    def test_cancel_after_handoff_to_postprocessing(self):
+        app.job_store.create(self.job_id, status='processing', url=URL)
+        app.postprocess_scheduler.submit(self.job_id, app.postprocess_track, URL, self.job_id, {}, None, '/nonexistent')
+
+        response = self.cancel(self.job_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['was'], 'queued')
+        self.assertEqual(self.status(self.job_id), 'cancelled')
+        self.assertNotIn(self.job_id, app.postprocess_scheduler.snapshot()['queued'])
+
+    def test_postprocessing_bails_out_for_a_cancelled_job(self):
+        staging = app.staging_dir(self.job_id)
+        os.makedirs(staging)
+        fetched = os.path.join(staging, 'track.mp3')
+        open(fetched, 'w').close()
+        app.job_store.create(self.job_id, status='cancelled', url=URL)
+
+        app.postprocess_track(URL, self.job_id, {}, None, fetched)
+        self.assertEqual(self.status(self.job_id), 'cancelled')
+        self.assertFalse(os.path.exists(staging))
+        self.assertEqual([name for name in os.listdir(app.DOWNLOAD_PATH) if not name.startswith('.')], [])
+
+    def test_unknown_job_is_not_cancelled(self):
+        self.assertEqual(self.cancel('missing').status_code, 404)
+
+    def test_retrying_a_playlist_track_keeps_it_in_the_playlist(self):
+        parent_id, child_id = self.job_id, f'{self.job_id}_0002'
+        app.job_store.create(parent_id, status='completed', url=URL, is_playlist=True,
+                             options={'format': 'mp3'}, skipped_tracks=0)
+        app.job_store.create(child_id, status='error', url=URL, parent_id=parent_id, playlist_index=2)
+
+        response = self.client.post(f'/api/downloads/{child_id}/retry')
+        self.assertEqual(response.status_code, 200)
+        child = app.job_store.get(child_id)
+        self.assertEqual((child['status'], child['parent_id'], child['playlist_index']), ('queued', parent_id, 2))
+        self.assertEqual(self.status(parent_id), 'downloading')
+        self.assertIn(child_id, app.download_scheduler.snapshot()['queued'])
+        app.download_scheduler.cancel(child_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
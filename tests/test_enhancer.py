@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Metadata Enhancer Tests
+Lookup cache TTLs and eviction, the provider rate limiter, tag padding and the manifest skip check
+"""
+
+import os
+import struct
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'scripts'))
+
+from enhance_manifest import FileManifest, has_enhanced_tag
+from lookup_cache import LookupCache
+
+try:
+    import mutagen
+    from tag_writer import DEFAULT_PADDING, write_tags
+except ImportError:
+    mutagen = None
+
+try:
+    from enhance_metadata import RateLimiter
+except ImportError:  # Needs the provider client libraries
+    RateLimiter = None
+
+DAY = 86400
+
+
+def write_flac(path):
+    """An empty but valid FLAC file: the marker and a STREAMINFO block, no tags"""
+    bits = (44100 << 44) | (1 << 41) | (15 << 36)  # 44.1 kHz, 2 channels, 16 bit, 0 samples
+    info = struct.pack('>HH', 4096, 4096) + bytes(6) + bits.to_bytes(8, 'big') + bytes(16)
+    with open(path, 'wb') as f:
+        f.write(b'fLaC' + bytes([0x80]) + len(info).to_bytes(3, 'big') + info)
+
+
+class LookupCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = LookupCache(os.path.join(self.tmp.name, 'cache.db'), ttl_days=30, negative_ttl_days=7)
+        self.now = time.time()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def at(self, days):
+        return mock.patch('lookup_cache.time.time', return_value=self.now + days * DAY)
+
+    def test_hit_across_spellings(self):
+        with self.at(0):
+            self.cache.put('musicbrainz', 'Daft  Punk', 'One More Time', {'album': 'Discovery'})
+            self.assertEqual(self.cache.get('musicbrainz', 'daft punk', 'ONE MORE TIME'), {'album': 'Discovery'})
+            self.assertIsNone(self.cache.get('spotify', 'daft punk', 'one more time'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_answers_and_negative_answers_expire_on_their_own_ttl(self):
+        with self.at(0):
+            self.cache.put('lastfm', 'artist', 'known', {'tags': ['house']})
+            self.cache.put('lastfm', 'artist', 'unknown', {})
+        with self.at(6):
+            self.assertEqual(self.cache.get('lastfm', 'artist', 'unknown'), {})
+        with self.at(8):
+            self.assertIsNone(self.cache.get('lastfm', 'artist', 'unknown'))
+            self.assertEqual(self.cache.get('lastfm', 'artist', 'known'), {'tags': ['house']})
+        with self.at(31):
+            self.assertIsNone(self.cache.get('lastfm', 'artist', 'known'))
+
+    def test_evict_drops_expired_then_least_recently_used(self):
+        cache = LookupCache(os.path.join(self.tmp.name, 'small.db'), max_entries=2)
+        for index, title in enumerate(('old', 'used', 'new')):
+            with self.at(index / DAY):
+                cache.put('spotify', 'artist', title, {'id': title})
+        with self.at(10 / DAY):
+            cache.get('spotify', 'artist', 'old')
+        with self.at(11 / DAY):
+            self.assertEqual(cache.evict(), 1)
+            self.assertIsNone(cache.get('spotify', 'artist', 'used'))
+            self.assertIsNotNone(cache.get('spotify', 'artist', 'old'))
+
+
+@unittest.skipIf(RateLimiter is None, 'enhance_metadata needs its provider libraries')
+class RateLimiterTest(unittest.TestCase):
+    def test_spaces_requests_at_the_rate(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        started = time.monotonic()
+        for _ in range(5):
+            limiter.acquire()
+        # The first request uses the initial token, the other four wait 50 ms each
+        self.assertGreaterEqual(time.monotonic() - started, 0.18)
+
+    def test_backoff_holds_every_caller(self):
+        limiter = RateLimiter(rate=1000, burst=5)
+        limiter.backoff(0.2)
+        started = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+
+@unittest.skipIf(mutagen is None, 'tag writing needs mutagen')
+class TagWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'track.flac')
+        write_flac(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_first_write_reserves_padding_and_rewrites_stay_in_place(self):
+        changes = write_tags(self.path, {'title': 'One More Time', 'artist': 'Daft Punk'})
+        self.assertEqual(changes['title'], (None, 'One More Time'))
+        padding = [block.length for block in mutagen.File(self.path).metadata_blocks
+                   if type(block).__name__ == 'Padding']
+        self.assertEqual(padding, [DEFAULT_PADDING])
+
+        size = os.path.getsize(self.path)
+        write_tags(self.path, {'title': 'One More Time (Radio Edit)', 'artist': 'Daft Punk'})
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertEqual(mutagen.File(self.path)['TITLE'], ['One More Time (Radio Edit)'])
+
+    def test_unchanged_tags_leave_the_file_alone(self):
+        metadata = {'title': 'Aerodynamic', 'artist': 'Daft Punk'}
+        write_tags(self.path, metadata)
+        mtime = os.stat(self.path).st_mtime_ns
+        self.assertEqual(write_tags(self.path, metadata), {})
+        self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+    def test_dry_run_writes_nothing(self):
+        self.assertTrue(write_tags(self.path, {'title': 'Digital Love'}, dry_run=True))
+        self.assertFalse(has_enhanced_tag(self.path))
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.manifest = FileManifest(os.path.join(self.tmp.name, 'manifest.db'))
+        self.path = os.path.join(self.tmp.name, 'track.flac')
+        write_flac(self.path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_unchanged_until_size_or_mtime_moves(self):
+        self.assertFalse(self.manifest.unchanged(self.path, os.stat(self.path)))
+        self.manifest.record(self.path)
+        self.assertTrue(self.manifest.unchanged(self.path, os.stat(self.path)))
+
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        self.assertFalse(self.manifest.unchanged(self.path, os.stat(self.path)))
+
+        self.manifest.record(self.path)
+        self.manifest.forget(self.path)
+        self.assertFalse(self.manifest.unchanged(self.path, os.stat(self.path)))
+
+    def test_last_run(self):
+        self.assertIsNone(self.manifest.last_run())
+        self.manifest.finish_run(1234.5)
+        self.assertEqual(self.manifest.last_run(), 1234.5)
+
+    @unittest.skipIf(mutagen is None, 'tag writing needs mutagen')
+    def test_enhanced_tag_is_found_without_parsing_the_file(self):
+        self.assertFalse(has_enhanced_tag(self.path))
+        write_tags(self.path, {'title': 'Voyager'})
+        self.assertTrue(has_enhanced_tag(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
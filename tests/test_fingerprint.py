@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Fingerprint Duplicate Tests
+Drives the duplicate match and quarantine path with synthetic PCM instead of ffmpeg
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'web'))
+
+import fingerprint
+from fingerprint import SAMPLE_RATE, FingerprintIndex, np, quarantine
+
+# Length of every synthetic recording, in seconds
+DURATION = 90
+
+
+def recording(seed):
+    """Noise shaped by a slowly changing spectrum, so bands rise and fall like music"""
+    rng = np.random.default_rng(seed)
+    samples = np.zeros(DURATION * SAMPLE_RATE, dtype=np.float32)
+    for frequency in rng.uniform(300, 2000, 24):
+        envelope = np.repeat(rng.uniform(0, 1, DURATION * 4), SAMPLE_RATE // 4)
+        envelope = np.pad(envelope, (0, len(samples) - len(envelope)), mode='edge')
+        t = np.arange(len(samples)) / SAMPLE_RATE
+        samples += envelope * np.sin(2 * np.pi * frequency * t)
+    return samples / np.abs(samples).max()
+
+
+def reupload(samples, seed, intro_seconds=3.0, gain=0.7, noise=0.02):
+    """The same recording as another channel would post it: a longer intro, quieter, re-encoded"""
+    rng = np.random.default_rng(seed)
+    intro = rng.normal(0, noise, int(intro_seconds * SAMPLE_RATE)).astype(np.float32)
+    copy = samples * gain + rng.normal(0, noise, len(samples)).astype(np.float32)
+    return np.concatenate([intro, copy])
+
+
+@unittest.skipIf(np is None, 'fingerprinting needs NumPy')
+class DuplicateMatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, 'music')
+        self.pcm = {}
+        self.original_decode = fingerprint.decode
+        fingerprint.decode = self.decode
+        self.index = FingerprintIndex(os.path.join(self.tmp.name, 'fingerprints.db'))
+
+    def tearDown(self):
+        fingerprint.decode = self.original_decode
+        self.tmp.cleanup()
+
+    def decode(self, path, start=fingerprint.START_SECONDS, seconds=fingerprint.WINDOW_SECONDS):
+        """Stand-in for ffmpeg: the window of the PCM registered for path"""
+        samples = self.pcm[path]
+        return samples[int(start * SAMPLE_RATE):int((start + seconds) * SAMPLE_RATE)]
+
+    def track(self, relative, samples):
+        path = os.path.join(self.root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'audio')
+        self.pcm[path] = samples
+        return path
+
+    def test_reupload_matches_original(self):
+        song = recording(1)
+        original = self.track('Artist/Song.mp3', song)
+        other = self.track('Artist/Other.mp3', recording(2))
+        self.assertIsNone(self.index.check(original))
+        self.assertIsNone(self.index.check(other))
+
+        copy = self.track('Artist - Topic/Song (Lyrics).mp3', reupload(song, 3))
+        match = self.index.check(copy)
+        self.assertIsNotNone(match)
+        self.assertEqual(match['path'], original)
+        self.assertLess(match['ber'], fingerprint.MATCH_BER)
+        self.assertAlmostEqual(match['offset_seconds'], -3.0, delta=0.5)
+        self.assertEqual(
+            [(d['path'], d['duplicate_of']) for d in self.index.duplicates()],
+            [(copy, original)]
+        )
+
+    def test_unrelated_recording_does_not_match(self):
+        self.assertIsNone(self.index.check(self.track('A/One.mp3', recording(4))))
+        self.assertIsNone(self.index.check(self.track('B/Two.mp3', reupload(recording(5), 6))))
+
+    def test_stale_match_is_dropped(self):
+        song = recording(7)
+        original = self.track('Artist/Song.mp3', song)
+        self.index.check(original)
+        os.remove(original)
+
+        copy = self.track('Other/Song.mp3', reupload(song, 8))
+        self.assertIsNone(self.index.check(copy))
+        self.assertFalse(self.index.has(original))
+
+    def test_quarantine_keeps_layout_and_sidecars(self):
+        song = recording(9)
+        self.index.check(self.track('Artist/Song.mp3', song))
+        copy = self.track('Artist - Topic/Song.mp3', reupload(song, 10))
+        with open(os.path.splitext(copy)[0] + '.info.json', 'w') as f:
+            f.write('{}')
+        self.assertIsNotNone(self.index.check(copy))
+
+        directory = os.path.join(self.root, '.quarantine')
+        target = quarantine(copy, self.root, directory, ('.info.json', '.jpg'))
+        self.assertEqual(target, os.path.join(directory, 'Artist - Topic', 'Song.mp3'))
+        self.assertTrue(os.path.exists(target))
+        self.assertTrue(os.path.exists(os.path.join(directory, 'Artist - Topic', 'Song.info.json')))
+        self.assertFalse(os.path.exists(copy))
+        self.assertFalse(os.path.exists(os.path.splitext(copy)[0] + '.info.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Job Store Tests
+Cursor paging, the version counter behind the ETags, status counters and nested updates
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'web'))
+
+from job_store import JobStore, decode_cursor, encode_cursor
+
+
+class JobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = JobStore(os.path.join(self.tmp.name, 'jobs.db'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add_jobs(self, count, status='completed', parent_id=None):
+        ids = []
+        for index in range(count):
+            job_id = f'{parent_id or "job"}_{index:03d}'
+            self.store.create(job_id, status=status, parent_id=parent_id)
+            ids.append(job_id)
+        return ids
+
+    def all_pages(self, limit, **filters):
+        pages, cursor = [], None
+        while True:
+            jobs, cursor = self.store.page(limit=limit, cursor=cursor, **filters)
+            pages.append([job['id'] for job in jobs])
+            if cursor is None:
+                return pages
+
+    def test_pages_cover_every_job_once_newest_first(self):
+        ids = self.add_jobs(7)
+        pages = self.all_pages(3)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([job_id for page in pages for job_id in page], ids[::-1])
+
+    def test_new_jobs_do_not_shift_later_pages(self):
+        ids = self.add_jobs(5)
+        first, cursor = self.store.page(limit=2)
+        self.store.create('newer', status='queued')
+        second, _ = self.store.page(limit=2, cursor=cursor)
+        self.assertEqual([job['id'] for job in first], [ids[4], ids[3]])
+        self.assertEqual([job['id'] for job in second], [ids[2], ids[1]])
+
+    def test_status_and_parent_filters(self):
+        self.add_jobs(2, status='completed')
+        self.store.create('failed', status='error')
+        self.add_jobs(4, status='queued', parent_id='playlist')
+        self.assertEqual(self.all_pages(10, statuses=('error',)), [['failed']])
+        # Tracks only show up when their playlist is asked for
+        self.assertEqual(sum(map(len, self.all_pages(10))), 3)
+        self.assertEqual(sum(map(len, self.all_pages(3, parent_id='playlist'))), 4)
+
+    def test_cursor_round_trip_and_garbage(self):
+        self.assertEqual(decode_cursor(encode_cursor(12.5, 'abc')), (12.5, 'abc'))
+        with self.assertRaises(ValueError):
+            decode_cursor('not-a-cursor')
+
+    def test_version_changes_with_every_write(self):
+        before = self.store.version()
+        self.store.create('a', status='queued')
+        after_create = self.store.version()
+        self.store.update('a', progress=50)
+        after_update = self.store.version()
+        self.assertLess(before, after_create)
+        self.assertLess(after_create, after_update)
+        # Reads leave it alone, so an unchanged store keeps its ETag
+        self.store.get('a')
+        self.store.page(limit=10)
+        self.assertEqual(self.store.version(), after_update)
+
+    def test_status_counters_follow_transitions(self):
+        self.store.create('a', status='queued')
+        self.store.create('b', status='queued')
+        self.store.update('a', status='completed')
+        self.store.update('b', status='error')
+        stats = self.store.stats()
+        self.assertEqual(stats['by_status'], {'completed': 1, 'error': 1})
+        self.assertEqual((stats['total_downloads'], stats['completed'], stats['failed']), (2, 1, 1))
+
+    def test_update_json_merges_nested_entries(self):
+        self.store.create('a', status='queued')
+        self.store.update_json('a', 'stages', 'fetch', {'state': 'queued', 'queued_at': 1})
+        self.store.update_json('a', 'stages', 'fetch', {'state': 'running', 'started_at': 2}, status='downloading')
+        self.store.update_json('a', 'stages', 'postprocess', {'state': 'queued'})
+        record = self.store.get('a')
+        self.assertEqual(record['status'], 'downloading')
+        self.assertEqual(record['stages'], {
+            'fetch': {'state': 'running', 'queued_at': 1, 'started_at': 2},
+            'postprocess': {'state': 'queued'},
+        })
+
+    def test_concurrent_update_json_keeps_every_entry(self):
+        self.store.create('a', status='downloading')
+
+        def write(stage):
+            store = JobStore(self.store.db_path)
+            for index in range(40):
+                store.update_json('a', 'durations', f'{stage}{index}', index)
+
+        threads = [threading.Thread(target=write, args=(stage,)) for stage in ('fetch', 'postprocess')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.store.get('a')['durations']), 80)
+
+    def test_prune_keeps_newest_finished_jobs(self):
+        store = JobStore(os.path.join(self.tmp.name, 'small.db'), max_finished=2)
+        for index in range(4):
+            store.create(f'done{index}', status='completed')
+        store.create('active', status='downloading')
+        self.assertEqual(store.prune(), 2)
+        self.assertIsNotNone(store.get('active'))
+        self.assertEqual(store.stats()['by_status'], {'completed': 2, 'downloading': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
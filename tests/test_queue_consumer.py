@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Queue Consumer Tests
+Claiming the queue file, deduplication, backlog-bounded dispatch and re-queuing ended jobs
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'web'))
+
+from queue_consumer import QueueConsumer, append_entries, entry_key, parse_priority, parse_window
+
+VIDEO_A = 'https://www.youtube.com/watch?v=aaaaaaaaaaa'
+VIDEO_B = 'https://youtu.be/bbbbbbbbbbb'
+PLAYLIST = 'https://www.youtube.com/playlist?list=PLxyz'
+
+
+class QueueConsumerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queue_file = os.path.join(self.tmp.name, 'queue', 'download_queue.txt')
+        self.dispatched = []
+        self.jobs = {}
+        self.backlog = 0
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def consumer(self, **kwargs):
+        kwargs.setdefault('playlists_off_peak', False)
+        return QueueConsumer(
+            self.queue_file,
+            os.path.join(self.tmp.name, 'queue.db'),
+            dispatch=self.dispatch,
+            backlog=lambda: self.backlog,
+            job_status=self.jobs.get,
+            **kwargs
+        )
+
+    def dispatch(self, url):
+        job_id = f'job{len(self.dispatched)}'
+        self.dispatched.append(url)
+        self.jobs[job_id] = 'queued'
+        return job_id
+
+    def test_claim_renames_the_file_and_ingest_deletes_it(self):
+        consumer = self.consumer()
+        self.assertIsNone(consumer.claim())
+        append_entries(self.queue_file, [{'url': VIDEO_A}])
+        claimed = consumer.claim()
+        self.assertTrue(claimed.endswith('.claimed'))
+        self.assertFalse(os.path.exists(self.queue_file))
+
+        # A writer after the claim starts a fresh file
+        append_entries(self.queue_file, [{'url': VIDEO_B}])
+        self.assertEqual(consumer.ingest(claimed), 1)
+        self.assertFalse(os.path.exists(claimed))
+        self.assertTrue(os.path.exists(self.queue_file))
+
+    def test_leftover_claimed_file_is_ingested_after_a_crash(self):
+        consumer = self.consumer()
+        append_entries(self.queue_file, [{'url': VIDEO_A}])
+        consumer.claim()  # Crash before ingest
+        self.assertEqual(consumer.run_once(), 1)
+        self.assertEqual(self.dispatched, [VIDEO_A])
+
+    def test_duplicates_are_dropped_across_url_spellings(self):
+        consumer = self.consumer()
+        consumer.add([{'url': VIDEO_A}, {'url': 'https://youtu.be/aaaaaaaaaaa'}, {'url': VIDEO_A + '&t=10'}])
+        consumer.run_once()
+        self.assertEqual(self.dispatched, [VIDEO_A])
+        self.assertEqual(consumer.status()['duplicates_dropped'], 2)
+
+    def test_dispatch_respects_backlog_and_priority(self):
+        consumer = self.consumer(max_backlog=2)
+        consumer.add([{'url': VIDEO_A, 'priority': 'low'}, {'url': VIDEO_B}, {'url': PLAYLIST, 'priority': 'high'}])
+        self.backlog = 1
+        self.assertEqual(consumer.run_once(), 1)
+        self.assertEqual(self.dispatched, [PLAYLIST])
+        self.backlog = 2
+        self.assertEqual(consumer.run_once(), 0)
+        self.backlog = 0
+        consumer.run_once()
+        self.assertEqual(self.dispatched, [PLAYLIST, VIDEO_B, VIDEO_A])
+
+    def test_failed_and_cancelled_jobs_can_be_queued_again(self):
+        consumer = self.consumer()
+        consumer.add([{'url': VIDEO_A}, {'url': VIDEO_B}, {'url': PLAYLIST}])
+        consumer.run_once()
+        self.jobs.update(job0='error', job1='cancelled', job2='completed')
+        consumer.run_once()
+        self.assertEqual(consumer.status()['released'], 2)
+
+        consumer.add([{'url': VIDEO_A}, {'url': VIDEO_B}, {'url': PLAYLIST}])
+        consumer.run_once()
+        self.assertEqual(self.dispatched[3:], [VIDEO_A, VIDEO_B])
+        self.assertEqual(consumer.status()['duplicates_dropped'], 1)
+
+    def test_running_jobs_keep_their_key(self):
+        consumer = self.consumer()
+        consumer.add([{'url': VIDEO_A}])
+        consumer.run_once()
+        self.jobs['job0'] = 'downloading'
+        consumer.add([{'url': VIDEO_A}])
+        consumer.run_once()
+        self.assertEqual(self.dispatched, [VIDEO_A])
+
+    def test_off_peak_entries_wait_for_the_window(self):
+        consumer = self.consumer(off_peak_window='01:00-07:00')
+        self.assertTrue(consumer.in_off_peak(datetime(2024, 1, 1, 3, 0)))
+        self.assertFalse(consumer.in_off_peak(datetime(2024, 1, 1, 12, 0)))
+        overnight = self.consumer(off_peak_window='23:00-02:00')
+        self.assertTrue(overnight.in_off_peak(datetime(2024, 1, 1, 23, 30)))
+        self.assertTrue(overnight.in_off_peak(datetime(2024, 1, 1, 1, 0)))
+        self.assertFalse(overnight.in_off_peak(datetime(2024, 1, 1, 2, 0)))
+
+    def test_parsers(self):
+        self.assertEqual(entry_key(PLAYLIST), 'playlist:PLxyz')
+        self.assertEqual(entry_key(VIDEO_B), 'video:bbbbbbbbbbb')
+        self.assertEqual(parse_priority('HIGH'), 10)
+        self.assertEqual(parse_priority(None), 0)
+        with self.assertRaises(ValueError):
+            parse_priority('urgent')
+        self.assertEqual(parse_window('1:00 - 7:30'), (60, 450))
+        self.assertIsNone(parse_window('nightly'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Download Scheduler Tests
+Worker bound, FIFO order, bounded backlog and cancellation of queued and running jobs
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'web'))
+
+from scheduler import DownloadScheduler, JobCancelled
+
+
+def wait_for(predicate, timeout=5):
+    """Poll until predicate() is true; fail the test if it never is"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return
+        time.sleep(0.01)
+    raise AssertionError('condition not reached')
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.started = []
+        self.lock = threading.Lock()
+        self.peak = 0
+        self.active = 0
+
+    def tearDown(self):
+        self.release.set()
+        for scheduler in getattr(self, 'schedulers', []):
+            scheduler.stop()
+
+    def scheduler(self, **kwargs):
+        scheduler = DownloadScheduler(**kwargs)
+        self.schedulers = getattr(self, 'schedulers', []) + [scheduler]
+        return scheduler
+
+    def job(self, job_id):
+        with self.lock:
+            self.started.append(job_id)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        self.release.wait(5)
+        with self.lock:
+            self.active -= 1
+
+    def test_never_runs_more_than_max_workers(self):
+        scheduler = self.scheduler(max_workers=2)
+        scheduler.start()
+        for index in range(6):
+            scheduler.submit(f'job{index}', self.job, f'job{index}')
+        wait_for(lambda: len(scheduler.snapshot()['running']) == 2)
+        time.sleep(0.1)
+        self.assertEqual(self.peak, 2)
+        self.assertEqual(scheduler.snapshot()['queued'], ['job2', 'job3', 'job4', 'job5'])
+        self.assertEqual(scheduler.position('job4'), 3)
+
+        self.release.set()
+        wait_for(lambda: len(self.started) == 6)
+        self.assertEqual(self.started[2:], ['job2', 'job3', 'job4', 'job5'])
+        self.assertEqual(self.peak, 2)
+
+    def test_duplicate_submit_is_refused(self):
+        scheduler = self.scheduler(max_workers=1)
+        self.assertTrue(scheduler.submit('a', self.job, 'a'))
+        self.assertFalse(scheduler.submit('a', self.job, 'a'))
+        self.assertEqual(scheduler.snapshot()['queued'], ['a'])
+
+    def test_cancel_queued_job_removes_it(self):
+        scheduler = self.scheduler(max_workers=1)
+        scheduler.start()
+        scheduler.submit('a', self.job, 'a')
+        scheduler.submit('b', self.job, 'b')
+        wait_for(lambda: scheduler.snapshot()['running'] == ['a'])
+
+        self.assertEqual(scheduler.cancel('b'), 'queued')
+        self.assertIsNone(scheduler.cancel('b'))
+        self.release.set()
+        wait_for(lambda: not scheduler.snapshot()['running'])
+        self.assertEqual(self.started, ['a'])
+
+    def test_cancel_running_job_flags_it_and_calls_hook(self):
+        cancelled = []
+        scheduler = self.scheduler(max_workers=1, on_cancel=cancelled.append)
+        finished = []
+
+        def cancellable():
+            self.release.wait(5)
+            if scheduler.is_cancelled('a'):
+                raise JobCancelled('a')
+            finished.append('a')
+
+        scheduler.start()
+        scheduler.submit('a', cancellable)
+        wait_for(lambda: scheduler.snapshot()['running'] == ['a'])
+        self.assertEqual(scheduler.cancel('a'), 'running')
+        self.assertTrue(scheduler.is_cancelled('a'))
+        self.assertEqual(cancelled, ['a'])
+
+        self.release.set()
+        wait_for(lambda: not scheduler.snapshot()['running'])
+        self.assertEqual(finished, [])
+        # The flag goes with the job, so a resubmitted job starts clean
+        self.assertFalse(scheduler.is_cancelled('a'))
+
+    def test_submit_wait_blocks_on_a_full_backlog(self):
+        scheduler = self.scheduler(max_workers=1, max_queued=1)
+        scheduler.submit('a', self.job, 'a')
+        submitted = threading.Event()
+        thread = threading.Thread(
+            target=lambda: (scheduler.submit_wait('b', self.job, 'b'), submitted.set()),
+            daemon=True
+        )
+        thread.start()
+        self.assertFalse(submitted.wait(0.2))
+
+        scheduler.start()
+        self.assertTrue(submitted.wait(5))
+        self.assertEqual(scheduler.snapshot()['queued'], ['b'])
+
+    def test_shrinking_holds_the_backlog(self):
+        scheduler = self.scheduler(max_workers=2)
+        scheduler.start()
+        for job_id in 'abc':
+            scheduler.submit(job_id, self.job, job_id)
+        wait_for(lambda: len(scheduler.snapshot()['running']) == 2)
+        scheduler.resize(1)
+        self.release.set()
+        wait_for(lambda: len(self.started) == 3)
+        self.assertEqual(scheduler.snapshot()['max_workers'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
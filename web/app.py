@@ -5,41 +5,346 @@ Modern, professional interface with playlist support and auto-updates
 """
 
 import os
+import fnmatch
+import functools
+import hashlib
 import json
 import subprocess
 import logging
 import requests
+import shutil
 import threading
 import time
+import uuid
 from datetime import datetime
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from werkzeug.serving import make_server
 from werkzeug.utils import secure_filename
 import re
+from scheduler import DownloadScheduler, JobCancelled
+from job_store import JobStore, ACTIVE_STATUSES, FINISHED_STATUSES
+from events import EventBus, stream_events
+from engine import YtDlpEngine, DownloadCancelled
+from archive import DownloadArchive, extract_video_id, format_matches
+from catalog import LibraryCatalog
+from fingerprint import FingerprintIndex, quarantine
+from monitor import PlaylistMonitor
+from library_scan import ScanCoordinator
+from concurrency import ConcurrencyController
+from queue_consumer import QueueConsumer, parse_priority
+from metrics import Registry
+from leader import LeaderElection
 
 # Configuration
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-change-this')
 
+# Overridable so the app also runs outside its container (bench/run.py)
+LOG_DIR = os.environ.get('LOG_DIR', '/app/logs')
+CONFIG_PATH = os.environ.get('CONFIG_PATH', '/app/config/config.env')
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.FileHandler('/app/logs/web.log'),
+        logging.FileHandler(os.path.join(LOG_DIR, 'web.log')),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
+def load_config(config_path=CONFIG_PATH):
+    """Load configuration from environment file"""
+    config = {}
+    try:
+        with open(config_path, 'r') as f:
+            for line in f:
+                if '=' in line and not line.startswith('#'):
+                    key, value = line.strip().split('=', 1)
+                    config[key] = value.strip('"')
+    except FileNotFoundError:
+        logger.warning(f"Config file not found: {config_path}")
+    return config
+
+config = load_config()
+
+def get_setting(key, default=None):
+    """Read a setting from the environment, falling back to config.env"""
+    return os.environ.get(key, config.get(key, default))
+
 # Configuration from environment
 DOWNLOAD_PATH = os.environ.get('DOWNLOAD_PATH', '/downloads')
 MAX_DOWNLOAD_SIZE = int(os.environ.get('MAX_DOWNLOAD_SIZE', '100'))  # MB
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+MAX_CONCURRENT_DOWNLOADS = int(get_setting('MAX_CONCURRENT_DOWNLOADS', '2'))
+DOWNLOAD_RETRIES = int(get_setting('DOWNLOAD_RETRIES', '3'))  # Attempts per track
+RETRY_BACKOFF_SECONDS = int(get_setting('RETRY_BACKOFF_SECONDS', '30'))
+DOWNLOAD_ENGINE = get_setting('DOWNLOAD_ENGINE', 'auto').lower()  # auto, python, subprocess
+JOBS_DB_PATH = get_setting('JOBS_DB_PATH', '/app/config/jobs.db')
+MONITOR_DB_PATH = get_setting('MONITOR_DB_PATH', '/app/config/monitor.db')
+PLAYLIST_CHECK_INTERVAL = int(get_setting('PLAYLIST_CHECK_INTERVAL', '60'))  # minutes
+AUTO_UPDATE = get_setting('AUTO_UPDATE', 'true').lower() == 'true'
+# Held by the one gunicorn worker that runs the schedulers and background loops
+LEADER_LOCK_PATH = get_setting('LEADER_LOCK_PATH', '/app/config/leader.lock')
+# Lives in the music library so download_music.sh on the host shares it
+ARCHIVE_PATH = get_setting('ARCHIVE_PATH', os.path.join(DOWNLOAD_PATH, '.download-archive.db'))
+JOB_RETENTION_DAYS = int(get_setting('JOB_RETENTION_DAYS', '30'))
+MAX_FINISHED_JOBS = int(get_setting('MAX_FINISHED_JOBS', '1000'))
+NAVIDROME_URL = get_setting('NAVIDROME_URL', 'http://navidrome:4533')
+SCAN_WINDOW_SECONDS = int(get_setting('SCAN_WINDOW_SECONDS', '60'))
+# Fetched audio waits here for post-processing; a hidden dir on the library's
+# filesystem, so Navidrome skips it and the final move is a rename
+STAGING_PATH = get_setting('STAGING_PATH', os.path.join(DOWNLOAD_PATH, '.staging'))
+NAVIDROME_CPUS = int(get_setting('NAVIDROME_CPUS', '1'))  # Cores kept free for Navidrome
+POSTPROCESS_WORKERS = int(get_setting('POSTPROCESS_WORKERS', str(max(1, (os.cpu_count() or 1) - NAVIDROME_CPUS))))
+POSTPROCESS_QUEUE = int(get_setting('POSTPROCESS_QUEUE', str(MAX_CONCURRENT_DOWNLOADS * 2)))
+# Adaptive pool sizing; MAX_CONCURRENT_DOWNLOADS and POSTPROCESS_WORKERS are the starting sizes
+# and, unless MAX_ADAPTIVE_DOWNLOADS raises it, the ceilings: by default the pools only shrink
+ADAPTIVE_CONCURRENCY = get_setting('ADAPTIVE_CONCURRENCY', 'true').lower() == 'true'
+MIN_CONCURRENT_DOWNLOADS = int(get_setting('MIN_CONCURRENT_DOWNLOADS', '1'))
+MAX_ADAPTIVE_DOWNLOADS = int(get_setting('MAX_ADAPTIVE_DOWNLOADS', str(MAX_CONCURRENT_DOWNLOADS)))
+CONCURRENCY_INTERVAL = int(get_setting('CONCURRENCY_INTERVAL', '15'))  # seconds
+CPU_PRESSURE_LIMIT = float(get_setting('CPU_PRESSURE_LIMIT', '25'))  # PSI some avg10, %
+IO_PRESSURE_LIMIT = float(get_setting('IO_PRESSURE_LIMIT', '25'))
+LOAD_LIMIT = float(get_setting('LOAD_LIMIT', '1.0'))  # 1-minute load average per core
+MIN_FREE_SPACE_MB = int(get_setting('MIN_FREE_SPACE_MB', '1024'))
+QUEUE_FILE = get_setting('QUEUE_FILE', '/app/queue/download_queue.txt')
+QUEUE_DB_PATH = get_setting('QUEUE_DB_PATH', '/app/config/queue.db')
+QUEUE_MAX_BACKLOG = int(get_setting('QUEUE_MAX_BACKLOG', str(MAX_CONCURRENT_DOWNLOADS * 2)))
+QUEUE_OFF_PEAK_WINDOW = get_setting('QUEUE_OFF_PEAK_WINDOW', '01:00-07:00')
+QUEUE_PLAYLISTS_OFF_PEAK = get_setting('QUEUE_PLAYLISTS_OFF_PEAK', 'true').lower() == 'true'
+# Written by enhance_metadata.py after each run, appended to /metrics
+ENHANCER_METRICS_PATH = get_setting('ENHANCER_METRICS_PATH', '/app/config/enhancer.prom')
+CATALOG_DB_PATH = get_setting('CATALOG_DB_PATH', '/app/config/catalog.db')
+CATALOG_SCAN_WORKERS = int(get_setting('CATALOG_SCAN_WORKERS', '4'))
+CATALOG_RESCAN_MINUTES = int(get_setting('CATALOG_RESCAN_MINUTES', '60'))  # Only without inotify
+FINGERPRINT_DB_PATH = get_setting('FINGERPRINT_DB_PATH', '/app/config/fingerprints.db')
+# What to do with a track whose recording is already in the library: off, flag or skip (quarantine it)
+DUPLICATE_ACTION = get_setting('DUPLICATE_ACTION', 'flag').lower()
+# Skipped duplicates are moved here; hidden, so neither the catalog nor Navidrome picks them up
+QUARANTINE_PATH = get_setting('QUARANTINE_PATH', os.path.join(DOWNLOAD_PATH, '.quarantine'))
+FINGERPRINT_WORKERS = int(get_setting('FINGERPRINT_WORKERS', str(POSTPROCESS_WORKERS)))
 
-# Global download status storage
-download_status = {}
+# Jobs per page of the /queue history
+QUEUE_PAGE_SIZE = 50
+
+# Persistent download status storage
+job_store = JobStore(
+    JOBS_DB_PATH,
+    retention_days=JOB_RETENTION_DAYS,
+    max_finished=MAX_FINISHED_JOBS
+)
 download_logs = []
 
+# Live job updates for Server-Sent Event clients
+event_bus = EventBus()
+
+# In-process yt-dlp, used instead of the binary when available
+ytdlp_engine = YtDlpEngine()
+
+# Served on /metrics
+metrics = Registry()
+stage_seconds = metrics.histogram(
+    'downloader_stage_duration_seconds',
+    'Time spent in each pipeline stage: extract, download, postprocess, transcode, tag, thumbnail, fingerprint, scan',
+    ['stage']
+)
+fetched_bytes = metrics.counter('downloader_fetched_bytes_total', 'Audio bytes fetched from YouTube')
+error_counter = metrics.counter('downloader_errors_total', 'Failed attempts by stage and cause', ['stage', 'cause'])
+duplicate_counter = metrics.counter('downloader_duplicates_total', 'Tracks whose recording was already in the library', ['action'])
+metrics.add_textfile(ENHANCER_METRICS_PATH)
+
+# Error message fragments (lowercase) that name the cause of a failed attempt
+ERROR_CAUSES = (
+    ('timeout', ('timed out', 'timeout')),
+    ('rate_limited', ('http error 429', 'too many requests')),
+    ('forbidden', ('http error 403', 'forbidden')),
+    ('unavailable', ('video unavailable', 'private video', 'not available', 'has been removed')),
+    ('sign_in', ('sign in to confirm',)),
+    ('disk', ('no space left', 'disk quota')),
+    ('network', ('connection', 'network is unreachable', 'name resolution', 'ssl')),
+    ('ffmpeg', ('ffmpeg', 'ffprobe', 'postprocessing')),
+)
+
+def classify_error(message):
+    """Short cause of a failed attempt for the error metrics"""
+    message = (message or '').lower()
+    for cause, fragments in ERROR_CAUSES:
+        if any(fragment in message for fragment in fragments):
+            return cause
+    return 'other'
+
+def record_duration(download_id, stage, seconds):
+    """Observe how long a stage took and keep it in the job record"""
+    stage_seconds.observe(seconds, stage=stage)
+    if download_id:
+        job_store.update_json(download_id, 'durations', stage, round(seconds, 3))
+
+def observe_scan(seconds, ok):
+    """Record a Navidrome library scan in the metrics"""
+    stage_seconds.observe(seconds, stage='scan')
+    if not ok:
+        error_counter.inc(stage='scan', cause='scan_failed')
+
+# One Navidrome rescan per window, however many downloads finish in it
+library_scanner = ScanCoordinator(
+    NAVIDROME_URL,
+    username=get_setting('NAVIDROME_USERNAME', get_setting('ADMIN_USERNAME')),
+    password=get_setting('NAVIDROME_PASSWORD', get_setting('ADMIN_PASSWORD')),
+    window_seconds=SCAN_WINDOW_SECONDS,
+    on_scan=observe_scan
+)
+
+def use_inprocess_engine():
+    """Whether downloads run through the in-process yt-dlp engine"""
+    if DOWNLOAD_ENGINE == 'subprocess':
+        return False
+    if not ytdlp_engine.available():
+        if DOWNLOAD_ENGINE == 'python':
+            logger.warning("DOWNLOAD_ENGINE=python but yt_dlp is not installed, using the binary")
+        return False
+    return True
+
+# yt-dlp progress lines, one JSON object per line (with --newline)
+PROGRESS_TEMPLATE = (
+    '{"progress": "%(progress._percent_str)s", "status": "%(progress.status)s", '
+    '"downloaded_bytes": "%(progress.downloaded_bytes)s", "speed": "%(progress.speed)s", '
+    '"playlist_index": "%(info.playlist_index)s", "n_entries": "%(info.n_entries)s"}'
+)
+
+# Library layout, relative to DOWNLOAD_PATH (or the job's staging dir)
+OUTPUT_TEMPLATE = '%(uploader)s/%(title)s.%(ext)s'
+
+# Printed once per finished file, feeds the download archive
+FILE_TEMPLATE = 'after_move:{"filepath": %(filepath)j, "id": %(id)j, "title": %(title)j}'
+
+# Every audio file in the library, so lookups never walk DOWNLOAD_PATH
+library_catalog = LibraryCatalog(
+    CATALOG_DB_PATH,
+    DOWNLOAD_PATH,
+    workers=CATALOG_SCAN_WORKERS,
+    rescan_minutes=CATALOG_RESCAN_MINUTES
+)
+
+# Already downloaded videos, keyed by YouTube video ID
+download_archive = DownloadArchive(ARCHIVE_PATH, DOWNLOAD_PATH, file_exists=library_catalog.exists)
+
+# Spectral fingerprints of library tracks, to catch the same song from another channel
+fingerprint_index = FingerprintIndex(FINGERPRINT_DB_PATH, file_exists=library_catalog.exists)
+
+def find_in_library(video_id, requested_format=None):
+    """Archive entry or catalog file of a video already in the library, or None"""
+    if not video_id:
+        return None
+    entry = download_archive.lookup(video_id, requested_format)
+    if entry:
+        return entry
+    # Files downloaded elsewhere are known by the video ID in their info JSON
+    for found in library_catalog.by_video_id(video_id):
+        if format_matches(found, requested_format):
+            return dict(found, video_id=video_id)
+    return None
+
+# yt-dlp processes of running jobs, so they can be cancelled
+active_processes = {}
+
+# Serializes progress/completion updates of playlist jobs
+parent_lock = threading.Lock()
+
+# Latest (bytes/s, monotonic time) reported by each running download
+transfer_rates = {}
+
+# Rates older than this belong to downloads that have moved on
+TRANSFER_RATE_TTL = 10
+
+def current_throughput():
+    """Combined transfer rate of the running downloads in bytes/s"""
+    cutoff = time.monotonic() - TRANSFER_RATE_TTL
+    for download_id, (_, reported) in list(transfer_rates.items()):
+        if reported < cutoff:
+            transfer_rates.pop(download_id, None)
+    return sum(rate for rate, _ in list(transfer_rates.values()))
+
+def update_status(download_id, **fields):
+    """Update the status record of a download"""
+    job_store.update(download_id, **fields)
+    event_bus.publish(download_id, job_store.get(download_id))
+
+def terminate_download(download_id):
+    """Kill the yt-dlp process of a running download"""
+    process = active_processes.get(download_id)
+    if process and process.poll() is None:
+        logger.info(f"Terminating download process: {download_id}")
+        process.terminate()
+
+download_scheduler = DownloadScheduler(
+    max_workers=MAX_CONCURRENT_DOWNLOADS,
+    on_cancel=terminate_download
+)
+
+# Transcoding and tagging run on their own CPU-sized pool. Its backlog is
+# bounded, so fetch workers stall instead of piling up staged files.
+postprocess_scheduler = DownloadScheduler(
+    max_workers=POSTPROCESS_WORKERS,
+    max_queued=POSTPROCESS_QUEUE,
+    on_cancel=terminate_download,
+    name='postprocess'
+)
+
+# Resizes both pools within their bounds from CPU, IO, bandwidth and disk
+concurrency_controller = ConcurrencyController(
+    download_scheduler,
+    postprocess_scheduler,
+    DOWNLOAD_PATH,
+    throughput=current_throughput,
+    download_bounds=(MIN_CONCURRENT_DOWNLOADS, MAX_ADAPTIVE_DOWNLOADS),
+    postprocess_bounds=(1, POSTPROCESS_WORKERS),
+    interval=CONCURRENCY_INTERVAL,
+    cpu_limit=CPU_PRESSURE_LIMIT,
+    io_limit=IO_PRESSURE_LIMIT,
+    load_limit=LOAD_LIMIT,
+    min_free_mb=MIN_FREE_SPACE_MB
+)
+concurrency_controller.enabled = ADAPTIVE_CONCURRENCY
+
+def job_cancelled(download_id):
+    """Check whether a job has been asked to stop in either stage"""
+    return download_scheduler.is_cancelled(download_id) or postprocess_scheduler.is_cancelled(download_id)
+
+# Backoff timers of tracks waiting to be retried, so a cancel can stop them
+retry_timers = {}
+
+def cancel_job(download_id):
+    """Cancel a job in whichever stage holds it; see DownloadScheduler.cancel.
+
+    A fetch worker queues its track for post-processing before it leaves the
+    download pool, so a job can be in both pools at once: it is cancelled in
+    each, and the post-processing state wins. Returns 'retrying' for a track
+    that was waiting out its retry backoff.
+    """
+    postprocess_state = postprocess_scheduler.cancel(download_id)
+    state = postprocess_state or download_scheduler.cancel(download_id)
+    if postprocess_state:
+        download_scheduler.cancel(download_id)
+    if state is None and cancel_retry(download_id):
+        state = 'retrying'
+    return state
+
+def cancel_retry(download_id):
+    """Stop a pending retry; True if the job was waiting for one"""
+    timer = retry_timers.pop(download_id, None)
+    if timer:
+        timer.cancel()
+    return timer is not None or (job_store.get(download_id) or {}).get('status') == 'retrying'
+
+def resubmit(download_id, url, options, parent_id):
+    """Put a track back in the download backlog once its backoff is over"""
+    retry_timers.pop(download_id, None)
+    if (job_store.get(download_id) or {}).get('status') != 'retrying':
+        return  # Cancelled (or otherwise settled) while waiting
+    download_scheduler.submit(download_id, download_track, url, download_id, options, parent_id)
+
 def check_for_updates():
     """Check GitHub for updates and auto-update if available"""
     try:
@@ -79,6 +384,128 @@ def start_update_checker():
     thread = threading.Thread(target=update_loop, daemon=True)
     thread.start()
 
+def start_job_store_maintenance():
+    """Start background thread that evicts old finished jobs"""
+    def maintenance_loop():
+        while True:
+            try:
+                job_store.prune()
+            except Exception as e:
+                logger.error(f"Job store maintenance failed: {e}")
+            time.sleep(3600)  # Prune every hour
+    
+    thread = threading.Thread(target=maintenance_loop, daemon=True)
+    thread.start()
+
+# Leftovers of interrupted yt-dlp/ffmpeg runs
+PARTIAL_FILE_PATTERNS = ('*.part', '*.part-Frag*', '*.ytdl', '*.temp.*')
+
+# Partial files younger than this may belong to download_music.sh on the host
+ORPHAN_MIN_AGE = 3600
+
+def resume_interrupted_jobs():
+    """Put jobs that were active when the service last stopped back to work.
+
+    Every job is journaled in the job store before it is queued and records
+    each stage it finishes, so it picks up from its last checkpoint: a track
+    fetched into staging goes straight to post-processing, anything else is
+    fetched again and yt-dlp continues the .part file it left behind.
+    """
+    resumed = set()
+    playlists = []
+    for download_id in job_store.ids_with_status(ACTIVE_STATUSES):
+        record = job_store.get(download_id)
+        try:
+            if record.get('is_playlist'):
+                # Its tracks resume on their own; re-check the playlist once they are queued
+                if record.get('status') != 'downloading':
+                    update_status(download_id, status='downloading')
+                playlists.append(download_id)
+            elif resume_job(record):
+                resumed.add(download_id)
+        except Exception as e:
+            update_status(
+                download_id,
+                status='error',
+                message=f'Could not resume after a restart: {e}',
+                end_time=datetime.now().isoformat()
+            )
+            logger.error(f"Failed to resume download {download_id}: {e}")
+    
+    for parent_id in playlists:
+        refresh_parent(parent_id)
+    
+    if resumed:
+        logger.info(f"Resumed {len(resumed)} interrupted downloads")
+    clean_staging(keep=resumed)
+    # Walking a large library takes a while, don't hold up the start for it
+    threading.Thread(target=clean_partial_files, name='orphan-cleanup', daemon=True).start()
+
+def resume_job(record):
+    """Requeue one interrupted job at its last checkpoint; False if it was dropped"""
+    download_id = record['id']
+    parent_id = record.get('parent_id')
+    options = record.get('options')
+    if parent_id:
+        parent = job_store.get(parent_id) or {}
+        if parent.get('status') in FINISHED_STATUSES:
+            mark_cancelled(download_id)
+            return False
+        options = parent.get('options') or {}
+    
+    fetched = record.get('fetched_path')
+    postprocess = (record.get('stages') or {}).get('postprocess') or {}
+    if postprocess.get('state') in ('queued', 'running') and fetched and os.path.exists(fetched):
+        set_stage(
+            download_id,
+            'postprocess',
+            'queued',
+            status='processing',
+            message='Waiting for a free processing slot...'
+        )
+        # Not submit_wait: nothing drains the backlog before the workers start
+        postprocess_scheduler.submit(
+            download_id, postprocess_track, record['url'], download_id, options or {}, parent_id, fetched
+        )
+    elif parent_id:
+        requeue_download(download_id, download_track, record['url'], download_id, options, parent_id)
+    elif options is None:
+        # Jobs from the legacy form download into the library directly
+        requeue_download(download_id, download_music, record['url'], download_id)
+    else:
+        requeue_download(download_id, download_music_enhanced, record['url'], download_id, options)
+    
+    logger.info(f"Resuming interrupted download: {download_id}")
+    return True
+
+def clean_staging(keep=()):
+    """Remove the staging dirs of jobs that won't resume"""
+    try:
+        staged = os.listdir(STAGING_PATH)
+    except FileNotFoundError:
+        return
+    for name in staged:
+        if name not in keep:
+            shutil.rmtree(os.path.join(STAGING_PATH, name), ignore_errors=True)
+            logger.info(f"Removed orphaned staging directory: {name}")
+
+def clean_partial_files():
+    """Remove stale partial downloads and half-converted files from the library"""
+    cutoff = time.time() - ORPHAN_MIN_AGE
+    staging = os.path.abspath(STAGING_PATH)
+    for root, dirs, files in os.walk(DOWNLOAD_PATH):
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != staging]
+        for name in files:
+            if not any(fnmatch.fnmatch(name, pattern) for pattern in PARTIAL_FILE_PATTERNS):
+                continue
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    logger.info(f"Removed orphaned partial file: {path}")
+            except OSError as e:
+                logger.error(f"Could not remove {path}: {e}")
+
 def is_valid_youtube_url(url):
     """Check if URL is a valid YouTube URL"""
     youtube_patterns = [
@@ -93,18 +520,280 @@ def is_valid_youtube_url(url):
             return True
     return False
 
+def parse_progress_line(line):
+    """Parse a PROGRESS_TEMPLATE line into overall percent and raw fields"""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or 'progress' not in data:
+        return None
+
+    try:
+        percent = float(data['progress'].strip().rstrip('%'))
+    except ValueError:
+        return None
+
+    # Spread playlist items over the whole bar instead of restarting at 0
+    try:
+        index = int(data.get('playlist_index'))
+        total = int(data.get('n_entries'))
+        if total > 0:
+            percent = ((index - 1) * 100 + percent) / total
+    except (TypeError, ValueError):
+        pass
+
+    data['percent'] = max(0.0, min(percent, 100.0))
+    return data
+
+def parse_file_line(line):
+    """Parse a FILE_TEMPLATE line into the finished file's details"""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        return None
+    if isinstance(data, dict) and data.get('filepath') and data.get('id'):
+        return data
+    return None
+
+def run_ytdlp(cmd, download_id, timeout=1800, on_progress=None, on_file=None):
+    """Run a yt-dlp command for a download job, in-process when possible"""
+    if not use_inprocess_engine():
+        return run_ytdlp_process(cmd, download_id, timeout, on_progress, on_file)
+
+    try:
+        return ytdlp_engine.run(
+            cmd[1:],
+            timeout=timeout,
+            on_progress=on_progress,
+            on_postprocess=stage_reporter(download_id),
+            on_file=on_file,
+            should_stop=lambda: job_cancelled(download_id)
+        )
+    except DownloadCancelled:
+        raise JobCancelled(download_id)
+
+def run_ytdlp_process(cmd, download_id, timeout=1800, on_progress=None, on_file=None):
+    """Run yt-dlp as a cancellable child process, streaming its progress"""
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1
+    )
+    active_processes[download_id] = process
+
+    # Drain stderr on the side so a chatty process can't block on a full pipe
+    stderr_lines = []
+    stderr_reader = threading.Thread(
+        target=lambda: stderr_lines.extend(process.stderr),
+        daemon=True
+    )
+    stderr_reader.start()
+
+    timed_out = threading.Event()
+    def kill_on_timeout():
+        timed_out.set()
+        process.kill()
+    timer = threading.Timer(timeout, kill_on_timeout)
+    timer.start()
+
+    stdout_lines = []
+    try:
+        # Cancelled between leaving the backlog and starting yt-dlp
+        if job_cancelled(download_id):
+            process.terminate()
+        for line in process.stdout:
+            progress = parse_progress_line(line) if on_progress else None
+            finished = parse_file_line(line) if on_file and not progress else None
+            if progress:
+                on_progress(progress)
+            elif finished:
+                on_file(finished)
+            else:
+                stdout_lines.append(line)
+        process.wait()
+        stderr_reader.join()
+    finally:
+        timer.cancel()
+        active_processes.pop(download_id, None)
+
+    if job_cancelled(download_id):
+        raise JobCancelled(download_id)
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+
+    return subprocess.CompletedProcess(cmd, process.returncode, ''.join(stdout_lines), ''.join(stderr_lines))
+
+def progress_reporter(download_id, scale=90, parent_id=None):
+    """Build an on_progress callback that writes progress into the job record"""
+    last = {'percent': -1}
+
+    def report(progress):
+        try:
+            transfer_rates[download_id] = (float(progress.get('speed') or 0), time.monotonic())
+        except (TypeError, ValueError):
+            pass  # 'NA' before yt-dlp knows the speed
+        percent = round(progress['percent'] * scale / 100, 1)
+        # Only persist whole-percent steps, yt-dlp reports many times a second
+        if int(percent) == int(last['percent']):
+            return
+        last['percent'] = percent
+        update_status(download_id, progress=percent)
+        if parent_id:
+            refresh_parent(parent_id)
+
+    return report
+
+def stage_reporter(download_id):
+    """Build an on_postprocess callback that records the post-processing step"""
+    messages = {
+        'transcode': 'Converting audio...',
+        'tag': 'Writing tags...',
+        'thumbnail': 'Embedding thumbnail...',
+    }
+
+    started = {}
+
+    def report(stage, state):
+        if state == 'started':
+            started[stage] = time.monotonic()
+            update_status(download_id, stage=stage, message=messages.get(stage, f'{stage}...'))
+        elif state == 'finished' and stage in messages and stage in started:
+            record_duration(download_id, stage, time.monotonic() - started.pop(stage))
+
+    return report
+
+def archive_recorder(download_id):
+    """Build an on_file callback that adds finished files to the download archive"""
+    def record(finished):
+        download_archive.add(finished['id'], finished['filepath'], title=finished.get('title'))
+        library_catalog.index_file(finished['filepath'])
+        update_status(download_id, filepath=finished['filepath'])
+
+    return record
+
+def mark_already_downloaded(download_id, entry):
+    """Complete a download whose video is already in the archive"""
+    update_status(
+        download_id,
+        status='completed',
+        progress=100,
+        message='Already downloaded, skipped',
+        filepath=entry['path'],
+        skipped=True,
+        end_time=datetime.now().isoformat()
+    )
+    logger.info(f"Skipping archived video {entry['video_id']} (ID: {download_id})")
+
+# Files yt-dlp leaves next to a track, moved with it
+SIDECAR_EXTENSIONS = ('.info.json', '.webp', '.jpg', '.png')
+
+def quarantine_track(path):
+    """Move a track and its sidecars out of the library; returns where the track went"""
+    target = quarantine(path, DOWNLOAD_PATH, QUARANTINE_PATH, SIDECAR_EXTENSIONS)
+    fingerprint_index.remove(path)
+    library_catalog.remove(path)
+    return target
+
+def check_duplicate(url, download_id):
+    """Fingerprint a finished track; returns job fields if its recording was already in the library"""
+    path = (job_store.get(download_id) or {}).get('filepath')
+    if DUPLICATE_ACTION == 'off' or not path or not fingerprint_index.available():
+        return {}
+
+    update_status(download_id, message='Checking for duplicates...')
+    started = time.monotonic()
+    try:
+        match = fingerprint_index.check(path)
+    except Exception as e:
+        logger.warning(f"Could not fingerprint {path}: {e}")
+        return {}
+    record_duration(download_id, 'fingerprint', time.monotonic() - started)
+    if not match:
+        return {}
+
+    duplicate_counter.inc(action=DUPLICATE_ACTION)
+    original = os.path.relpath(match['path'], DOWNLOAD_PATH)
+    if DUPLICATE_ACTION == 'skip':
+        quarantined = quarantine_track(path)
+        # Later requests for this video find the copy that was kept
+        video_id = extract_video_id(url)
+        if video_id:
+            download_archive.add(video_id, match['path'])
+        logger.info(
+            f"Quarantined {path} as {quarantined}, same recording as {match['path']} "
+            f"(BER {match['ber']}, ID: {download_id})"
+        )
+        return {
+            'message': f'Same recording as {original}, moved to quarantine',
+            'filepath': match['path'],
+            'duplicate_of': match['path'],
+            'duplicate_ber': match['ber'],
+            'quarantined': quarantined,
+            'skipped': True
+        }
+
+    logger.info(f"{path} looks like a duplicate of {match['path']} (BER {match['ber']}, ID: {download_id})")
+    return {
+        'message': f'Download completed, possible duplicate of {original}',
+        'duplicate_of': match['path'],
+        'duplicate_ber': match['ber']
+    }
+
+# Job-record timestamp set when a pipeline stage enters a state
+STAGE_TIMESTAMPS = {'queued': 'queued_at', 'running': 'started_at'}
+
+def set_stage(download_id, stage, state, **fields):
+    """Record the state of one pipeline stage (fetch, postprocess) in the job record"""
+    entry = {'state': state, STAGE_TIMESTAMPS.get(state, 'finished_at'): datetime.now().isoformat()}
+    job_store.update_json(download_id, 'stages', stage, entry, **fields)
+    event_bus.publish(download_id, job_store.get(download_id))
+
+def discard_staging(download_id):
+    """Remove whatever a job left in the staging directory"""
+    shutil.rmtree(staging_dir(download_id), ignore_errors=True)
+
+def mark_cancelled(download_id):
+    """Record that a download was cancelled"""
+    update_status(
+        download_id,
+        status='cancelled',
+        message='Download cancelled',
+        end_time=datetime.now().isoformat()
+    )
+
+# Requested formats that keep whatever codec YouTube serves
+PASSTHROUGH_FORMATS = ('best', 'native')
+
+# Stream selectors for formats YouTube serves natively, so they are only remuxed
+NATIVE_AUDIO_STREAMS = {
+    'opus': 'bestaudio[acodec=opus]',
+    'vorbis': 'bestaudio[acodec=vorbis]',
+    'm4a': 'bestaudio[ext=m4a]',
+    'aac': 'bestaudio[ext=m4a]',
+}
+
 def download_music(url, download_id):
     """Download music using yt-dlp"""
     try:
-        download_status[download_id] = {
-            'status': 'starting',
-            'progress': 0,
-            'message': 'Initializing download...',
-            'start_time': datetime.now().isoformat()
-        }
+        update_status(
+            download_id,
+            status='starting',
+            progress=0,
+            message='Initializing download...',
+            start_time=datetime.now().isoformat()
+        )
         
         logger.info(f"Starting download: {url} (ID: {download_id})")
         
+        # Skip videos that are already in the library
+        archived = find_in_library(extract_video_id(url), 'mp3')
+        if archived:
+            mark_already_downloaded(download_id, archived)
+            return
+        
         # Build yt-dlp command
         cmd = [
             'yt-dlp',
@@ -115,38 +804,55 @@ def download_music(url, download_id):
             '--embed-thumbnail',
             '--restrict-filenames',
             '--no-warnings',
-            '--progress-template', '{"progress": "%(progress._percent_str)s", "status": "%(progress.status)s"}',
+            '--progress',
+            '--newline',
+            '--progress-template', PROGRESS_TEMPLATE,
+            '--print', FILE_TEMPLATE,
             '-o', f'{DOWNLOAD_PATH}/%(uploader)s/%(title)s.%(ext)s',
             url
         ]
         
-        download_status[download_id]['status'] = 'downloading'
-        download_status[download_id]['message'] = 'Downloading...'
+        update_status(download_id, status='downloading', message='Downloading...')
         
         # Execute yt-dlp
-        process = subprocess.run(
+        process = run_ytdlp(
             cmd,
-            capture_output=True,
-            text=True,
-            timeout=1800  # 30 minute timeout
+            download_id,
+            on_progress=progress_reporter(download_id, scale=100),
+            on_file=archive_recorder(download_id)
         )
         
         if process.returncode == 0:
-            download_status[download_id]['status'] = 'completed'
-            download_status[download_id]['progress'] = 100
-            download_status[download_id]['message'] = 'Download completed successfully!'
-            download_status[download_id]['end_time'] = datetime.now().isoformat()
+            update_status(
+                download_id,
+                status='completed',
+                progress=100,
+                message='Download completed successfully!',
+                end_time=datetime.now().isoformat()
+            )
+            library_scanner.request(download_id)
             logger.info(f"Download completed: {url} (ID: {download_id})")
         else:
-            download_status[download_id]['status'] = 'error'
-            download_status[download_id]['message'] = f'Download failed: {process.stderr}'
-            download_status[download_id]['end_time'] = datetime.now().isoformat()
+            update_status(
+                download_id,
+                status='error',
+                message=f'Download failed: {process.stderr}',
+                end_time=datetime.now().isoformat()
+            )
             logger.error(f"Download failed: {url} (ID: {download_id}) - {process.stderr}")
     
+    except JobCancelled:
+        mark_cancelled(download_id)
+        raise
+    
     except subprocess.TimeoutExpired:
-        download_status[download_id]['status'] = 'error'
-        download_status[download_id]['message'] = 'Download timed out'
-        download_status[download_id]['end_time'] = datetime.now().isoformat()
+        update_status(
+            download_id,
+            status='error',
+            message='Download timed out',
+            end_time=datetime.now().isoformat()
+        )
+
 def create_navidrome_playlist(playlist_name, track_ids):
     """Create a playlist in Navidrome"""
     try:
@@ -161,6 +867,10 @@ def create_navidrome_playlist(playlist_name, track_ids):
 def extract_playlist_info(url):
     """Extract playlist information from YouTube URL"""
     try:
+        if use_inprocess_engine():
+            info = ytdlp_engine.extract_flat(url)
+            return info.get('title') or 'Unknown Playlist'
+        
         cmd = ['yt-dlp', '--flat-playlist', '--print', 'title', '--print', 'id', url]
         result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
         
@@ -173,132 +883,711 @@ def extract_playlist_info(url):
         logger.error(f"Failed to extract playlist info: {e}")
         return 'Unknown Playlist'
 
+def list_playlist_entries(url):
+    """Return the title and the unique entries of a playlist without downloading it"""
+    if use_inprocess_engine():
+        info = ytdlp_engine.extract_flat(url, timeout=120)
+    else:
+        cmd = ['yt-dlp', '--flat-playlist', '--dump-single-json', '--no-warnings', url]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or 'Could not read playlist')
+        info = json.loads(result.stdout)
+    
+    entries = []
+    seen = set()
+    for entry in info.get('entries') or []:
+        video_id = (entry or {}).get('id')
+        if not video_id or video_id in seen:
+            continue
+        seen.add(video_id)
+        entries.append({
+            'id': video_id,
+            'title': entry.get('title'),
+            'url': f'https://www.youtube.com/watch?v={video_id}'
+        })
+    
+    return info.get('title') or 'Unknown Playlist', entries
+
+def audio_stream_selector(options):
+    """yt-dlp format selector that prefers a stream already in the requested codec"""
+    fmt = (options.get('format') or 'mp3').lower()
+    native = NATIVE_AUDIO_STREAMS.get(fmt)
+    return f'{native}/bestaudio/best' if native else 'bestaudio/best'
+
+def audio_convert_args(options):
+    """yt-dlp arguments that only transcode when the requested codec isn't served natively"""
+    fmt = (options.get('format') or 'mp3').lower()
+    quality = options.get('quality') or 'best'
+    
+    if fmt in PASSTHROUGH_FORMATS:
+        # Keep the best native stream; ffmpeg only remuxes it into an audio file
+        return ['--extract-audio', '--audio-format', 'best']
+    
+    # yt-dlp copies the audio instead of re-encoding when the stream's codec matches
+    return [
+        '--extract-audio',
+        '--audio-format', fmt,
+        '--audio-quality', '0' if quality == 'best' else quality
+    ]
+
+def staging_dir(download_id):
+    """Directory a job's fetched files wait in until post-processing moves them"""
+    return os.path.join(STAGING_PATH, download_id)
+
+def build_fetch_cmd(url, download_id, options):
+    """Build the yt-dlp command that only downloads a video's audio into staging"""
+    return [
+        'yt-dlp',
+        '-f', audio_stream_selector(options),
+        '--restrict-filenames',
+        '--no-warnings',
+        '--no-playlist',
+        '--write-info-json',
+        '--write-thumbnail',
+        '--progress',  # --print implies --quiet
+        '--newline',
+        '--progress-template', PROGRESS_TEMPLATE,
+        '--print', FILE_TEMPLATE,
+        '-P', staging_dir(download_id),
+        '-o', OUTPUT_TEMPLATE,
+        url
+    ]
+
+def build_postprocess_cmd(info_json, download_id, options):
+    """Build the yt-dlp command that converts and tags a fetched file into the library.
+
+    It replays the fetch's info JSON with the same format selector, so yt-dlp
+    finds the staged file and goes straight to its postprocessors without
+    touching the network.
+    """
+    return [
+        'yt-dlp',
+        '--load-info-json', info_json,
+        '-f', audio_stream_selector(options),
+        *audio_convert_args(options),
+        '--embed-metadata',
+        '--embed-thumbnail',
+        '--add-metadata',
+        '--restrict-filenames',
+        '--no-warnings',
+        '--write-info-json',
+        '--write-thumbnail',
+        '--print', FILE_TEMPLATE,
+        '-P', f'home:{DOWNLOAD_PATH}',
+        '-P', f'temp:{staging_dir(download_id)}',
+        '-o', OUTPUT_TEMPLATE
+    ]
+
 def download_music_enhanced(url, download_id, options=None):
     """Enhanced download with playlist support"""
+    options = options or {}
+    
+    if 'playlist?list=' in url:
+        expand_playlist(url, download_id, options)
+    else:
+        download_track(url, download_id, options)
+
+def expand_playlist(url, download_id, options):
+    """Turn a playlist job into one child job per entry"""
     try:
-        options = options or {}
-        download_status[download_id] = {
-            'status': 'starting',
-            'progress': 0,
-            'message': 'Initializing download...',
-            'start_time': datetime.now().isoformat()
-        }
+        update_status(
+            download_id,
+            status='starting',
+            progress=0,
+            message='Reading playlist...',
+            start_time=datetime.now().isoformat()
+        )
         
-        logger.info(f"Starting enhanced download: {url} (ID: {download_id})")
+        logger.info(f"Expanding playlist: {url} (ID: {download_id})")
+        started = time.monotonic()
+        title, entries = list_playlist_entries(url)
+        record_duration(download_id, 'extract', time.monotonic() - started)
         
-        # Check if it's a playlist
-        is_playlist = 'playlist?list=' in url
-        playlist_name = None
+        if download_scheduler.is_cancelled(download_id):
+            raise JobCancelled(download_id)
         
-        if is_playlist and options.get('createPlaylist'):
-            playlist_name = options.get('playlistName')
-            if not playlist_name:
-                playlist_name = extract_playlist_info(url)
-            
-            download_status[download_id]['message'] = f'Creating playlist: {playlist_name}'
+        if not entries:
+            update_status(
+                download_id,
+                status='error',
+                message='Playlist is empty or unavailable',
+                end_time=datetime.now().isoformat()
+            )
+            return
         
-        # Build enhanced yt-dlp command
-        cmd = [
-            'yt-dlp',
-            '--extract-audio',
-            '--audio-format', options.get('format', 'mp3'),
-            '--audio-quality', options.get('quality', 'best'),
-            '--embed-metadata',
-            '--embed-thumbnail',
-            '--add-metadata',
-            '--restrict-filenames',
-            '--no-warnings',
-            '--write-info-json',
-            '--write-thumbnail',
-            '-o', f'{DOWNLOAD_PATH}/%(uploader)s/%(title)s.%(ext)s',
-        ]
+        queue_playlist_tracks(download_id, entries, options, options.get('playlistName') or title)
+    
+    except JobCancelled:
+        mark_cancelled(download_id)
+        raise
+    
+    except Exception as e:
+        update_status(
+            download_id,
+            status='error',
+            message=f'Error: {str(e)}',
+            end_time=datetime.now().isoformat()
+        )
+        logger.error(f"Playlist expansion failed: {url} (ID: {download_id}) - {str(e)}")
+
+def queue_playlist_tracks(download_id, entries, options, playlist_name):
+    """Queue one child job per playlist entry that isn't downloaded yet"""
+    # Only tracks that aren't in the library yet become jobs
+    missing = {e['id'] for e in entries if not find_in_library(e['id'], options.get('format'))}
+    skipped = len(entries) - len(missing)
+    
+    update_status(
+        download_id,
+        status='downloading',
+        message=f'Downloading {len(missing)} tracks ({skipped} already downloaded)...',
+        is_playlist=True,
+        playlist_name=playlist_name,
+        skipped_tracks=skipped,
+        tracks={'total': len(entries), 'completed': skipped, 'failed': 0, 'active': len(missing)}
+    )
+    
+    if not missing:
+        refresh_parent(download_id)
+        return
+    
+    # Tracks go through the same worker pool as every other download
+    for index, entry in enumerate(entries, start=1):
+        if entry['id'] not in missing:
+            continue
+        child_id = f'{download_id}_{index:04d}'
+        queue_download(
+            child_id, entry['url'],
+            download_track, entry['url'], child_id, options, download_id,
+            parent_id=download_id,
+            title=entry['title'],
+            video_id=entry['id'],
+            playlist_index=index
+        )
+    
+    logger.info(f"Queued {len(missing)} tracks for playlist: {playlist_name} (ID: {download_id})")
+
+def queue_monitored_entries(url, title, entries):
+    """Queue the new entries of a monitored playlist as one playlist job"""
+    download_id = f"mon_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    options = {
+        'quality': get_setting('AUDIO_QUALITY', 'best'),
+        'format': get_setting('AUDIO_FORMAT', 'mp3')
+    }
+    
+    job_store.create(
+        download_id,
+        url=url,
+        status='starting',
+        progress=0,
+        message=f'{len(entries)} new tracks in monitored playlist',
+        start_time=datetime.now().isoformat(),
+        options=options,
+        monitored=True
+    )
+    queue_playlist_tracks(download_id, entries, options, title)
+
+def dispatch_queued_url(url):
+    """Start a download for a URL from the queue file and return its job ID"""
+    download_id = f"queue_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    options = {
+        'quality': get_setting('AUDIO_QUALITY', 'best'),
+        'format': get_setting('AUDIO_FORMAT', 'mp3')
+    }
+    queue_download(download_id, url, download_music_enhanced, url, download_id, options, options=options, source='queue')
+    return download_id
+
+# Feeds /api/queue entries to the scheduler a few at a time
+queue_consumer = QueueConsumer(
+    QUEUE_FILE,
+    QUEUE_DB_PATH,
+    dispatch=dispatch_queued_url,
+    backlog=lambda: len(download_scheduler.snapshot()['queued']),
+    max_backlog=QUEUE_MAX_BACKLOG,
+    off_peak_window=QUEUE_OFF_PEAK_WINDOW,
+    playlists_off_peak=QUEUE_PLAYLISTS_OFF_PEAK,
+    job_status=lambda job_id: (job_store.get(job_id) or {}).get('status')
+)
+
+def worker_counts(field):
+    """Busy ('running') or configured ('max_workers') workers per pool, for the gauges"""
+    counts = {}
+    for name, pool in (('download', download_scheduler), ('postprocess', postprocess_scheduler)):
+        value = pool.snapshot()[field]
+        counts[(name,)] = len(value) if field == 'running' else value
+    return counts
+
+metrics.gauge('downloader_queue_depth', 'Jobs waiting in each queue', ['queue'], collect=lambda: {
+    ('download',): len(download_scheduler.snapshot()['queued']),
+    ('postprocess',): len(postprocess_scheduler.snapshot()['queued']),
+    ('batch',): queue_consumer.status()['pending'],
+})
+metrics.gauge('downloader_workers_busy', 'Workers running a job', ['pool'], collect=lambda: worker_counts('running'))
+metrics.gauge('downloader_workers_max', 'Current size of each worker pool', ['pool'], collect=lambda: worker_counts('max_workers'))
+metrics.gauge('downloader_throughput_bytes_per_second', 'Combined transfer rate of running downloads', collect=current_throughput)
+metrics.gauge('downloader_jobs', 'Jobs in the job store by status', ['status'], collect=lambda: {
+    (status,): count for status, count in job_store.stats()['by_status'].items()
+})
+
+def download_track(url, download_id, options, parent_id=None):
+    """Fetch a single video's audio and hand it to the post-processing pool"""
+    record = job_store.get(download_id) or {}
+    if record.get('status') == 'cancelled':
+        return
+    
+    attempt = record.get('attempts', 0) + 1
+    error = None
+    
+    # Skip videos that are already in the library
+    archived = find_in_library(extract_video_id(url), options.get('format'))
+    if archived:
+        mark_already_downloaded(download_id, archived)
+        if parent_id:
+            refresh_parent(parent_id)
+        return
+    
+    try:
+        update_status(
+            download_id,
+            status='downloading',
+            progress=0,
+            attempts=attempt,
+            message='Downloading audio...' if attempt == 1 else f'Downloading audio (attempt {attempt})...',
+            start_time=datetime.now().isoformat()
+        )
+        set_stage(download_id, 'fetch', 'running')
         
-        # Add playlist-specific options
-        if is_playlist:
-            cmd.extend(['--yes-playlist', '--write-playlist-metafiles'])
+        logger.info(f"Starting enhanced download: {url} (ID: {download_id})")
         
-        cmd.append(url)
+        fetched = {}
+        report_progress = progress_reporter(download_id, parent_id=parent_id)
+        timing = {'started': time.monotonic()}
         
-        download_status[download_id]['status'] = 'downloading'
-        download_status[download_id]['message'] = 'Downloading audio...'
+        def on_progress(progress):
+            # Until the first progress line yt-dlp is extracting the video info
+            timing.setdefault('first_progress', time.monotonic())
+            report_progress(progress)
         
-        # Execute yt-dlp
-        process = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=1800  # 30 minute timeout
+        process = run_ytdlp(
+            build_fetch_cmd(url, download_id, options),
+            download_id,
+            on_progress=on_progress,
+            on_file=fetched.update
+        )
+        
+        if process.returncode == 0 and fetched.get('filepath'):
+            finished = time.monotonic()
+            first_progress = timing.get('first_progress', finished)
+            record_duration(download_id, 'extract', first_progress - timing['started'])
+            record_duration(download_id, 'download', finished - first_progress)
+            try:
+                fetched_bytes.inc(os.path.getsize(fetched['filepath']))
+            except OSError:
+                pass
+            set_stage(download_id, 'fetch', 'completed')
+            set_stage(
+                download_id,
+                'postprocess',
+                'queued',
+                status='processing',
+                message='Waiting for a free processing slot...',
+                fetched_path=fetched['filepath']
+            )
+            # Blocks this fetch worker while the post-processing backlog is full
+            postprocess_scheduler.submit_wait(
+                download_id, postprocess_track, url, download_id, options, parent_id, fetched['filepath']
+            )
+            if download_scheduler.is_cancelled(download_id):
+                # Cancelled while waiting for room in the post-processing backlog
+                postprocess_scheduler.cancel(download_id)
+                raise JobCancelled(download_id)
+            logger.info(f"Fetched audio, queued for post-processing: {url} (ID: {download_id})")
+        elif process.returncode == 0:
+            error = 'Download failed: yt-dlp did not report a file'
+        else:
+            error = f'Download failed: {process.stderr}'
+    
+    except JobCancelled:
+        mark_cancelled(download_id)
+        discard_staging(download_id)
+        if parent_id:
+            refresh_parent(parent_id)
+        raise
+    
+    except subprocess.TimeoutExpired:
+        error = 'Download timed out'
+    
+    except Exception as e:
+        error = f'Error: {str(e)}'
+    
+    if error:
+        set_stage(download_id, 'fetch', 'error')
+        retry_or_fail(url, download_id, options, parent_id, attempt, error, 'fetch')
+    
+    if parent_id:
+        refresh_parent(parent_id)
+
+def postprocess_track(url, download_id, options, parent_id, fetched_path):
+    """Convert, tag and move a fetched track into the library"""
+    record = job_store.get(download_id) or {}
+    if record.get('status') == 'cancelled':
+        # Cancelled between the hand-off and a post-processing worker picking it up
+        discard_staging(download_id)
+        if parent_id:
+            refresh_parent(parent_id)
+        return
+    attempt = record.get('attempts', 1)
+    error = None
+    info_json = os.path.splitext(fetched_path)[0] + '.info.json'
+    
+    try:
+        set_stage(download_id, 'postprocess', 'running', message='Processing audio...')
+        
+        started = time.monotonic()
+        process = run_ytdlp(
+            build_postprocess_cmd(info_json, download_id, options),
+            download_id,
+            on_file=archive_recorder(download_id)
         )
         
         if process.returncode == 0:
-            download_status[download_id]['status'] = 'processing'
-            download_status[download_id]['progress'] = 90
-            download_status[download_id]['message'] = 'Processing metadata...'
-            
-            # Create Navidrome playlist if requested
-            if is_playlist and options.get('createPlaylist') and playlist_name:
-                # Trigger Navidrome scan
-                subprocess.run(['docker', 'exec', 'navidrome', '/app/navidrome', '--configfile', '/data/navidrome.toml', 'scan'], 
-                             capture_output=True)
-                
-                # Add to monitoring if requested
-                if options.get('monitorPlaylist'):
-                    add_to_monitoring(url, playlist_name)
-            
-            download_status[download_id]['status'] = 'completed'
-            download_status[download_id]['progress'] = 100
-            download_status[download_id]['message'] = 'Download completed successfully!'
-            download_status[download_id]['end_time'] = datetime.now().isoformat()
+            record_duration(download_id, 'postprocess', time.monotonic() - started)
+            duplicate = check_duplicate(url, download_id)
+            set_stage(
+                download_id,
+                'postprocess',
+                'completed',
+                status='completed',
+                progress=100,
+                message=duplicate.pop('message', 'Download completed successfully!'),
+                end_time=datetime.now().isoformat(),
+                **duplicate
+            )
+            discard_staging(download_id)
+            if not parent_id:
+                library_scanner.request(download_id)
             logger.info(f"Enhanced download completed: {url} (ID: {download_id})")
-            
         else:
-            download_status[download_id]['status'] = 'error'
-            download_status[download_id]['message'] = f'Download failed: {process.stderr}'
-            download_status[download_id]['end_time'] = datetime.now().isoformat()
-            logger.error(f"Enhanced download failed: {url} (ID: {download_id}) - {process.stderr}")
+            error = f'Post-processing failed: {process.stderr}'
+    
+    except JobCancelled:
+        mark_cancelled(download_id)
+        discard_staging(download_id)
+        if parent_id:
+            refresh_parent(parent_id)
+        raise
     
     except subprocess.TimeoutExpired:
-        download_status[download_id]['status'] = 'error'
-        download_status[download_id]['message'] = 'Download timed out'
-        download_status[download_id]['end_time'] = datetime.now().isoformat()
-        logger.error(f"Enhanced download timed out: {url} (ID: {download_id})")
+        error = 'Post-processing timed out'
     
     except Exception as e:
-        download_status[download_id]['status'] = 'error'
-        download_status[download_id]['message'] = f'Error: {str(e)}'
-        download_status[download_id]['end_time'] = datetime.now().isoformat()
-        logger.error(f"Enhanced download error: {url} (ID: {download_id}) - {str(e)}")
+        error = f'Error: {str(e)}'
+    
+    if error:
+        set_stage(download_id, 'postprocess', 'error')
+        retry_or_fail(url, download_id, options, parent_id, attempt, error, 'postprocess')
+    
+    if parent_id:
+        refresh_parent(parent_id)
+
+def retry_or_fail(url, download_id, options, parent_id, attempt, error, stage):
+    """Schedule another attempt of a failed track, or fail it for good.
+
+    Retries start over at the fetch stage, which finds a file that was already
+    fetched in staging and skips the download.
+    """
+    error_counter.inc(stage=stage, cause=classify_error(error))
+    if attempt < DOWNLOAD_RETRIES:
+        # Back off outside the worker pool, then rejoin the end of the backlog
+        delay = RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+        update_status(download_id, status='retrying', message=f'{error} (retrying in {delay}s)')
+        logger.warning(f"Enhanced download failed, retrying in {delay}s: {url} (ID: {download_id}) - {error}")
+        
+        timer = threading.Timer(delay, resubmit, args=(download_id, url, options, parent_id))
+        timer.daemon = True
+        retry_timers[download_id] = timer
+        timer.start()
+    else:
+        update_status(
+            download_id,
+            status='error',
+            message=error,
+            end_time=datetime.now().isoformat()
+        )
+        discard_staging(download_id)
+        logger.error(f"Enhanced download failed: {url} (ID: {download_id}) - {error}")
+
+def refresh_parent(parent_id):
+    """Recompute a playlist job from its tracks and finish it once they are done"""
+    with parent_lock:
+        parent = job_store.get(parent_id)
+        if parent is None or parent.get('status') != 'downloading':
+            return
+        
+        # Tracks skipped via the archive have no child job but count as done
+        skipped = parent.get('skipped_tracks', 0)
+        summary = job_store.child_summary(parent_id)
+        by_status = summary['by_status']
+        total = summary['total'] + skipped
+        completed = by_status.get('completed', 0) + skipped
+        failed = by_status.get('error', 0) + by_status.get('cancelled', 0)
+        tracks = {
+            'total': total,
+            'completed': completed,
+            'failed': failed,
+            'active': total - completed - failed
+        }
+        
+        if tracks['active']:
+            progress = (summary['progress'] * summary['total'] + skipped * 100) / total
+            update_status(
+                parent_id,
+                progress=round(min(progress, 99), 1),
+                tracks=tracks,
+                message=f'Downloaded {completed} of {total} tracks...'
+            )
+            return
+        
+        # Claim the playlist so no other finishing track runs the final steps
+        update_status(parent_id, status='processing', tracks=tracks, message='Processing metadata...')
+    
+    finish_playlist(parent, tracks)
+
+def finish_playlist(parent, tracks):
+    """Run the end-of-playlist steps and record the outcome"""
+    parent_id = parent['id']
+    options = parent.get('options') or {}
+    playlist_name = parent.get('playlist_name')
+    
+    # Pick up the new files in Navidrome with the next coalesced scan
+    if tracks['completed'] > parent.get('skipped_tracks', 0):
+        library_scanner.request(parent_id)
+    
+    # Add to monitoring if requested
+    if tracks['completed'] and options.get('createPlaylist') and playlist_name:
+        if options.get('monitorPlaylist'):
+            add_to_monitoring(parent['url'], playlist_name)
+    
+    if tracks['failed']:
+        update_status(
+            parent_id,
+            status='error',
+            progress=round(tracks['completed'] * 100 / tracks['total'], 1),
+            message=f"{tracks['failed']} of {tracks['total']} tracks failed, retry to download only those",
+            end_time=datetime.now().isoformat()
+        )
+        logger.error(f"Playlist finished with {tracks['failed']} failed tracks (ID: {parent_id})")
+    else:
+        update_status(
+            parent_id,
+            status='completed',
+            progress=100,
+            message=f"Downloaded all {tracks['total']} tracks successfully!",
+            end_time=datetime.now().isoformat()
+        )
+        logger.info(f"Playlist completed: {playlist_name} (ID: {parent_id})")
+
+def queue_download(download_id, url, func, *args, **fields):
+    """Register a download as queued and hand it to the scheduler"""
+    job_store.create(
+        download_id,
+        url=url,
+        status='queued',
+        progress=0,
+        message='Waiting for a free download slot...',
+        queued_time=datetime.now().isoformat(),
+        **fields
+    )
+    event_bus.publish(download_id, job_store.get(download_id))
+    download_scheduler.submit(download_id, func, *args)
+
+def requeue_download(download_id, func, *args, **fields):
+    """Put an existing job back into the backlog"""
+    update_status(
+        download_id,
+        status='queued',
+        progress=0,
+        message='Waiting for a free download slot...',
+        end_time=None,
+        **fields
+    )
+    download_scheduler.submit(download_id, func, *args)
+
+def get_download(download_id):
+    """Return a download's status record, or None if unknown"""
+    record = job_store.get(download_id)
+    if record is None:
+        return None
+    if record.get('status') == 'queued':
+        if leader.is_leader:
+            record['queue_position'] = download_scheduler.position(download_id)
+        else:
+            record['queue_position'] = leader_backlog().get(download_id)
+    return record
+
+# Multi-worker mode (gunicorn.conf.py): job records live in SQLite and every
+# worker serves them, but the schedulers, the SSE event bus and the background
+# loops only exist in the leader. Followers forward the routes that need them.
+leader = LeaderElection(LEADER_LOCK_PATH)
+
+# Tells the leader which follower forwarded a request; for logs only, never trusted
+FORWARDED_HEADER = 'X-Forwarded-By-Worker'
+# Set in the WSGI environ of requests that came in through the leader's
+# internal server, which only listens on loopback for followers
+INTERNAL_ENVIRON_KEY = 'downloader.internal'
+
+# Headers that belong to one connection and are not passed along
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+    'trailers', 'transfer-encoding', 'upgrade', 'host', 'content-length', 'content-encoding',
+}
+
+# Seconds a follower reuses the leader's backlog for queue positions
+BACKLOG_CACHE_SECONDS = 1
+backlog_cache = {'fetched': 0, 'positions': {}}
+
+def leader_address():
+    """host:port of the leader's internal server, or None"""
+    current = leader.leader()
+    return current.get('address') if current else None
+
+def forward_to_leader():
+    """Pass the current request to the leader worker and stream its answer back"""
+    address = leader_address()
+    if not address:
+        return jsonify({'error': 'No leader worker is available yet, try again'}), 503
+    headers = {key: value for key, value in request.headers if key.lower() not in HOP_BY_HOP_HEADERS}
+    headers[FORWARDED_HEADER] = str(os.getpid())
+    try:
+        upstream = requests.request(
+            request.method,
+            f'http://{address}{request.full_path}',
+            headers=headers,
+            data=request.get_data(),
+            stream=True,
+            allow_redirects=False,
+            timeout=(2, None)  # SSE streams stay open
+        )
+    except requests.RequestException as e:
+        logger.warning(f"Could not reach the leader worker at {address}: {e}")
+        return jsonify({'error': 'Leader worker unavailable, try again'}), 503
+    return app.response_class(
+        upstream.iter_content(chunk_size=None),
+        status=upstream.status_code,
+        headers=[(key, value) for key, value in upstream.headers.items() if key.lower() not in HOP_BY_HOP_HEADERS]
+    )
+
+def leader_only(view):
+    """Serve a route from the leader worker, which holds the schedulers and background loops"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if leader.is_leader:
+            return view(*args, **kwargs)
+        if request.environ.get(INTERNAL_ENVIRON_KEY):
+            # Only a former leader's server gets here; never forward a request twice
+            return jsonify({'error': 'No leader worker is available yet, try again'}), 503
+        return forward_to_leader()
+    return wrapper
+
+def leader_backlog():
+    """{download ID: queue position} from the leader's scheduler, cached briefly"""
+    if time.monotonic() - backlog_cache['fetched'] < BACKLOG_CACHE_SECONDS:
+        return backlog_cache['positions']
+    positions = {}
+    address = leader_address()
+    if address:
+        try:
+            response = requests.get(f'http://{address}/api/scheduler', timeout=2)
+            positions = {job_id: index for index, job_id in enumerate(response.json()['queued'], start=1)}
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.warning(f"Could not read the leader's backlog: {e}")
+    backlog_cache.update(fetched=time.monotonic(), positions=positions)
+    return positions
+
+def start_internal_server():
+    """Serve the app on a loopback port for requests forwarded by followers"""
+    def internal_app(environ, start_response):
+        environ[INTERNAL_ENVIRON_KEY] = True
+        return app(environ, start_response)
+
+    server = make_server('127.0.0.1', 0, internal_app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='leader-server', daemon=True).start()
+    return f'127.0.0.1:{server.server_port}'
+
+def start_leader_tasks(serve_internal=False):
+    """Start everything that must run exactly once per server"""
+    if serve_internal:
+        leader.publish(start_internal_server())
+    resume_interrupted_jobs()
+    if AUTO_UPDATE:
+        start_update_checker()
+    start_job_store_maintenance()
+    playlist_monitor.start()
+    library_scanner.start()
+    library_catalog.start()
+    if DUPLICATE_ACTION != 'off' and not fingerprint_index.available():
+        logger.warning("DUPLICATE_ACTION is set but NumPy or ffmpeg is missing, duplicates go undetected")
+    if use_inprocess_engine():
+        ytdlp_engine.warm_up()
+    download_scheduler.start()
+    postprocess_scheduler.start()
+    concurrency_controller.start()
+    queue_consumer.start()
+
+def start_services(serve_internal=False):
+    """Join the leader election; the winner starts the background work.
+
+    A follower keeps retrying, so when the leader worker exits another one
+    takes over and resumes its interrupted downloads.
+    """
+    leader.start(lambda: start_leader_tasks(serve_internal))
+
+def monitored_playlists():
+    """Read MONITOR_PLAYLISTS fresh from config.env"""
+    value = os.environ.get('MONITOR_PLAYLISTS', load_config().get('MONITOR_PLAYLISTS', ''))
+    return [url.strip() for url in value.split(',') if url.strip()]
 
 def add_to_monitoring(url, playlist_name):
     """Add playlist to monitoring list"""
     try:
-        config_path = '/app/config/config.env'
-        # Read current config
-        current_playlists = []
-        if os.path.exists(config_path):
-            with open(config_path, 'r') as f:
-                for line in f:
-                    if line.startswith('MONITOR_PLAYLISTS='):
-                        current_value = line.split('=', 1)[1].strip().strip('"')
-                        if current_value:
-                            current_playlists = current_value.split(',')
-                        break
-        
-        # Add new playlist if not already monitored
-        if url not in current_playlists:
-            current_playlists.append(url)
-            # Update config file
-            # Implementation would update the config.env file
-            logger.info(f"Added {playlist_name} to monitoring")
+        current_playlists = monitored_playlists()
+        if url in current_playlists:
+            return
+        
+        current_playlists.append(url)
+        new_line = f'MONITOR_PLAYLISTS="{",".join(current_playlists)}"\n'
+        
+        lines = []
+        if os.path.exists(CONFIG_PATH):
+            with open(CONFIG_PATH, 'r') as f:
+                lines = f.readlines()
+        
+        # Replace the existing setting, or append it if the file has none
+        updated = [new_line if line.startswith('MONITOR_PLAYLISTS=') else line for line in lines]
+        if updated == lines:
+            updated.append(new_line)
+        
+        # Write a temp file and swap it in so a crash can't truncate the config
+        tmp_path = f'{CONFIG_PATH}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(updated)
+        os.replace(tmp_path, CONFIG_PATH)
+        
+        playlist_monitor.check_now(url)
+        logger.info(f"Added {playlist_name} to monitoring")
     except Exception as e:
         logger.error(f"Failed to add playlist to monitoring: {e}")
 
-@app.route('/')
-def index():
-    """Main page"""
-    return render_template('index.html')
+playlist_monitor = PlaylistMonitor(
+    MONITOR_DB_PATH,
+    get_playlists=monitored_playlists,
+    list_entries=list_playlist_entries,
+    enqueue=queue_monitored_entries,
+    interval_minutes=PLAYLIST_CHECK_INTERVAL
+)
 
 @app.route('/download', methods=['POST'])
+@leader_only
 def download():
     """Enhanced download endpoint with playlist support"""
     try:
@@ -312,7 +1601,7 @@ def download():
             return jsonify({'success': False, 'error': 'Invalid YouTube URL'})
         
         # Generate unique download ID
-        download_id = f"dl_{int(time.time())}_{hash(url) % 10000}"
+        download_id = f"dl_{int(time.time())}_{uuid.uuid4().hex[:8]}"
         
         # Extract options
         options = {
@@ -323,18 +1612,13 @@ def download():
             'playlistName': data.get('playlistName', '')
         }
         
-        # Start download in background thread
-        thread = threading.Thread(
-            target=download_music_enhanced,
-            args=(url, download_id, options)
-        )
-        thread.daemon = True
-        thread.start()
+        # Hand the download to the worker pool
+        queue_download(download_id, url, download_music_enhanced, url, download_id, options, options=options)
         
         return jsonify({
             'success': True, 
             'download_id': download_id,
-            'message': 'Download started'
+            'message': 'Download queued'
         })
         
     except Exception as e:
@@ -344,8 +1628,9 @@ def download():
 @app.route('/status/<download_id>')
 def get_status(download_id):
     """Get download status"""
-    if download_id in download_status:
-        return jsonify(download_status[download_id])
+    record = get_download(download_id)
+    if record is not None:
+        return jsonify(record)
     else:
         return jsonify({
             'status': 'not_found',
@@ -354,6 +1639,7 @@ def get_status(download_id):
         }), 404
 
 @app.route('/check-updates')
+@leader_only
 def check_updates_endpoint():
     """Manual update check endpoint"""
     try:
@@ -396,16 +1682,10 @@ def get_logs():
 def get_stats():
     """Get download statistics"""
     try:
-        completed = len([d for d in download_status.values() if d['status'] == 'completed'])
-        failed = len([d for d in download_status.values() if d['status'] == 'error'])
-        total = len(download_status)
-        
-        return jsonify({
-            'total_downloads': total,
-            'completed': completed,
-            'failed': failed,
-            'success_rate': (completed / total * 100) if total > 0 else 0
-        })
+        stats = job_store.stats()
+        # Read from the per-status counters, so it costs the same however many jobs there are
+        stats['active'] = sum(stats['by_status'].get(status, 0) for status in ACTIVE_STATUSES)
+        return jsonify(stats)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -430,13 +1710,6 @@ def install_extension():
     
     return render_template('install-extension.html', server_ip=local_ip)
 
-if __name__ == '__main__':
-    # Start update checker
-    start_update_checker()
-    
-    # Start Flask app
-    app.run(host='0.0.0.0', port=5000, debug=False)
-
 @app.route('/user-script.js')
 def user_script():
     """Serve the user script directly with auto-configured IP"""
@@ -491,6 +1764,7 @@ def index():
     return render_template('index.html', prefill_url=url)
 
 @app.route('/download', methods=['POST'])
+@leader_only
 def start_download():
     """Start a new download"""
     url = request.form.get('url', '').strip()
@@ -504,72 +1778,420 @@ def start_download():
         return redirect(url_for('index'))
     
     # Generate download ID
-    download_id = f"dl_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{len(download_status)}"
+    download_id = f"dl_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
     
-    # Start download in background (in production, use Celery or similar)
-    import threading
-    thread = threading.Thread(target=download_music, args=(url, download_id))
-    thread.daemon = True
-    thread.start()
+    # Hand the download to the worker pool
+    queue_download(download_id, url, download_music, url, download_id)
     
-    flash(f'Download started! ID: {download_id}', 'success')
+    flash(f'Download queued! ID: {download_id}', 'success')
     return redirect(url_for('status', download_id=download_id))
 
 @app.route('/status/<download_id>')
 def status(download_id):
     """Show download status page"""
-    if download_id not in download_status:
+    record = get_download(download_id)
+    if record is None:
         flash('Download ID not found', 'error')
         return redirect(url_for('index'))
     
     return render_template('status.html', 
                          download_id=download_id, 
-                         status=download_status[download_id])
+                         status=record)
 
 @app.route('/api/status/<download_id>')
 def api_status(download_id):
     """API endpoint for download status"""
-    if download_id not in download_status:
+    record = get_download(download_id)
+    if record is None:
+        return jsonify({'error': 'Download ID not found'}), 404
+    
+    return jsonify(record)
+
+def job_finished(record):
+    """Whether a job record is in a final state"""
+    return record.get('status') in FINISHED_STATUSES
+
+def event_stream_response(generator):
+    """Wrap an SSE generator in a streaming response"""
+    response = app.response_class(generator, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let nginx buffer the stream
+    return response
+
+@app.route('/api/events')
+@leader_only
+def api_events():
+    """Server-Sent Events stream of updates for all downloads"""
+    return event_stream_response(stream_events(event_bus))
+
+@app.route('/api/events/<download_id>')
+@leader_only
+def api_download_events(download_id):
+    """Server-Sent Events stream of updates for one download"""
+    if get_download(download_id) is None:
         return jsonify({'error': 'Download ID not found'}), 404
     
-    return jsonify(download_status[download_id])
+    return event_stream_response(stream_events(
+        event_bus,
+        download_id,
+        snapshot=lambda: get_download(download_id),
+        until=job_finished
+    ))
+
+@app.route('/api/downloads/<download_id>/cancel', methods=['POST'])
+@leader_only
+def api_cancel(download_id):
+    """Cancel a queued or running download"""
+    record = get_download(download_id)
+    if record and record.get('is_playlist') and record.get('status') not in FINISHED_STATUSES:
+        # Cancel the playlist first so its tracks don't finish it as failed
+        mark_cancelled(download_id)
+        for child in job_store.children(download_id, statuses=ACTIVE_STATUSES):
+            if cancel_job(child['id']) != 'running':
+                mark_cancelled(child['id'])
+        
+        logger.info(f"Cancelled playlist download: {download_id}")
+        return jsonify({'success': True, 'download_id': download_id, 'was': 'playlist'})
+    
+    state = cancel_job(download_id)
+    if state is None:
+        return jsonify({'error': 'Download is not queued or running'}), 404
+    
+    if state in ('queued', 'retrying'):
+        mark_cancelled(download_id)
+        if record and record.get('parent_id'):
+            refresh_parent(record['parent_id'])
+    
+    logger.info(f"Cancelled {state} download: {download_id}")
+    return jsonify({'success': True, 'download_id': download_id, 'was': state})
+
+@app.route('/api/downloads/<download_id>/retry', methods=['POST'])
+@leader_only
+def api_retry(download_id):
+    """Re-run a failed download; for playlists only the tracks that failed"""
+    record = get_download(download_id)
+    if record is None:
+        return jsonify({'error': 'Download ID not found'}), 404
+    
+    if record.get('status') not in ('error', 'cancelled'):
+        return jsonify({'error': 'Only failed or cancelled downloads can be retried'}), 409
+    
+    options = record.get('options') or {}
+    failed = []
+    if record.get('is_playlist'):
+        failed = job_store.children(download_id, statuses=('error', 'cancelled'))
+    
+    if failed:
+        update_status(
+            download_id,
+            status='downloading',
+            end_time=None,
+            message=f'Retrying {len(failed)} failed tracks...'
+        )
+        for child in failed:
+            requeue_download(
+                child['id'],
+                download_track, child['url'], child['id'], options, download_id,
+                attempts=0
+            )
+    elif record.get('parent_id'):
+        # A single playlist track: keep it in its playlist, reopened if already finished
+        parent_id = record['parent_id']
+        parent = job_store.get(parent_id) or {}
+        options = options or parent.get('options') or {}
+        if parent.get('status') in FINISHED_STATUSES:
+            update_status(parent_id, status='downloading', end_time=None, message='Retrying 1 failed track...')
+        requeue_download(
+            download_id,
+            download_track, record['url'], download_id, options, parent_id,
+            attempts=0,
+            parent_id=parent_id,
+            playlist_index=record.get('playlist_index')
+        )
+    else:
+        requeue_download(
+            download_id,
+            download_music_enhanced, record['url'], download_id, options,
+            attempts=0
+        )
+    
+    logger.info(f"Retrying download: {download_id} ({len(failed) or 1} jobs)")
+    return jsonify({'success': True, 'download_id': download_id, 'retried': len(failed) or 1})
+
+@app.route('/api/archive')
+def api_archive():
+    """API endpoint to browse the download archive"""
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    offset = request.args.get('offset', 0, type=int)
+    return jsonify({
+        'count': download_archive.count(),
+        'entries': download_archive.list(limit, offset)
+    })
+
+@app.route('/api/archive/<video_id>', methods=['GET', 'DELETE'])
+def api_archive_entry(video_id):
+    """Look up or forget an archived video"""
+    if request.method == 'DELETE':
+        if not download_archive.remove(video_id):
+            return jsonify({'error': 'Video not in archive'}), 404
+        return jsonify({'success': True, 'video_id': video_id})
+    
+    entry = download_archive.get(video_id)
+    if entry is None:
+        return jsonify({'error': 'Video not in archive'}), 404
+    entry['exists'] = os.path.exists(entry['path'])
+    return jsonify(entry)
+
+@app.route('/api/archive/prune', methods=['POST'])
+def api_archive_prune():
+    """Drop archive entries whose files were deleted"""
+    removed = download_archive.prune()
+    return jsonify({'success': True, 'removed': removed, 'count': download_archive.count()})
+
+@app.route('/api/library')
+def api_library():
+    """Size of the library catalog and the state of its scanner"""
+    return jsonify(library_catalog.status())
+
+@app.route('/api/library/search')
+def api_library_search():
+    """Search the library catalog by text, video ID, artist or album"""
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    offset = request.args.get('offset', 0, type=int)
+    filters = {
+        column: request.args.get(column)
+        for column in ('video_id', 'artist', 'album', 'format')
+        if request.args.get(column)
+    }
+    query = request.args.get('q', '').strip()
+    if not query and not filters:
+        return jsonify({'error': 'Give a search term (q) or a video_id, artist, album or format'}), 400
+
+    started = time.monotonic()
+    results = library_catalog.search(query, limit=limit, offset=offset, **filters)
+    return jsonify({
+        'query': query,
+        'results': results,
+        'took_ms': round((time.monotonic() - started) * 1000, 2)
+    })
+
+@app.route('/api/library/rescan', methods=['POST'])
+@leader_only
+def api_library_rescan():
+    """Reconcile the catalog with the disk right away"""
+    library_catalog.rescan()
+    return jsonify({'success': True})
+
+@app.route('/api/library/duplicates')
+def api_library_duplicates():
+    """Tracks fingerprinted as another upload of a recording already in the library"""
+    return jsonify({
+        'action': DUPLICATE_ACTION,
+        'fingerprinted': fingerprint_index.count(),
+        'duplicates': fingerprint_index.duplicates()
+    })
+
+@app.route('/api/library/fingerprint', methods=['GET', 'POST'])
+@leader_only
+def api_library_fingerprint():
+    """Fingerprint every catalogued track that has no fingerprint yet, or show that run's progress"""
+    if request.method == 'POST':
+        if not fingerprint_index.available():
+            return jsonify({'error': 'Fingerprinting needs NumPy and ffmpeg'}), 503
+        if fingerprint_index.batch.get('running'):
+            return jsonify({'error': 'Fingerprinting is already running', **fingerprint_index.batch}), 409
+        threading.Thread(
+            target=fingerprint_index.fingerprint_library,
+            args=(library_catalog.paths(), FINGERPRINT_WORKERS),
+            name='fingerprint-library',
+            daemon=True
+        ).start()
+    return jsonify(fingerprint_index.batch)
+
+@app.route('/api/monitor')
+@leader_only
+def api_monitor():
+    """API endpoint for the monitored playlists"""
+    return jsonify({
+        'interval_minutes': PLAYLIST_CHECK_INTERVAL,
+        'playlists': playlist_monitor.status()
+    })
+
+@app.route('/api/monitor/check', methods=['POST'])
+@leader_only
+def api_monitor_check():
+    """Check one or all monitored playlists right away"""
+    data = request.get_json(silent=True) or {}
+    playlist_monitor.check_now(data.get('url'))
+    return jsonify({'success': True})
+
+@app.route('/api/scan', methods=['GET', 'POST'])
+@leader_only
+def api_scan():
+    """Request a Navidrome library scan, or show the scan state"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        library_scanner.request(data.get('source', 'api'))
+    return jsonify(library_scanner.status())
+
+@app.route('/metrics')
+@leader_only
+def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return app.response_class(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/scheduler')
+@leader_only
+def api_scheduler():
+    """API endpoint for the download and post-processing worker pools"""
+    return jsonify({
+        **download_scheduler.snapshot(),
+        'postprocess': postprocess_scheduler.snapshot()
+    })
+
+@app.route('/api/concurrency', methods=['GET', 'POST'])
+@leader_only
+def api_concurrency():
+    """Show the concurrency controller's decisions, or change its bounds"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            bounds = {}
+            for pool in ('download', 'postprocess'):
+                if pool in data:
+                    current = concurrency_controller.bounds[pool]
+                    bounds[pool] = (
+                        int(data[pool].get('min', current[0])),
+                        int(data[pool].get('max', current[1]))
+                    )
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({'error': 'Bounds must look like {"download": {"min": 1, "max": 4}}'}), 400
+        
+        concurrency_controller.configure(
+            enabled=data.get('enabled'),
+            download_bounds=bounds.get('download'),
+            postprocess_bounds=bounds.get('postprocess')
+        )
+    return jsonify(concurrency_controller.status())
+
+def parse_time_arg(value):
+    """Read a since/until query argument given as epoch seconds or ISO time"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def job_filters(args):
+    """Page and filter arguments shared by /api/downloads and /queue"""
+    return {
+        'cursor': args.get('cursor') or None,
+        'statuses': [status for status in args.get('status', '').split(',') if status],
+        'since': parse_time_arg(args.get('since')),
+        'until': parse_time_arg(args.get('until')),
+        'parent_id': args.get('playlist') or None,
+    }
+
+def jobs_etag():
+    """Weak ETag for the current query against the current state of the job store"""
+    key = f'{job_store.version()}:{request.path}?{request.query_string.decode()}'
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
 
 @app.route('/api/downloads')
 def api_downloads():
-    """API endpoint to list all downloads"""
-    return jsonify(download_status)
+    """API endpoint to page through downloads, newest first.
+
+    Query arguments: limit, cursor (next_cursor of the previous page),
+    status (comma separated), since/until (epoch or ISO time), playlist
+    (a playlist job's ID, lists its tracks) and fields (comma separated).
+    Polls with If-None-Match get 304 until any job changes.
+    """
+    etag = jobs_etag()
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    try:
+        downloads, next_cursor = job_store.page(limit, **job_filters(request.args))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    fields = [field for field in request.args.get('fields', '').split(',') if field]
+    if fields:
+        downloads = [
+            {key: record[key] for key in ['id', *fields] if key in record}
+            for record in downloads
+        ]
+    
+    response = jsonify({'downloads': downloads, 'next_cursor': next_cursor, 'limit': limit})
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/queue')
 def queue_page():
-    """Show download queue/history"""
-    return render_template('queue.html', downloads=download_status)
+    """Show download queue/history, one page at a time"""
+    try:
+        filters = job_filters(request.args)
+        downloads, next_cursor = job_store.page(QUEUE_PAGE_SIZE, **filters)
+    except ValueError:
+        # A stale or mangled cursor/filter link starts over at the first page
+        return redirect(url_for('queue_page'))
+    return render_template(
+        'queue.html',
+        downloads=downloads,
+        next_cursor=next_cursor,
+        status_filter=','.join(filters['statuses']),
+        stats=job_store.stats()
+    )
 
-@app.route('/api/queue', methods=['POST'])
+@app.route('/api/queue', methods=['GET', 'POST'])
+@leader_only
 def add_to_queue():
-    """Add URL to download queue"""
-    data = request.get_json()
-    url = data.get('url', '').strip()
+    """Add one or many URLs to the download queue, or show what is pending"""
+    if request.method == 'GET':
+        return jsonify(queue_consumer.status())
     
-    if not url:
+    data = request.get_json(silent=True) or {}
+    urls = data.get('urls') or [data.get('url', '')]
+    if not isinstance(urls, list):
+        return jsonify({'error': 'urls must be a list'}), 400
+    urls = [str(url).strip() for url in urls if str(url).strip()]
+    
+    if not urls:
         return jsonify({'error': 'URL is required'}), 400
     
-    if not is_valid_youtube_url(url):
-        return jsonify({'error': 'Invalid YouTube URL'}), 400
+    invalid = [url for url in urls if not is_valid_youtube_url(url)]
+    if invalid:
+        return jsonify({'error': 'Invalid YouTube URL', 'invalid': invalid[:100]}), 400
     
-    # Add to queue file for batch processing
-    queue_file = '/app/queue/download_queue.txt'
-    os.makedirs(os.path.dirname(queue_file), exist_ok=True)
+    try:
+        priority = parse_priority(data.get('priority'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    with open(queue_file, 'a') as f:
-        f.write(f"{url}\n")
+    # Add to queue file for batch processing
+    entry = {'priority': priority, 'added_at': time.time()}
+    if data.get('off_peak') is not None:
+        entry['off_peak'] = bool(data['off_peak'])
+    queue_consumer.add([dict(entry, url=url) for url in urls])
     
-    return jsonify({'message': 'URL added to queue', 'url': url})
+    if len(urls) == 1:
+        return jsonify({'message': 'URL added to queue', 'url': urls[0]})
+    return jsonify({'message': f'{len(urls)} URLs added to queue', 'count': len(urls)})
 
 if __name__ == '__main__':
     # Create necessary directories
     os.makedirs(DOWNLOAD_PATH, exist_ok=True)
-    os.makedirs('/app/logs', exist_ok=True)
-    os.makedirs('/app/queue', exist_ok=True)
+    os.makedirs(LOG_DIR, exist_ok=True)
+    os.makedirs(os.path.dirname(QUEUE_FILE), exist_ok=True)
+    
+    # Start background workers; the development server is a single process,
+    # so it always wins the election
+    start_services()
     
-    # Run the app
-    app.run(host='0.0.0.0', port=80, debug=False)
+    # Run the app (in production gunicorn runs it, see gunicorn.conf.py)
+    app.run(host='0.0.0.0', port=int(os.environ.get('LISTEN_PORT', '80')), debug=False)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Download Archive
+Index of already downloaded YouTube videos, shared with download_music.sh
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Keep in sync with scripts/download_music.sh
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive (
+    video_id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    format TEXT,
+    title TEXT,
+    added_at REAL NOT NULL
+);
+"""
+
+VIDEO_ID_PATTERNS = [
+    r'[?&]v=([\w-]{11})',
+    r'youtu\.be/([\w-]{11})',
+    r'youtube\.com/(?:shorts|embed|live)/([\w-]{11})',
+]
+
+
+def extract_video_id(url):
+    """Return the video ID of a single-video YouTube URL, or None"""
+    for pattern in VIDEO_ID_PATTERNS:
+        match = re.search(pattern, url)
+        if match:
+            return match.group(1)
+    return None
+
+
+# yt-dlp --audio-format names whose files get another extension
+# Keep in sync with scripts/download_music.sh
+FORMAT_EXTENSIONS = {'vorbis': 'ogg', 'aac': 'm4a', 'alac': 'm4a'}
+
+
+def format_matches(entry, requested_format):
+    """Whether an archived file (format is its extension) satisfies the requested audio format"""
+    if not requested_format or requested_format in ('best', 'native'):
+        return True
+    requested = requested_format.lower()
+    return (entry.get('format') or '').lower() == FORMAT_EXTENSIONS.get(requested, requested)
+
+
+class DownloadArchive:
+    """Map YouTube video IDs to the files they were downloaded to.
+
+    Stored as SQLite next to the music library, so the web service and
+    download_music.sh on the host read and write the same index. The two
+    see the library under different mounts, so paths are stored relative to
+    it and each side joins them with its own `root`. Whether an entry's file
+    is still there is answered by `file_exists`, which the web service
+    points at its library catalog.
+    """
+
+    def __init__(self, db_path, root, file_exists=os.path.exists):
+        self.db_path = db_path
+        self.root = os.path.abspath(root)
+        self.file_exists = file_exists
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        # Entries from before paths were relative, written under this mount
+        prefix = self.root.rstrip(os.sep) + os.sep
+        conn.execute(
+            'UPDATE archive SET path = substr(path, ?) WHERE substr(path, 1, ?) = ?',
+            (len(prefix) + 1, len(prefix), prefix)
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def relative(self, path):
+        """A library path as stored: relative to the library root"""
+        if os.path.isabs(path):
+            return os.path.relpath(path, self.root)
+        return path
+
+    def absolute(self, path):
+        """A stored path as this side of the mount sees it"""
+        return os.path.join(self.root, path)
+
+    def _entry(self, row):
+        entry = dict(row)
+        entry['path'] = self.absolute(entry['path'])
+        return entry
+
+    def get(self, video_id):
+        """Return the archive entry of a video (with an absolute path), or None"""
+        row = self._connection().execute(
+            'SELECT * FROM archive WHERE video_id = ?', (video_id,)
+        ).fetchone()
+        return self._entry(row) if row else None
+
+    def lookup(self, video_id, requested_format=None):
+        """Return the entry of a video whose file still exists in a usable format"""
+        entry = self.get(video_id) if video_id else None
+        if entry is None or not format_matches(entry, requested_format):
+            return None
+        if not self.file_exists(entry['path']):
+            return None
+        return entry
+
+    def missing(self, video_ids, requested_format=None):
+        """Return the IDs from video_ids that still have to be downloaded"""
+        return [video_id for video_id in video_ids if not self.lookup(video_id, requested_format)]
+
+    def add(self, video_id, path, title=None):
+        """Record a downloaded video"""
+        fmt = os.path.splitext(path)[1].lstrip('.').lower() or None
+        self._connection().execute(
+            'INSERT OR REPLACE INTO archive (video_id, path, format, title, added_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (video_id, self.relative(path), fmt, title, time.time())
+        )
+
+    def remove(self, video_id):
+        """Forget a video so it will be downloaded again"""
+        cursor = self._connection().execute('DELETE FROM archive WHERE video_id = ?', (video_id,))
+        return cursor.rowcount > 0
+
+    def list(self, limit=100, offset=0):
+        """Return archive entries, most recently added first"""
+        rows = self._connection().execute(
+            'SELECT * FROM archive ORDER BY added_at DESC LIMIT ? OFFSET ?', (limit, offset)
+        ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def count(self):
+        """Number of archived videos"""
+        return self._connection().execute('SELECT COUNT(*) FROM archive').fetchone()[0]
+
+    def prune(self):
+        """Remove entries whose file no longer exists.
+
+        Absolute paths are legacy entries of the other mount, which only that
+        side can check (download_music.sh rewrites them on its next run).
+        """
+        conn = self._connection()
+        missing = [
+            row['video_id']
+            for row in conn.execute('SELECT video_id, path FROM archive')
+            if not os.path.isabs(row['path']) and not self.file_exists(self.absolute(row['path']))
+        ]
+        for video_id in missing:
+            conn.execute('DELETE FROM archive WHERE video_id = ?', (video_id,))
+        if missing:
+            logger.info(f"Pruned {len(missing)} missing files from the download archive")
+        return len(missing)
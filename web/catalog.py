@@ -0,0 +1,647 @@
+#!/usr/bin/env python3
+"""
+Library Catalog
+Searchable index of every audio file in the music library, kept current with inotify
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import json
+import logging
+import os
+import select
+import sqlite3
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import mutagen
+except ImportError:  # Tags and durations then come from the info JSON sidecars
+    mutagen = None
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {'.mp3', '.m4a', '.aac', '.opus', '.ogg', '.oga', '.flac', '.wav', '.alac', '.webm', '.mka'}
+
+# Sidecar yt-dlp writes next to each file with --write-info-json
+INFO_JSON_SUFFIX = '.info.json'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    format TEXT,
+    codec TEXT,
+    duration REAL,
+    bitrate INTEGER,
+    title TEXT,
+    artist TEXT,
+    album TEXT,
+    genre TEXT,
+    video_id TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_video_id ON files (video_id);
+"""
+
+# External-content full-text index over the files table, synced by triggers
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+    title, artist, album, genre, path, content='files', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS files_ai AFTER INSERT ON files BEGIN
+    INSERT INTO files_fts (rowid, title, artist, album, genre, path)
+    VALUES (new.id, new.title, new.artist, new.album, new.genre, new.path);
+END;
+CREATE TRIGGER IF NOT EXISTS files_ad AFTER DELETE ON files BEGIN
+    INSERT INTO files_fts (files_fts, rowid, title, artist, album, genre, path)
+    VALUES ('delete', old.id, old.title, old.artist, old.album, old.genre, old.path);
+END;
+CREATE TRIGGER IF NOT EXISTS files_au AFTER UPDATE ON files BEGIN
+    INSERT INTO files_fts (files_fts, rowid, title, artist, album, genre, path)
+    VALUES ('delete', old.id, old.title, old.artist, old.album, old.genre, old.path);
+    INSERT INTO files_fts (rowid, title, artist, album, genre, path)
+    VALUES (new.id, new.title, new.artist, new.album, new.genre, new.path);
+END;
+"""
+
+COLUMNS = ('path', 'size', 'mtime', 'format', 'codec', 'duration', 'bitrate',
+           'title', 'artist', 'album', 'genre', 'video_id', 'indexed_at')
+
+# Tag keys of the mutagen "easy" interfaces and of raw Vorbis/MP4 tags
+TAG_KEYS = {
+    'title': ('title', '\xa9nam'),
+    'artist': ('artist', 'albumartist', '\xa9ART'),
+    'album': ('album', '\xa9alb'),
+    'genre': ('genre', '\xa9gen'),
+}
+
+# Rows written per transaction while scanning
+SCAN_BATCH = 500
+
+# Seconds of quiet before queued inotify changes are indexed
+SETTLE_SECONDS = 1.0
+
+# Longest a change waits for the library to go quiet
+MAX_SETTLE_SECONDS = 10
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def is_hidden(name):
+    """Dot files and directories (staging, the archive DB) are not part of the library"""
+    return name.startswith('.')
+
+
+def is_audio(path):
+    return os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS
+
+
+def sidecar_path(path):
+    return os.path.splitext(path)[0] + INFO_JSON_SUFFIX
+
+
+def first_tag(tags, keys):
+    """First non-empty value of any of keys in a mutagen tag mapping"""
+    for key in keys:
+        try:
+            value = tags.get(key)
+        except Exception:
+            value = None
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if value:
+            return str(value)
+    return None
+
+
+def read_tags(path):
+    """Duration, codec, bitrate and tags of an audio file, via mutagen"""
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception as e:
+        logger.debug(f"Could not read tags of {path}: {e}")
+        return {}
+    if audio is None:
+        return {}
+    info = getattr(audio, 'info', None)
+    result = {
+        'duration': getattr(info, 'length', None),
+        'bitrate': getattr(info, 'bitrate', None) or None,
+        'codec': getattr(info, 'codec', None) or type(audio).__name__.replace('Easy', '').lower(),
+    }
+    for field, keys in TAG_KEYS.items():
+        result[field] = first_tag(audio.tags or {}, keys)
+    return result
+
+
+def read_sidecar(path):
+    """Video ID, tags and duration from a file's yt-dlp info JSON, if it has one"""
+    try:
+        with open(sidecar_path(path)) as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {
+        'video_id': info.get('id'),
+        'title': info.get('track') or info.get('title'),
+        'artist': info.get('artist') or info.get('uploader'),
+        'album': info.get('album'),
+        'genre': info.get('genre'),
+        'duration': info.get('duration'),
+        'codec': info.get('acodec'),
+    }
+
+
+def describe_file(path, stat=None):
+    """Build the catalog row of one audio file; tags win over the sidecar, which wins over the name"""
+    stat = stat or os.stat(path)
+    row = {
+        'path': path,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'format': os.path.splitext(path)[1].lstrip('.').lower() or None,
+        'indexed_at': time.time(),
+    }
+    sources = [read_tags(path) if mutagen else {}, read_sidecar(path)]
+    for column in ('codec', 'duration', 'bitrate', 'title', 'artist', 'album', 'genre', 'video_id'):
+        row[column] = next((source[column] for source in sources if source.get(column)), None)
+    if not row['title']:
+        row['title'] = os.path.splitext(os.path.basename(path))[0].replace('_', ' ')
+    if not row['artist']:
+        row['artist'] = os.path.basename(os.path.dirname(path)).replace('_', ' ') or None
+    return row
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    words = [word.replace('"', '""') for word in text.split()]
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class Inotify:
+    """Minimal ctypes binding of Linux inotify, so no extra package is needed"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """Events (wd, mask, name) that arrive within timeout seconds"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LibraryCatalog:
+    """Index the music library in SQLite so lookups never walk the filesystem.
+
+    One row per audio file with its size, duration, codec, tags and the
+    YouTube video ID from the yt-dlp info JSON next to it, plus an FTS5
+    index over titles, artists, albums and paths. `start()` reconciles the
+    table with the disk in a parallel scan (unchanged files are skipped by
+    size and mtime), then follows changes through inotify. Without inotify,
+    or when the kernel drops events, the library is rescanned every
+    `rescan_minutes` instead. Until the first scan has finished `exists()`
+    asks the filesystem, so nothing is missed on startup.
+    """
+
+    def __init__(self, db_path, root, workers=4, rescan_minutes=60):
+        self.db_path = db_path
+        self.root = os.path.abspath(root)
+        self.workers = max(1, workers)
+        self.rescan_interval = max(0, rescan_minutes) * 60
+        self.ready = False
+        self.watching = False
+        self.last_scan = None
+        self.scans = 0
+        self.fts = True
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._rescan = threading.Event()
+        self._pending = {}
+        self._pending_since = None
+        self._watches = {}
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite has no FTS5, library search falls back to LIKE: {e}")
+            self.fts = False
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    # Lookups
+
+    def get(self, path):
+        """Return the catalog entry of a file, or None"""
+        row = self._connection().execute('SELECT * FROM files WHERE path = ?', (path,)).fetchone()
+        return dict(row) if row else None
+
+    def exists(self, path):
+        """Whether a file is in the library, from the catalog once it is built"""
+        if not self.ready:
+            return os.path.exists(path)
+        return self._connection().execute(
+            'SELECT 1 FROM files WHERE path = ?', (os.path.abspath(path),)
+        ).fetchone() is not None
+
+    def by_video_id(self, video_id):
+        """Return every file downloaded from a YouTube video"""
+        rows = self._connection().execute(
+            'SELECT * FROM files WHERE video_id = ? ORDER BY mtime DESC', (video_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def paths(self):
+        """Every file in the catalog, oldest first"""
+        return [row[0] for row in self._connection().execute('SELECT path FROM files ORDER BY mtime')]
+
+    def search(self, text=None, limit=50, offset=0, **filters):
+        """Full-text search, best matches first; filters narrow by exact column values"""
+        clauses, params = [], []
+        for column, value in filters.items():
+            if column not in COLUMNS:
+                raise ValueError(f'Unknown column: {column}')
+            if value is not None:
+                clauses.append(f'files.{column} = ?')
+                params.append(value)
+
+        query = fts_query(text or '')
+        if query and self.fts:
+            sql = ('SELECT files.* FROM files_fts JOIN files ON files.id = files_fts.rowid '
+                   'WHERE files_fts MATCH ?')
+            params.insert(0, query)
+            order = 'bm25(files_fts)'
+        else:
+            sql = 'SELECT * FROM files WHERE 1'
+            for word in (text or '').split():
+                clauses.append("(title || ' ' || ifnull(artist, '') || ' ' || ifnull(album, '') || ' ' || path) LIKE ?")
+                params.append(f'%{word}%')
+            order = 'artist, title'
+        for clause in clauses:
+            sql += f' AND {clause}'
+        sql += f' ORDER BY {order} LIMIT ? OFFSET ?'
+        rows = self._connection().execute(sql, (*params, limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def status(self):
+        """Size of the catalog and the state of its scanner"""
+        count, size, duration = self._connection().execute(
+            'SELECT COUNT(*), ifnull(SUM(size), 0), ifnull(SUM(duration), 0) FROM files'
+        ).fetchone()
+        return {
+            'root': self.root,
+            'files': count,
+            'bytes': size,
+            'duration_seconds': round(duration),
+            'ready': self.ready,
+            'watching': self.watching,
+            'watched_dirs': len(self._watches),
+            'scans': self.scans,
+            'last_scan': self.last_scan,
+        }
+
+    # Updates
+
+    def index_file(self, path):
+        """Add or refresh one file; removes it from the catalog if it is gone"""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.remove(path)
+            return None
+        row = describe_file(path, stat)
+        self._write([row])
+        return row
+
+    def remove(self, path):
+        """Drop a file, or every file under a directory, from the catalog"""
+        path = os.path.abspath(path)
+        with self._write_lock:
+            self._connection().execute(
+                "DELETE FROM files WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                (path, self._prefix_pattern(path))
+            )
+
+    def _prefix_pattern(self, directory):
+        escaped = directory.rstrip(os.sep).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f'{escaped}{os.sep}%'
+
+    def _write(self, rows):
+        """Upsert rows in one transaction"""
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in COLUMNS if column != 'path')
+        sql = (f'INSERT INTO files ({", ".join(COLUMNS)}) VALUES ({placeholders}) '
+               f'ON CONFLICT (path) DO UPDATE SET {updates}')
+        with self._write_lock:
+            conn = self._connection()
+            conn.execute('BEGIN')
+            try:
+                conn.executemany(sql, [tuple(row[column] for column in COLUMNS) for row in rows])
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def walk(self, directory=None):
+        """Yield (path, stat) of every audio file under directory, skipping hidden entries"""
+        stack = [directory or self.root]
+        while stack:
+            current = stack.pop()
+            try:
+                entries = list(os.scandir(current))
+            except OSError as e:
+                logger.debug(f"Cannot list {current}: {e}")
+                continue
+            for entry in entries:
+                if is_hidden(entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and is_audio(entry.name):
+                        yield entry.path, entry.stat()
+                except OSError:
+                    continue
+
+    def scan(self, directory=None):
+        """Reconcile the catalog with the disk under directory (the whole library by default)"""
+        started = time.monotonic()
+        directory = os.path.abspath(directory or self.root)
+        known = {
+            row['path']: (row['size'], row['mtime'])
+            for row in self._connection().execute(
+                "SELECT path, size, mtime FROM files WHERE path LIKE ? ESCAPE '\\'",
+                (self._prefix_pattern(directory),)
+            )
+        }
+        changed = []
+        for path, stat in self.walk(directory):
+            if known.pop(path, None) != (stat.st_size, stat.st_mtime):
+                changed.append((path, stat))
+
+        indexed = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='catalog-scan') as pool:
+            batch = []
+            for row in pool.map(lambda item: self._describe(*item), changed):
+                if row:
+                    batch.append(row)
+                if len(batch) >= SCAN_BATCH:
+                    self._write(batch)
+                    indexed += len(batch)
+                    batch = []
+            if batch:
+                self._write(batch)
+                indexed += len(batch)
+
+        for path in known:
+            self.remove(path)
+
+        elapsed = time.monotonic() - started
+        if indexed or known or directory == self.root:
+            logger.info(
+                f"Library scan of {directory}: {indexed} indexed, {len(known)} removed in {elapsed:.1f}s"
+            )
+        return {'indexed': indexed, 'removed': len(known), 'seconds': round(elapsed, 3)}
+
+    def _describe(self, path, stat):
+        try:
+            return describe_file(path, stat)
+        except Exception as e:
+            logger.warning(f"Could not index {path}: {e}")
+            return None
+
+    def rescan(self):
+        """Ask the background thread for a full rescan"""
+        self._rescan.set()
+
+    # Background
+
+    def start(self):
+        """Scan the library and keep the catalog current in a background thread"""
+        thread = threading.Thread(target=self._run, name='library-catalog', daemon=True)
+        thread.start()
+
+    def _run(self):
+        inotify = None
+        try:
+            inotify = Inotify()
+            # Watches go in before the scan, so nothing written during it is missed
+            self._watch_tree(inotify, self.root)
+            self.watching = True
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify unavailable, rescanning the library every "
+                           f"{self.rescan_interval // 60} minutes instead: {e}")
+            if inotify:
+                inotify.close()
+            inotify = None
+
+        self._full_scan()
+
+        next_rescan = time.monotonic() + self.rescan_interval
+        while True:
+            try:
+                if inotify and self.watching:
+                    self._follow(inotify)
+                else:
+                    self._rescan.wait(timeout=5)
+                if self._rescan.is_set() or (
+                    not self.watching and self.rescan_interval and time.monotonic() >= next_rescan
+                ):
+                    self._rescan.clear()
+                    if inotify and not self.watching:
+                        self._rewatch(inotify)
+                    self._full_scan()
+                    next_rescan = time.monotonic() + self.rescan_interval
+            except Exception as e:
+                logger.error(f"Library catalog error: {e}")
+                time.sleep(5)
+
+    def _full_scan(self):
+        try:
+            self.scan()
+            self.scans += 1
+            self.last_scan = time.time()
+            self.ready = True
+        except Exception as e:
+            logger.error(f"Library scan failed: {e}")
+
+    def _watch_tree(self, inotify, directory):
+        """Watch directory and every visible directory below it"""
+        stack = [directory]
+        while stack:
+            current = stack.pop()
+            try:
+                wd = inotify.add_watch(current, WATCH_MASK)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise  # Out of watches: fall back to periodic rescans
+                continue
+            self._watches[wd] = current
+            try:
+                stack.extend(
+                    entry.path for entry in os.scandir(current)
+                    if not is_hidden(entry.name) and entry.is_dir(follow_symlinks=False)
+                )
+            except OSError:
+                continue
+
+    def _rewatch(self, inotify):
+        """Start watching again after the event queue overflowed"""
+        for wd in list(self._watches):
+            inotify.rm_watch(wd)
+        self._watches.clear()
+        try:
+            self._watch_tree(inotify, self.root)
+            self.watching = True
+        except OSError as e:
+            logger.warning(f"Could not re-establish library watches: {e}")
+
+    def _follow(self, inotify):
+        """Queue the changes inotify reports and index them once they settle"""
+        events = inotify.read(timeout=SETTLE_SECONDS)
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflowed, rescanning the library")
+                self.watching = False
+                self._rescan.set()
+                return
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                continue
+            if is_hidden(name):
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._pending[path] = 'dir'
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._pending[path] = 'gone'
+            elif name.endswith(INFO_JSON_SUFFIX):
+                # A sidecar written after its audio file carries the video ID
+                audio = [
+                    os.path.join(directory, candidate) for candidate in self._siblings(directory)
+                    if os.path.splitext(candidate)[0] + INFO_JSON_SUFFIX == name and is_audio(candidate)
+                ]
+                for candidate in audio:
+                    self._pending.setdefault(candidate, 'file')
+            elif is_audio(name):
+                self._pending[path] = 'gone' if mask & (IN_DELETE | IN_MOVED_FROM) else 'file'
+
+        if not self._pending:
+            return
+        if self._pending_since is None:
+            self._pending_since = time.monotonic()
+        # Index once a read window passed without new events, or the changes waited long enough
+        if events and time.monotonic() - self._pending_since < MAX_SETTLE_SECONDS:
+            return
+        pending, self._pending, self._pending_since = self._pending, {}, None
+        files = []
+        for path, kind in pending.items():
+            if kind == 'dir':
+                try:
+                    self._watch_tree(inotify, path)
+                except OSError as e:
+                    logger.warning(f"Out of inotify watches, falling back to rescans: {e}")
+                    self.watching = False
+                    self._rescan.set()
+                self.scan(path)
+            elif kind == 'gone':
+                self._unwatch(inotify, path)
+                self.remove(path)
+            else:
+                files.append(path)
+        rows = []
+        for path in files:
+            try:
+                rows.append(describe_file(path))
+            except FileNotFoundError:
+                self.remove(path)
+            except Exception as e:
+                logger.warning(f"Could not index {path}: {e}")
+        if rows:
+            self._write(rows)
+            logger.debug(f"Catalog updated {len(rows)} files")
+
+    def _unwatch(self, inotify, directory):
+        """Stop watching a directory that was moved or deleted, and everything below it"""
+        prefix = directory.rstrip(os.sep) + os.sep
+        for wd, path in list(self._watches.items()):
+            if path == directory or path.startswith(prefix):
+                inotify.rm_watch(wd)
+                self._watches.pop(wd, None)
+
+    def _siblings(self, directory):
+        try:
+            return os.listdir(directory)
+        except OSError:
+            return []
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Adaptive Concurrency Controller
+Resizes the download and post-processing pools from system pressure
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+PRESSURE_PATH = '/proc/pressure'
+
+# Decisions kept for the API
+HISTORY_SIZE = 50
+
+# An increase that doesn't raise throughput by this factor is undone
+MIN_THROUGHPUT_GAIN = 1.1
+
+# Ticks the download pool stays below a size that didn't add throughput
+CEILING_TICKS = 20
+
+
+def read_pressure(resource):
+    """Return the 'some avg10' stall percentage of a PSI resource, or None"""
+    try:
+        with open(os.path.join(PRESSURE_PATH, resource)) as f:
+            for line in f:
+                if line.startswith('some '):
+                    fields = dict(field.split('=', 1) for field in line.split()[1:])
+                    return float(fields['avg10'])
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def read_load_per_cpu():
+    """Return the 1-minute load average divided by the number of cores"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+
+def read_free_mb(path):
+    """Return the free space on the filesystem holding path, in MB"""
+    try:
+        return shutil.disk_usage(path).free / (1024 * 1024)
+    except OSError:
+        return None
+
+
+class ConcurrencyController:
+    """Grow or shrink the worker pools between configured bounds.
+
+    Every interval it samples the load average, CPU and IO pressure (PSI),
+    the combined transfer rate of running downloads and the free space on
+    the library. Downloads back off on IO pressure or low disk space and
+    only grow while there is a backlog and the last step up actually raised
+    throughput. Post-processing backs off on CPU pressure first, since that
+    is what makes Navidrome's streams stutter. Pools move one worker per tick.
+    """
+
+    def __init__(self, download_pool, postprocess_pool, download_path, throughput,
+                 download_bounds=(1, 4), postprocess_bounds=(1, 4), interval=15,
+                 cpu_limit=25.0, io_limit=25.0, load_limit=1.0, min_free_mb=1024):
+        self.download_pool = download_pool
+        self.postprocess_pool = postprocess_pool
+        self.download_path = download_path
+        self.throughput = throughput
+        self.bounds = {'download': download_bounds, 'postprocess': postprocess_bounds}
+        self.interval = max(1, interval)
+        self.cpu_limit = cpu_limit
+        self.io_limit = io_limit
+        self.load_limit = load_limit
+        self.min_free_mb = min_free_mb
+        self.enabled = True
+        self.last_sample = None
+        self.decisions = deque(maxlen=HISTORY_SIZE)
+        self._lock = threading.Lock()
+        self._last_increase = None
+        self._ceiling = None
+
+    def sample(self):
+        """Read the current system and pool state"""
+        downloads = self.download_pool.snapshot()
+        postprocess = self.postprocess_pool.snapshot()
+        return {
+            'time': time.time(),
+            'load_per_cpu': read_load_per_cpu(),
+            'cpu_pressure': read_pressure('cpu'),
+            'io_pressure': read_pressure('io'),
+            'free_mb': read_free_mb(self.download_path),
+            'throughput': self.throughput(),
+            'download_workers': downloads['max_workers'],
+            'download_running': len(downloads['running']),
+            'download_queued': len(downloads['queued']),
+            'postprocess_workers': postprocess['max_workers'],
+            'postprocess_running': len(postprocess['running']),
+            'postprocess_queued': len(postprocess['queued']),
+        }
+
+    def _cpu_busy(self, sample, factor=1.0):
+        cpu = sample['cpu_pressure']
+        load = sample['load_per_cpu']
+        return ((cpu is not None and cpu > self.cpu_limit * factor)
+                or (load is not None and load > self.load_limit * factor))
+
+    def _io_busy(self, sample, factor=1.0):
+        io = sample['io_pressure']
+        return io is not None and io > self.io_limit * factor
+
+    def _download_target(self, sample):
+        workers = sample['download_workers']
+        low, high = self.bounds['download']
+        free = sample['free_mb']
+
+        if free is not None and free < self.min_free_mb:
+            return low, f'only {free:.0f} MB free on the library'
+        if self._io_busy(sample):
+            return workers - 1, f"IO pressure {sample['io_pressure']:.1f}%"
+        if self._cpu_busy(sample, 1.5):
+            return workers - 1, 'CPU saturated'
+
+        # Undo a step up that didn't buy any bandwidth
+        previous, self._last_increase = self._last_increase, None
+        if (previous and sample['download_running'] >= workers
+                and sample['throughput'] < previous['throughput'] * MIN_THROUGHPUT_GAIN):
+            self._ceiling = (workers - 1, CEILING_TICKS)
+            return workers - 1, 'more downloads did not raise throughput'
+
+        if self._ceiling:
+            size, ticks = self._ceiling
+            self._ceiling = (size, ticks - 1) if ticks > 1 else None
+            high = min(high, size)
+
+        if (sample['download_queued'] and sample['download_running'] >= workers
+                and not self._io_busy(sample, 0.5) and not self._cpu_busy(sample, 0.75)
+                and workers < high):
+            self._last_increase = {'throughput': sample['throughput']}
+            return workers + 1, 'downloads waiting and headroom available'
+        return workers, None
+
+    def _postprocess_target(self, sample):
+        workers = sample['postprocess_workers']
+        if self._cpu_busy(sample):
+            cpu = sample['cpu_pressure']
+            detail = f'{cpu:.1f}%' if cpu is not None else f"load {sample['load_per_cpu']:.2f}/core"
+            return workers - 1, f'CPU pressure {detail}'
+        if (sample['postprocess_queued'] and sample['postprocess_running'] >= workers
+                and not self._cpu_busy(sample, 0.5) and not self._io_busy(sample)):
+            return workers + 1, 'tracks waiting for processing and CPU idle'
+        return workers, None
+
+    def _apply(self, pool_name, pool, target, reason, sample):
+        low, high = self.bounds[pool_name]
+        current = pool.max_workers
+        target = max(low, min(high, target))
+        if target == current:
+            return
+        pool.resize(target)
+        decision = {
+            'time': sample['time'],
+            'pool': pool_name,
+            'from': current,
+            'to': target,
+            'reason': reason,
+        }
+        self.decisions.append(decision)
+        logger.info(f"Resized {pool_name} pool {current} -> {target}: {reason}")
+
+    def tick(self):
+        """Take one sample and adjust both pools"""
+        sample = self.sample()
+        with self._lock:
+            self.last_sample = sample
+            if not self.enabled:
+                return sample
+            target, reason = self._download_target(sample)
+            self._apply('download', self.download_pool, target, reason, sample)
+            target, reason = self._postprocess_target(sample)
+            self._apply('postprocess', self.postprocess_pool, target, reason, sample)
+        return sample
+
+    def configure(self, enabled=None, download_bounds=None, postprocess_bounds=None):
+        """Change the bounds or switch the controller on or off"""
+        with self._lock:
+            if enabled is not None:
+                self.enabled = bool(enabled)
+            for name, bounds in (('download', download_bounds), ('postprocess', postprocess_bounds)):
+                if bounds:
+                    low, high = max(1, int(bounds[0])), max(1, int(bounds[1]))
+                    self.bounds[name] = (min(low, high), max(low, high))
+            self._ceiling = None
+            self._last_increase = None
+
+        # Bring the pools inside new bounds right away
+        for name, pool in (('download', self.download_pool), ('postprocess', self.postprocess_pool)):
+            low, high = self.bounds[name]
+            if not low <= pool.max_workers <= high:
+                pool.resize(max(low, min(high, pool.max_workers)))
+
+    def status(self):
+        """Describe the bounds, the last sample and recent decisions"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'interval_seconds': self.interval,
+                'bounds': {name: {'min': low, 'max': high} for name, (low, high) in self.bounds.items()},
+                'limits': {
+                    'cpu_pressure': self.cpu_limit,
+                    'io_pressure': self.io_limit,
+                    'load_per_cpu': self.load_limit,
+                    'min_free_mb': self.min_free_mb,
+                },
+                'workers': {
+                    'download': self.download_pool.max_workers,
+                    'postprocess': self.postprocess_pool.max_workers,
+                },
+                'last_sample': self.last_sample,
+                'decisions': list(self.decisions)[::-1],
+            }
+
+    def start(self):
+        """Start the background sampling thread"""
+        def control_loop():
+            while True:
+                try:
+                    self.tick()
+                except Exception as e:
+                    logger.error(f"Concurrency controller error: {e}")
+                time.sleep(self.interval)
+
+        thread = threading.Thread(target=control_loop, name='concurrency-controller', daemon=True)
+        thread.start()
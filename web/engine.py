@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+In-process yt-dlp Engine
+Runs yt-dlp through its Python API instead of forking the binary per job
+"""
+
+import logging
+import subprocess
+import threading
+import time
+
+try:
+    import yt_dlp
+    from yt_dlp.utils import DownloadCancelled
+except ImportError:
+    yt_dlp = None
+
+    class DownloadCancelled(Exception):
+        """Stand-in so callers can catch it without yt-dlp installed"""
+
+logger = logging.getLogger(__name__)
+
+# Seconds a stalled connection may block before yt-dlp gives up on it, unless
+# the command line sets --socket-timeout; bounds how long an abandoned job
+# thread lingers after its deadline
+SOCKET_TIMEOUT = 30
+# Seconds between the watchdog's checks of the deadline and should_stop
+WATCHDOG_INTERVAL = 1
+
+# Job-facing names of the yt-dlp postprocessors we run
+POSTPROCESSOR_STAGES = {
+    'ExtractAudio': 'transcode',
+    'FFmpegExtractAudio': 'transcode',
+    'Metadata': 'tag',
+    'FFmpegMetadata': 'tag',
+    'EmbedThumbnail': 'thumbnail',
+}
+
+
+class _CollectingLogger:
+    """yt-dlp logger that keeps error output for the job record"""
+
+    def __init__(self):
+        self.errors = []
+
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        logger.debug(f"yt-dlp: {msg}")
+
+    def error(self, msg):
+        self.errors.append(msg)
+
+
+class YtDlpEngine:
+    """Long-lived yt-dlp engine shared by all download workers.
+
+    yt-dlp and its extractors are imported once per process, so a job only
+    pays for building a YoutubeDL instance. Options are given as the same
+    command-line arguments the subprocess path uses, so both paths behave alike.
+    """
+
+    def __init__(self):
+        self._ready = threading.Event()
+
+    @staticmethod
+    def available():
+        """Whether the yt_dlp package can be imported"""
+        return yt_dlp is not None
+
+    def warm_up(self):
+        """Load the extractors in the background so the first job doesn't pay for it"""
+        def load():
+            try:
+                with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+                    ydl.get_info_extractor('Youtube')
+                logger.info(f"yt-dlp engine ready (yt-dlp {yt_dlp.version.__version__})")
+            except Exception as e:
+                logger.error(f"yt-dlp engine warm-up failed: {e}")
+            finally:
+                self._ready.set()
+
+        threading.Thread(target=load, name='ytdlp-warmup', daemon=True).start()
+
+    @staticmethod
+    def _params(args):
+        parsed = yt_dlp.parse_options(args)
+        return parsed.ydl_opts, parsed.urls, parsed.options.load_info_filename
+
+    def extract_flat(self, url, timeout=30):
+        """Return the flat playlist/video info dict without downloading"""
+        params = {
+            'quiet': True,
+            'no_warnings': True,
+            'skip_download': True,
+            'extract_flat': 'in_playlist',
+            'socket_timeout': timeout,
+        }
+        with yt_dlp.YoutubeDL(params) as ydl:
+            return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+    def run(self, args, timeout=1800, on_progress=None, on_postprocess=None,
+            on_file=None, should_stop=None):
+        """Run a yt-dlp command line in-process.
+
+        on_file receives {'filepath', 'id', 'title'} for every finished file.
+        Returns a CompletedProcess like the subprocess path. Raises
+        subprocess.TimeoutExpired when the deadline passes and
+        DownloadCancelled when should_stop() becomes true.
+
+        yt-dlp runs on its own thread while this one watches the deadline and
+        should_stop(), so a job that stalls before its first hook (extracting,
+        connecting) still ends on time. The abandoned thread stops at its next
+        hook or socket timeout.
+        """
+        self._ready.wait(timeout=60)
+        params, urls, info_file = self._params(args)
+        if not params.get('socket_timeout'):
+            params['socket_timeout'] = min(SOCKET_TIMEOUT, timeout)
+        deadline = time.monotonic() + timeout
+        collector = _CollectingLogger()
+        abandoned = threading.Event()
+        current = {}
+        outcome = {}
+
+        def check_stop():
+            if abandoned.is_set() or (should_stop and should_stop()):
+                raise DownloadCancelled('Cancelled by user')
+
+        def progress_hook(d):
+            check_stop()
+            current['info'] = d.get('info_dict') or current.get('info')
+            if on_progress and d.get('status') == 'downloading':
+                on_progress(progress_from_hook(d))
+
+        def postprocessor_hook(d):
+            check_stop()
+            current['info'] = d.get('info_dict') or current.get('info')
+            if on_postprocess:
+                name = d.get('postprocessor')
+                on_postprocess(POSTPROCESSOR_STAGES.get(name, name), d.get('status'))
+
+        def post_hook(filepath):
+            if on_file and not abandoned.is_set():
+                info = current.get('info') or {}
+                on_file({'filepath': filepath, 'id': info.get('id'), 'title': info.get('title')})
+
+        params.update({
+            'logger': collector,
+            'noprogress': True,
+            'progress_hooks': [progress_hook],
+            'postprocessor_hooks': [postprocessor_hook],
+            'post_hooks': [post_hook],
+        })
+
+        def download():
+            try:
+                with yt_dlp.YoutubeDL(params) as ydl:
+                    if info_file:
+                        # Post-process an already fetched file (--load-info-json)
+                        outcome['returncode'] = ydl.download_with_info_file(info_file)
+                    else:
+                        outcome['returncode'] = ydl.download(urls)
+            except BaseException as e:
+                outcome['error'] = e
+
+        worker = threading.Thread(target=download, name='ytdlp-job', daemon=True)
+        worker.start()
+        while True:
+            worker.join(WATCHDOG_INTERVAL)
+            if not worker.is_alive():
+                break
+            if time.monotonic() > deadline:
+                abandoned.set()
+                raise subprocess.TimeoutExpired(args, timeout)
+            if should_stop and should_stop():
+                abandoned.set()
+                raise DownloadCancelled('Cancelled by user')
+
+        error = outcome.get('error')
+        if isinstance(error, yt_dlp.utils.DownloadError):
+            collector.errors.append(str(error))
+            return subprocess.CompletedProcess(args, 1, '', '\n'.join(collector.errors))
+        if error is not None:
+            raise error
+        return subprocess.CompletedProcess(args, outcome['returncode'], '', '\n'.join(collector.errors))
+
+
+def progress_from_hook(d):
+    """Convert a yt-dlp progress hook dict to the PROGRESS_TEMPLATE fields"""
+    total = d.get('total_bytes') or d.get('total_bytes_estimate')
+    downloaded = d.get('downloaded_bytes') or 0
+    percent = downloaded * 100.0 / total if total else 0.0
+
+    info = d.get('info_dict') or {}
+    index, entries = info.get('playlist_index'), info.get('n_entries')
+    if index and entries:
+        percent = ((index - 1) * 100 + percent) / entries
+
+    return {
+        'percent': max(0.0, min(percent, 100.0)),
+        'status': d.get('status'),
+        'downloaded_bytes': downloaded,
+        'speed': d.get('speed'),
+        'playlist_index': index,
+        'n_entries': entries,
+    }
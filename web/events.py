@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Download Event Bus
+Fan-out of job updates to Server-Sent Event subscribers
+"""
+
+import json
+import queue
+import threading
+
+# Seconds between keep-alive comments on idle streams
+KEEPALIVE_INTERVAL = 15
+
+# Updates buffered per subscriber before the oldest are dropped
+SUBSCRIBER_BUFFER = 256
+
+
+class EventBus:
+    """Deliver job updates to every subscriber of that job or of all jobs"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, job_id=None):
+        """Register a subscriber; job_id=None receives every job's updates"""
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_BUFFER)
+        with self._lock:
+            self._subscribers[subscriber] = job_id
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Remove a subscriber"""
+        with self._lock:
+            self._subscribers.pop(subscriber, None)
+
+    def publish(self, job_id, record):
+        """Send a job record to the interested subscribers"""
+        with self._lock:
+            targets = [s for s, wanted in self._subscribers.items() if wanted in (None, job_id)]
+
+        for subscriber in targets:
+            try:
+                subscriber.put_nowait(record)
+            except queue.Full:
+                # Slow client: drop the oldest update, the newest one matters most
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait(record)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def subscriber_count(self):
+        """Number of connected subscribers"""
+        with self._lock:
+            return len(self._subscribers)
+
+
+def format_sse(data, event=None):
+    """Encode a payload as a Server-Sent Events message"""
+    message = ''
+    if event:
+        message += f'event: {event}\n'
+    message += f'data: {json.dumps(data)}\n\n'
+    return message
+
+
+def stream_events(bus, job_id=None, snapshot=None, until=None):
+    """Generate SSE messages for a subscriber until the client disconnects.
+
+    `snapshot()` is called after subscribing and its result sent first, so no
+    update can slip in between. The stream ends after a record for which
+    `until(record)` is true.
+    """
+    subscriber = bus.subscribe(job_id)
+    try:
+        initial = snapshot() if snapshot else None
+        if initial is not None:
+            yield format_sse(initial, event='status')
+            if until and until(initial):
+                return
+        while True:
+            try:
+                record = subscriber.get(timeout=KEEPALIVE_INTERVAL)
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            yield format_sse(record, event='status')
+            if until and until(record):
+                return
+    finally:
+        bus.unsubscribe(subscriber)
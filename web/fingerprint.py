@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Acoustic Fingerprints
+Spots the same recording uploaded by different channels, whatever the file is called
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # Fingerprinting is then off; everything else works
+    np = None
+
+from catalog import is_audio, is_hidden
+
+logger = logging.getLogger(__name__)
+
+# Audio is decoded to mono at this rate; the bands below all fit under its Nyquist
+SAMPLE_RATE = 5512
+# Decode this much audio, from this far in (skipping intros), per track
+WINDOW_SECONDS = 40
+START_SECONDS = 20
+# Tracks with less audio than this past START_SECONDS are decoded from the start
+MIN_SECONDS = 10
+
+# 370 ms frames every 46 ms: strong overlap keeps bits stable when two
+# decodes don't start on the same sample
+FRAME_SIZE = 2048
+HOP_SIZE = 256
+# 33 log-spaced bands give 32 energy-difference bits per frame
+BAND_EDGES_HZ = np.geomspace(300, 2000, 34) if np is not None else None
+
+# Every KEY_STRIDE-th frame of a stored fingerprint goes into the lookup
+# table, once per 16-bit slice: a slice survives re-encoding far more often
+# than all 32 bits do (bit-sampling LSH)
+KEY_STRIDE = 8
+KEY_SLICES = (0, 8, 16)
+KEY_BITS = 16
+# Key hits two fingerprints must share around one alignment to be compared at all
+MIN_VOTES = 3
+# Candidate alignments verified per lookup
+MAX_CANDIDATES = 5
+# Aligned frames needed for a verdict (about 10 s)
+MIN_OVERLAP_FRAMES = 200
+# Bit error rate under which two fingerprints are the same recording
+# (unrelated audio sits near 0.5)
+MATCH_BER = 0.35
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    start REAL NOT NULL,
+    hashes BLOB NOT NULL,
+    duplicate_of TEXT,
+    ber REAL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS fingerprint_keys (
+    key INTEGER NOT NULL,
+    fingerprint_id INTEGER NOT NULL,
+    frame INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fingerprint_keys_key ON fingerprint_keys (key);
+CREATE INDEX IF NOT EXISTS fingerprint_keys_id ON fingerprint_keys (fingerprint_id);
+"""
+
+# SQLite's default limit on host parameters per statement
+QUERY_CHUNK = 900
+
+
+def decode(path, start=START_SECONDS, seconds=WINDOW_SECONDS):
+    """Decode a window of a file to mono float PCM at SAMPLE_RATE with ffmpeg"""
+    result = subprocess.run(
+        [
+            'ffmpeg', '-nostdin', '-v', 'error',
+            '-ss', str(start), '-t', str(seconds), '-i', path,
+            '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-'
+        ],
+        capture_output=True,
+        timeout=120
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout, dtype='<i2').astype(np.float32) / 32768
+
+
+def compute(samples):
+    """Sub-fingerprints of PCM: one uint32 per frame, a bit per band whose energy
+    difference to the next band rose or fell since the previous frame"""
+    if len(samples) < FRAME_SIZE + HOP_SIZE:
+        return np.zeros(0, dtype=np.uint32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FRAME_SIZE)[::HOP_SIZE]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FRAME_SIZE), axis=1)) ** 2
+    edges = np.searchsorted(np.fft.rfftfreq(FRAME_SIZE, 1 / SAMPLE_RATE), BAND_EDGES_HZ)
+    energy = np.add.reduceat(spectrum, edges[:-1], axis=1)
+    across = energy[:, :-1] - energy[:, 1:]
+    bits = (across[1:] - across[:-1]) > 0
+    weights = np.left_shift(np.uint32(1), np.arange(32, dtype=np.uint32))
+    return (bits.astype(np.uint32) * weights).sum(axis=1, dtype=np.uint64).astype(np.uint32)
+
+
+def fingerprint_file(path):
+    """(start second, sub-fingerprints) of a window from a file's middle, or its start if short"""
+    samples = decode(path)
+    start = START_SECONDS
+    if len(samples) < MIN_SECONDS * SAMPLE_RATE:
+        samples = decode(path, start=0)
+        start = 0
+    return start, compute(samples)
+
+
+def quarantine(path, root, directory, sidecars=()):
+    """Move a file and its sidecars from root into directory, keeping their relative path;
+    returns the file's new path"""
+    target = os.path.join(directory, os.path.relpath(path, root))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(path, target)
+    stem, target_stem = os.path.splitext(path)[0], os.path.splitext(target)[0]
+    for ext in sidecars:
+        if os.path.exists(stem + ext):
+            shutil.move(stem + ext, target_stem + ext)
+    return target
+
+
+def slice_keys(value):
+    """LSH keys of one sub-fingerprint, tagged with their slice so they never collide"""
+    mask = (1 << KEY_BITS) - 1
+    return [(index << KEY_BITS) | ((value >> shift) & mask) for index, shift in enumerate(KEY_SLICES)]
+
+
+def bit_error_rate(a, b, offset):
+    """Share of differing bits where b, shifted by offset frames, overlaps a; (ber, frames)"""
+    if offset >= 0:
+        a = a[offset:]
+    else:
+        b = b[-offset:]
+    length = min(len(a), len(b))
+    if length <= 0:
+        return 1.0, 0
+    differing = np.unpackbits(np.bitwise_xor(a[:length], b[:length]).view(np.uint8)).sum()
+    return differing / (32 * length), length
+
+
+class FingerprintIndex:
+    """Store track fingerprints and find near-duplicates among them.
+
+    A fingerprint is a sequence of 32-bit sub-fingerprints over a 40 s
+    window of the track. Re-encodes of one recording share most bits, so
+    16-bit slices of every KEY_STRIDE-th sub-fingerprint often survive
+    exactly and serve as exact-match keys in SQLite. A lookup votes on
+    (track, alignment) pairs with those keys and verifies the best few by
+    bit error rate over the overlap, which tolerates different intros
+    between uploads. `file_exists` decides whether a matched file is still
+    in the library; stale fingerprints are dropped when met.
+    """
+
+    def __init__(self, db_path, file_exists=os.path.exists):
+        self.db_path = db_path
+        self.file_exists = file_exists
+        self.batch = {'running': False}
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def available(self):
+        """Whether NumPy and ffmpeg are installed"""
+        return np is not None and shutil.which('ffmpeg') is not None
+
+    def has(self, path):
+        return self._connection().execute(
+            'SELECT 1 FROM fingerprints WHERE path = ?', (path,)
+        ).fetchone() is not None
+
+    def match(self, hashes, start=START_SECONDS, exclude=None):
+        """Best stored fingerprint of the same recording: {'path', 'ber', 'offset_seconds'} or None"""
+        positions = defaultdict(list)
+        for frame, value in enumerate(hashes.tolist()):
+            if value:  # Silence hashes to 0
+                for key in slice_keys(value):
+                    positions[key].append(frame)
+        if not positions:
+            return None
+
+        conn = self._connection()
+        keys = list(positions)
+        votes = Counter()
+        for index in range(0, len(keys), QUERY_CHUNK):
+            chunk = keys[index:index + QUERY_CHUNK]
+            rows = conn.execute(
+                f'SELECT key, fingerprint_id, frame FROM fingerprint_keys '
+                f'WHERE key IN ({", ".join("?" for _ in chunk)})', chunk
+            )
+            for key, fingerprint_id, frame in rows:
+                for query_frame in positions[key]:
+                    votes[(fingerprint_id, frame - query_frame)] += 1
+
+        # Decodes can land between two frames, splitting the votes of the true alignment
+        candidates = sorted(
+            (
+                (count + max(votes.get((fingerprint_id, offset - 1), 0), votes.get((fingerprint_id, offset + 1), 0)),
+                 fingerprint_id, offset)
+                for (fingerprint_id, offset), count in votes.most_common(MAX_CANDIDATES * 4)
+            ),
+            reverse=True
+        )
+        best, seen = None, set()
+        for count, fingerprint_id, offset in candidates:
+            if count < MIN_VOTES or len(seen) >= MAX_CANDIDATES:
+                break
+            if fingerprint_id in seen:
+                continue
+            seen.add(fingerprint_id)
+            row = conn.execute('SELECT * FROM fingerprints WHERE id = ?', (fingerprint_id,)).fetchone()
+            if row is None or row['path'] == exclude:
+                continue
+            stored = np.frombuffer(row['hashes'], dtype=np.uint32)
+            ber, overlap = min(bit_error_rate(stored, hashes, shift) for shift in (offset - 1, offset, offset + 1))
+            if overlap < MIN_OVERLAP_FRAMES or ber >= MATCH_BER:
+                continue
+            if not self.file_exists(row['path']):
+                self.remove(row['path'])
+                continue
+            if best is None or ber < best['ber']:
+                best = {
+                    'path': row['path'],
+                    'ber': round(float(ber), 3),
+                    'offset_seconds': round(offset * HOP_SIZE / SAMPLE_RATE + row['start'] - start, 1),
+                }
+        return best
+
+    def add(self, path, start, hashes, duplicate_of=None, ber=None):
+        """Store a file's fingerprint and its lookup keys"""
+        keys = [
+            (key, frame) for frame, value in enumerate(hashes.tolist())
+            if frame % KEY_STRIDE == 0 and value
+            for key in slice_keys(value)
+        ]
+        with self._write_lock:
+            conn = self._connection()
+            conn.execute('BEGIN')
+            try:
+                self._delete(conn, path)
+                cursor = conn.execute(
+                    'INSERT INTO fingerprints (path, start, hashes, duplicate_of, ber, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (path, start, hashes.astype(np.uint32).tobytes(), duplicate_of, ber, time.time())
+                )
+                conn.executemany(
+                    'INSERT INTO fingerprint_keys (key, fingerprint_id, frame) VALUES (?, ?, ?)',
+                    [(key, cursor.lastrowid, frame) for key, frame in keys]
+                )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def check(self, path):
+        """Fingerprint a file, store it and return the match it duplicates, if any"""
+        start, hashes = fingerprint_file(path)
+        match = self.match(hashes, start, exclude=path)
+        self.add(path, start, hashes, *((match['path'], match['ber']) if match else ()))
+        return match
+
+    def remove(self, path):
+        """Forget a file's fingerprint"""
+        with self._write_lock:
+            self._delete(self._connection(), path)
+
+    def _delete(self, conn, path):
+        row = conn.execute('SELECT id FROM fingerprints WHERE path = ?', (path,)).fetchone()
+        if row:
+            conn.execute('DELETE FROM fingerprint_keys WHERE fingerprint_id = ?', (row['id'],))
+            conn.execute('DELETE FROM fingerprints WHERE id = ?', (row['id'],))
+
+    def duplicates(self):
+        """Files flagged as another upload of a recording already in the library"""
+        rows = self._connection().execute(
+            'SELECT path, duplicate_of, ber, created_at FROM fingerprints '
+            'WHERE duplicate_of IS NOT NULL ORDER BY created_at DESC'
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+
+    def fingerprint_library(self, paths, workers=2):
+        """Fingerprint every file of paths that has none yet, decoding in parallel.
+
+        Matching and storing stay on this thread, in path order, so of two
+        copies the one listed first is kept as the original.
+        """
+        todo = [path for path in paths if not self.has(path)]
+        self.batch = {'running': True, 'total': len(todo), 'done': 0, 'duplicates': 0, 'failed': 0,
+                      'started': time.time()}
+
+        def compute_one(path):
+            try:
+                return path, fingerprint_file(path)
+            except Exception as e:
+                logger.warning(f"Could not fingerprint {path}: {e}")
+                return path, None
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='fingerprint') as pool:
+                for path, result in pool.map(compute_one, todo):
+                    self.batch['done'] += 1
+                    if result is None:
+                        self.batch['failed'] += 1
+                        continue
+                    start, hashes = result
+                    match = self.match(hashes, start, exclude=path)
+                    if match:
+                        self.batch['duplicates'] += 1
+                        logger.info(f"{path} duplicates {match['path']} (BER {match['ber']})")
+                    self.add(path, start, hashes, *((match['path'], match['ber']) if match else ()))
+        finally:
+            self.batch.update(running=False, finished=time.time())
+        logger.info(
+            f"Fingerprinted {self.batch['done']} files: {self.batch['duplicates']} duplicates, "
+            f"{self.batch['failed']} failed"
+        )
+        return self.batch
+
+
+def library_files(root):
+    """Audio files under root in a stable order, hidden directories skipped"""
+    paths = []
+    for directory, subdirs, files in os.walk(os.path.abspath(root)):
+        subdirs[:] = sorted(name for name in subdirs if not is_hidden(name))
+        paths.extend(os.path.join(directory, name) for name in sorted(files)
+                     if not is_hidden(name) and is_audio(name))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fingerprint a music library and report near-duplicate uploads')
+    parser.add_argument('library', nargs='?', default=os.environ.get('DOWNLOAD_PATH', '/app/downloads'))
+    parser.add_argument('--db', default=os.environ.get('FINGERPRINT_DB_PATH', '/app/config/fingerprints.db'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='files decoded in parallel')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    index = FingerprintIndex(args.db)
+    if not index.available():
+        parser.error('fingerprinting needs NumPy and ffmpeg')
+    index.fingerprint_library(library_files(args.library), workers=args.workers)
+    for duplicate in index.duplicates():
+        print(f"{duplicate['path']}\n    same recording as {duplicate['duplicate_of']} (BER {duplicate['ber']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Gunicorn Configuration
+Production server: several threaded workers, one of them elected leader
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('LISTEN_PORT', '80')}"
+
+# Threaded workers: SSE streams and status polls each hold a thread, not a process
+workers = int(os.environ.get('WEB_WORKERS', '2'))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', '16'))
+
+# Workers are never recycled on a request count: restarting the leader
+# interrupts running downloads (the next leader resumes them)
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = None
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """Every worker joins the leader election once the app is loaded"""
+    import app
+    app.start_services(serve_internal=True)
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Download Job Store
+Durable SQLite storage for download jobs with incremental statistics
+"""
+
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Columns stored directly on the jobs table; every other field lives in `data`
+JOB_COLUMNS = ('status', 'progress', 'message', 'url', 'start_time', 'end_time', 'parent_id')
+
+# Statuses that count towards the lifetime statistics
+COUNTED_STATUSES = {'completed': 'completed', 'error': 'failed'}
+
+FINISHED_STATUSES = ('completed', 'error', 'cancelled')
+ACTIVE_STATUSES = ('queued', 'starting', 'downloading', 'processing', 'retrying')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'queued',
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    url TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    parent_id TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, updated_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs (created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs (updated_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_parent ON jobs (parent_id, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_parent_created ON jobs (parent_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_parent_status_created ON jobs (parent_id, status, created_at, id);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class JobStore:
+    """Persist download jobs in SQLite (WAL mode).
+
+    Lookups go through the primary key, and the statistics shown by /stats and
+    the queue page are kept as counters that are updated in the same transaction
+    as the job, so no request ever has to scan the job history.
+    """
+
+    def __init__(self, db_path, retention_days=30, max_finished=1000):
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self.max_finished = max_finished
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._migrate()
+        self._connection().executescript(SCHEMA)
+
+    def _migrate(self):
+        """Add columns introduced after a database was created"""
+        conn = self._connection()
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+        if columns and 'parent_id' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN parent_id TEXT')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+    @staticmethod
+    def _bump(conn, name, delta=1):
+        conn.execute(
+            'INSERT INTO counters (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            (name, delta)
+        )
+
+    def _count_transition(self, conn, old_status, new_status):
+        if old_status == new_status:
+            return
+        if old_status is not None:
+            self._bump(conn, f'status:{old_status}', -1)
+            if old_status in COUNTED_STATUSES:
+                self._bump(conn, COUNTED_STATUSES[old_status], -1)
+        self._bump(conn, f'status:{new_status}')
+        if new_status in COUNTED_STATUSES:
+            self._bump(conn, COUNTED_STATUSES[new_status])
+
+    @staticmethod
+    def _row_to_record(row):
+        record = json.loads(row['data'])
+        for column in JOB_COLUMNS:
+            if row[column] is not None:
+                record[column] = row[column]
+        record['id'] = row['id']
+        return record
+
+    def create(self, job_id, **fields):
+        """Insert a new job, or reset an existing one with the same ID"""
+        with self._transaction() as conn:
+            row = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            self._insert(conn, job_id, fields, row['status'] if row else None)
+            self._bump(conn, 'version')
+
+    def update(self, job_id, **fields):
+        """Update fields of a job, creating it if it does not exist yet"""
+        self._update(job_id, fields)
+
+    def update_json(self, job_id, key, subkey, value, **fields):
+        """Set data[key][subkey], merged into the dict already there if both are dicts.
+
+        The read-modify-write runs in the same transaction as the other
+        fields, so the fetch and post-processing stages of one job, which run
+        on different pools, never drop each other's entries.
+        """
+        self._update(job_id, fields, (key, subkey, value))
+
+    def _update(self, job_id, fields, nested=None):
+        with self._transaction() as conn:
+            row = conn.execute('SELECT status, data FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            self._bump(conn, 'version')
+            if row is None:
+                if nested:
+                    key, subkey, value = nested
+                    fields[key] = {subkey: value}
+                self._insert(conn, job_id, fields, None)
+                return
+
+            columns = {key: fields.pop(key) for key in JOB_COLUMNS if key in fields}
+            if 'status' in columns:
+                self._count_transition(conn, row['status'], columns['status'])
+
+            data = json.loads(row['data'])
+            data.update(fields)
+            if nested:
+                key, subkey, value = nested
+                section = data.get(key) if isinstance(data.get(key), dict) else {}
+                current = section.get(subkey)
+                section[subkey] = dict(current, **value) if isinstance(current, dict) and isinstance(value, dict) else value
+                data[key] = section
+            assignments = ''.join(f', {key} = ?' for key in columns)
+            conn.execute(
+                f'UPDATE jobs SET updated_at = ?, data = ?{assignments} WHERE id = ?',
+                (time.time(), json.dumps(data), *columns.values(), job_id)
+            )
+
+    def _insert(self, conn, job_id, fields, old_status):
+        now = time.time()
+        columns = {key: fields.pop(key) for key in JOB_COLUMNS if key in fields}
+        columns.setdefault('status', 'queued')
+        if old_status is None:
+            self._bump(conn, 'total')
+        self._count_transition(conn, old_status, columns['status'])
+        conn.execute(
+            'INSERT OR REPLACE INTO jobs (id, created_at, updated_at, data, {0}) '
+            'VALUES (?, ?, ?, ?, {1})'.format(', '.join(columns), ', '.join('?' for _ in columns)),
+            (job_id, now, now, json.dumps(fields), *columns.values())
+        )
+
+    def get(self, job_id):
+        """Return a job record, or None if unknown"""
+        row = self._connection().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._row_to_record(row) if row else None
+
+    def list(self, limit=100):
+        """Return the most recent top-level jobs, newest first, keyed by ID"""
+        rows = self._connection().execute(
+            'SELECT * FROM jobs WHERE parent_id IS NULL ORDER BY created_at DESC LIMIT ?', (limit,)
+        ).fetchall()
+        return {row['id']: self._row_to_record(row) for row in rows}
+
+    def page(self, limit=100, cursor=None, statuses=None, since=None, until=None, parent_id=None):
+        """Return one page of jobs, newest first, and the cursor of the next page.
+
+        Without parent_id only top-level jobs are listed, with it the tracks of
+        that playlist. since/until bound the creation time (epoch seconds).
+        Pages are keyed on (created_at, id), so they stay cheap however deep
+        the history goes and don't shift when new jobs arrive.
+        """
+        if parent_id:
+            clauses, params = ['parent_id = ?'], [parent_id]
+        else:
+            clauses, params = ['parent_id IS NULL'], []
+        if statuses:
+            clauses.append('status IN ({0})'.format(', '.join('?' for _ in statuses)))
+            params.extend(statuses)
+        if since is not None:
+            clauses.append('created_at >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('created_at < ?')
+            params.append(until)
+        if cursor:
+            clauses.append('(created_at, id) < (?, ?)')
+            params.extend(decode_cursor(cursor))
+
+        rows = self._connection().execute(
+            f'SELECT * FROM jobs WHERE {" AND ".join(clauses)} '
+            f'ORDER BY created_at DESC, id DESC LIMIT ?',
+            (*params, limit + 1)
+        ).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+        return [self._row_to_record(row) for row in rows], next_cursor
+
+    def version(self):
+        """Counter bumped by every change to the jobs table, for cheap ETags"""
+        row = self._connection().execute("SELECT value FROM counters WHERE name = 'version'").fetchone()
+        return row['value'] if row else 0
+
+    def children(self, parent_id, statuses=None):
+        """Return the child jobs of a playlist job in creation order"""
+        query = 'SELECT * FROM jobs WHERE parent_id = ?'
+        params = [parent_id]
+        if statuses:
+            query += ' AND status IN ({0})'.format(', '.join('?' for _ in statuses))
+            params.extend(statuses)
+        rows = self._connection().execute(query + ' ORDER BY created_at, id', params).fetchall()
+        return [self._row_to_record(row) for row in rows]
+
+    def child_summary(self, parent_id):
+        """Count a playlist job's children by status and average their progress"""
+        rows = self._connection().execute(
+            'SELECT status, COUNT(*) AS count, SUM(progress) AS progress '
+            'FROM jobs WHERE parent_id = ? GROUP BY status',
+            (parent_id,)
+        ).fetchall()
+        total = sum(row['count'] for row in rows)
+        progress = sum(row['progress'] or 0 for row in rows)
+        return {
+            'total': total,
+            'by_status': {row['status']: row['count'] for row in rows},
+            'progress': progress / total if total else 0
+        }
+
+    def ids_with_status(self, statuses):
+        """Return the IDs of all jobs in one of the given statuses"""
+        placeholders = ', '.join('?' for _ in statuses)
+        rows = self._connection().execute(
+            f'SELECT id FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at',
+            tuple(statuses)
+        ).fetchall()
+        return [row['id'] for row in rows]
+
+    def stats(self):
+        """Return the lifetime and per-status counters"""
+        rows = self._connection().execute('SELECT name, value FROM counters').fetchall()
+        counters = {row['name']: row['value'] for row in rows}
+        total = counters.get('total', 0)
+        completed = counters.get('completed', 0)
+        return {
+            'total_downloads': total,
+            'completed': completed,
+            'failed': counters.get('failed', 0),
+            'success_rate': (completed / total * 100) if total > 0 else 0,
+            'by_status': {
+                name.split(':', 1)[1]: value
+                for name, value in counters.items()
+                if name.startswith('status:') and value
+            }
+        }
+
+    def prune(self):
+        """Evict finished jobs past the retention age or count limit"""
+        placeholders = ', '.join('?' for _ in FINISHED_STATUSES)
+        cutoff = time.time() - self.retention_days * 86400
+        removed = 0
+
+        # Playlist entries are only evicted together with their playlist job
+        with self._transaction() as conn:
+            expired = conn.execute(
+                f'SELECT id FROM jobs WHERE parent_id IS NULL AND status IN ({placeholders}) '
+                f'AND updated_at < ?',
+                (*FINISHED_STATUSES, cutoff)
+            ).fetchall()
+            overflow = conn.execute(
+                f'SELECT id FROM jobs WHERE parent_id IS NULL AND status IN ({placeholders}) '
+                f'ORDER BY updated_at DESC LIMIT -1 OFFSET ?',
+                (*FINISHED_STATUSES, self.max_finished)
+            ).fetchall()
+
+            evicted = {row['id'] for row in expired} | {row['id'] for row in overflow}
+            for job_id in evicted:
+                rows = conn.execute(
+                    'SELECT status FROM jobs WHERE id = ? OR parent_id = ?', (job_id, job_id)
+                ).fetchall()
+                for row in rows:
+                    self._bump(conn, f'status:{row["status"]}', -1)
+                conn.execute('DELETE FROM jobs WHERE id = ? OR parent_id = ?', (job_id, job_id))
+                removed += len(rows)
+            if evicted:
+                self._bump(conn, 'version')
+
+        if removed:
+            logger.info(f"Pruned {removed} finished jobs from the job store")
+        return removed
+
+
+def encode_cursor(created_at, job_id):
+    """Opaque page cursor for a (created_at, id) position"""
+    return base64.urlsafe_b64encode(json.dumps([created_at, job_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for a malformed cursor"""
+    try:
+        created_at, job_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(created_at), str(job_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+
+
+class _Transaction:
+    """Context manager running a block inside BEGIN IMMEDIATE ... COMMIT"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute('COMMIT')
+        else:
+            self.conn.execute('ROLLBACK')
+        return False
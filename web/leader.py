@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Worker Leader Election
+Picks the one server process that runs the schedulers and background loops
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds between a follower's attempts to take over the lock
+RETRY_INTERVAL = 2
+
+
+class LeaderElection:
+    """Elect one worker of a multi-process server with an exclusive file lock.
+
+    Every worker tries to flock `lock_path`; the one that gets it is the
+    leader until its process exits, when the kernel releases the lock and
+    the next follower's retry takes over. The leader can publish the address
+    of its internal server in the lock file, so followers know where to
+    forward requests that need the leader's in-memory state.
+    """
+
+    def __init__(self, lock_path, retry_interval=RETRY_INTERVAL):
+        self.lock_path = lock_path
+        self.retry_interval = retry_interval
+        self.is_leader = False
+        self._file = None
+        self._cached = (0, None)
+
+    def try_acquire(self):
+        """Take the lock if no other process holds it"""
+        os.makedirs(os.path.dirname(self.lock_path) or '.', exist_ok=True)
+        f = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self._file = f
+        self.is_leader = True
+        self.publish(None)
+        return True
+
+    def publish(self, address):
+        """Record this leader's PID and internal address in the lock file"""
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(json.dumps({'pid': os.getpid(), 'address': address}))
+        self._file.flush()
+
+    def leader(self, max_age=1.0):
+        """The current leader's {'pid', 'address'}, re-read at most every max_age seconds"""
+        read_at, cached = self._cached
+        if time.monotonic() - read_at < max_age:
+            return cached
+        try:
+            with open(self.lock_path) as f:
+                cached = json.loads(f.read() or 'null')
+        except (OSError, ValueError):
+            cached = None
+        self._cached = (time.monotonic(), cached)
+        return cached
+
+    def start(self, on_elected):
+        """Try to become leader now, and keep trying in the background until elected"""
+        def elected():
+            logger.info(f"Worker {os.getpid()} is the leader")
+            try:
+                on_elected()
+            except Exception as e:
+                logger.error(f"Leader startup failed: {e}")
+
+        if self.try_acquire():
+            elected()
+            return
+
+        def election_loop():
+            while not self.try_acquire():
+                time.sleep(self.retry_interval)
+            elected()
+
+        thread = threading.Thread(target=election_loop, name='leader-election', daemon=True)
+        thread.start()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Navidrome Scan Coordinator
+Coalesces library scan requests into at most one scan per window
+"""
+
+import hashlib
+import logging
+import secrets
+import subprocess
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DOCKER_SCAN_CMD = ['docker', 'exec', 'navidrome', '/app/navidrome', '--configfile', '/data/navidrome.toml', 'scan']
+
+SUBSONIC_API_VERSION = '1.16.1'
+SUBSONIC_CLIENT = 'youtube-downloader'
+
+# Seconds between getScanStatus polls while Navidrome is busy
+SCAN_POLL_INTERVAL = 5
+
+# Failed getScanStatus calls retried (with doubling backoff) before a scan is deferred
+STATUS_RETRIES = 3
+
+
+class ScanCoordinator:
+    """Trigger Navidrome library scans without piling them up.
+
+    Completed downloads call `request()`. The first request opens a window,
+    every request that arrives while it is open is folded into it, and one
+    scan runs when it closes. Scans go through the Subsonic startScan API
+    and never start while Navidrome reports a scan in progress. `docker exec`
+    is the fallback only when the API isn't configured or can't be reached
+    at all; if it answered but its scan status can't be read, the scan is
+    deferred to the next window rather than risking a second, concurrent
+    one. `on_scan(seconds, ok)` is called after every scan.
+    """
+
+    def __init__(self, base_url, username=None, password=None, window_seconds=60,
+                 docker_fallback=True, request_timeout=10, on_scan=None):
+        self.base_url = (base_url or '').rstrip('/')
+        self.username = username
+        self.password = password
+        self.window = max(0, window_seconds)
+        self.docker_fallback = docker_fallback
+        self.request_timeout = request_timeout
+        self.on_scan = on_scan
+        self._lock = threading.Condition()
+        self._pending = []
+        self._window_started = None
+        self._scanning = False
+        self.last_scan = None
+        self.last_method = None
+        self.last_error = None
+        self.scans = 0
+        self.coalesced = 0
+        self.deferred = 0
+
+    def request(self, reason=None):
+        """Ask for a library scan; it runs when the current window closes"""
+        with self._lock:
+            if self._window_started is None:
+                self._window_started = time.monotonic()
+            self._pending.append(reason)
+            self._lock.notify_all()
+
+    def _api(self, method):
+        salt = secrets.token_hex(6)
+        token = hashlib.md5(f'{self.password}{salt}'.encode()).hexdigest()
+        response = requests.get(
+            f'{self.base_url}/rest/{method}',
+            params={
+                'u': self.username,
+                't': token,
+                's': salt,
+                'v': SUBSONIC_API_VERSION,
+                'c': SUBSONIC_CLIENT,
+                'f': 'json',
+            },
+            timeout=self.request_timeout
+        )
+        response.raise_for_status()
+        body = response.json().get('subsonic-response', {})
+        if body.get('status') != 'ok':
+            raise RuntimeError(body.get('error', {}).get('message', 'Subsonic API error'))
+        return body.get('scanStatus', {})
+
+    def api_enabled(self):
+        """Whether the Subsonic API is configured"""
+        return bool(self.base_url and self.username and self.password)
+
+    def _scan_status(self):
+        """getScanStatus, retried with backoff; raises the last error"""
+        for attempt in range(STATUS_RETRIES):
+            try:
+                return self._api('getScanStatus')
+            except Exception as e:
+                if attempt == STATUS_RETRIES - 1:
+                    raise
+                delay = SCAN_POLL_INTERVAL * 2 ** attempt
+                logger.warning(f"Navidrome scan status unavailable, retrying in {delay}s: {e}")
+                time.sleep(delay)
+
+    def _wait_for_idle(self):
+        """Block while Navidrome reports a running scan; raises if the status can't be read"""
+        while self._scan_status().get('scanning'):
+            time.sleep(SCAN_POLL_INTERVAL)
+
+    def _scan(self):
+        """Run one scan, preferring the Subsonic API; None if it had to be deferred"""
+        if not self.api_enabled():
+            return self._docker_scan()
+
+        try:
+            status = self._api('getScanStatus')
+        except requests.ConnectionError as e:
+            logger.warning(f"Navidrome API unreachable, scanning with docker exec: {e}")
+            return self._docker_scan()
+        except Exception:
+            status = None  # Reachable but failing: retried below
+
+        try:
+            if status is None or status.get('scanning'):
+                self._wait_for_idle()
+            self._api('startScan')
+        except Exception as e:
+            self.last_error = f'Navidrome API failed: {e}'
+            return None
+        self.last_method = 'api'
+
+        # startScan returns at once; wait so the scan's duration is known
+        try:
+            self._wait_for_idle()
+        except Exception as e:
+            logger.warning(f"Navidrome scan started, but its progress is unknown: {e}")
+        return True
+
+    def _docker_scan(self):
+        """Scan through the Navidrome CLI in its container"""
+        if not self.docker_fallback:
+            self.last_error = 'Navidrome API unavailable'
+            return False
+
+        # The CLI scan runs in the foreground, so nothing else starts until it returns
+        result = subprocess.run(DOCKER_SCAN_CMD, capture_output=True, text=True)
+        if result.returncode != 0:
+            self.last_error = (result.stderr or 'docker exec failed').strip()
+            return False
+        self.last_method = 'docker'
+        return True
+
+    def run_once(self):
+        """Wait for the next window to close and run its scan"""
+        with self._lock:
+            while self._window_started is None:
+                self._lock.wait()
+            while time.monotonic() < self._window_started + self.window:
+                self._lock.wait(self._window_started + self.window - time.monotonic())
+            reasons, self._pending = self._pending, []
+            self._window_started = None
+            self._scanning = True
+
+        started = time.monotonic()
+        ok = False
+        try:
+            logger.info(f"Starting Navidrome library scan for {len(reasons)} request(s)")
+            ok = self._scan()
+            if ok is None:
+                logger.warning(f"Navidrome library scan deferred to the next window: {self.last_error}")
+                self.deferred += 1
+                with self._lock:
+                    self._pending[:0] = reasons
+                    if self._window_started is None:
+                        self._window_started = time.monotonic()
+                return
+            if ok:
+                self.last_scan = time.time()
+                self.last_error = None
+                self.scans += 1
+                self.coalesced += len(reasons) - 1
+            else:
+                logger.error(f"Navidrome library scan failed: {self.last_error}")
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Navidrome library scan failed: {e}")
+        finally:
+            with self._lock:
+                self._scanning = False
+            if self.on_scan and ok is not None:
+                self.on_scan(time.monotonic() - started, ok)
+
+    def status(self):
+        """Describe pending and past scans"""
+        with self._lock:
+            window_closes = None
+            if self._window_started is not None:
+                window_closes = max(0, self._window_started + self.window - time.monotonic())
+            return {
+                'pending_requests': len(self._pending),
+                'window_seconds': self.window,
+                'next_scan_in': window_closes,
+                'scanning': self._scanning,
+                'last_scan': self.last_scan,
+                'last_method': self.last_method,
+                'last_error': self.last_error,
+                'scans': self.scans,
+                'coalesced_requests': self.coalesced,
+                'deferred_scans': self.deferred,
+            }
+
+    def start(self):
+        """Start the background scan thread"""
+        def scan_loop():
+            while True:
+                self.run_once()
+
+        thread = threading.Thread(target=scan_loop, name='library-scan', daemon=True)
+        thread.start()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Playlist Monitor
+Polls monitored YouTube playlists and queues only the entries that are new
+"""
+
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS playlists (
+    url TEXT PRIMARY KEY,
+    title TEXT,
+    last_checked REAL,
+    next_check REAL NOT NULL,
+    last_new INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    playlist_url TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    PRIMARY KEY (playlist_url, video_id)
+);
+"""
+
+# Seconds between looking for playlists that are due
+TICK_INTERVAL = 30
+
+
+class PlaylistMonitor:
+    """Background poller for MONITOR_PLAYLISTS.
+
+    Each playlist keeps a snapshot of the video IDs seen so far. A check only
+    fetches the flat listing, diffs it against the snapshot and hands the new
+    entries to `enqueue(url, title, entries)`. Checks are spread over the
+    interval and jittered so playlists don't all fire at once.
+    """
+
+    def __init__(self, db_path, get_playlists, list_entries, enqueue,
+                 interval_minutes=60, jitter=0.1):
+        self.db_path = db_path
+        self.get_playlists = get_playlists
+        self.list_entries = list_entries
+        self.enqueue = enqueue
+        self.interval = max(1, interval_minutes) * 60
+        self.jitter = jitter
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def _next_check(self, now):
+        spread = self.interval * self.jitter
+        return now + self.interval + random.uniform(-spread, spread)
+
+    def sync_playlists(self):
+        """Track newly configured playlists and forget removed ones"""
+        conn = self._connection()
+        configured = set(self.get_playlists())
+        known = {row['url'] for row in conn.execute('SELECT url FROM playlists')}
+        now = time.time()
+
+        for url in configured - known:
+            # Stagger first checks across one interval
+            conn.execute(
+                'INSERT INTO playlists (url, next_check) VALUES (?, ?)',
+                (url, now + random.uniform(0, self.interval))
+            )
+            logger.info(f"Monitoring playlist: {url}")
+        for url in known - configured:
+            conn.execute('DELETE FROM playlists WHERE url = ?', (url,))
+            conn.execute('DELETE FROM snapshots WHERE playlist_url = ?', (url,))
+            logger.info(f"Stopped monitoring playlist: {url}")
+
+    def check(self, url):
+        """Fetch a playlist listing and queue the entries not seen before"""
+        conn = self._connection()
+        now = time.time()
+        try:
+            title, entries = self.list_entries(url)
+            known = {
+                row['video_id']
+                for row in conn.execute('SELECT video_id FROM snapshots WHERE playlist_url = ?', (url,))
+            }
+            new_entries = [entry for entry in entries if entry['id'] not in known]
+
+            if new_entries:
+                logger.info(f"Found {len(new_entries)} new entries in playlist: {title}")
+                self.enqueue(url, title, new_entries)
+                conn.executemany(
+                    'INSERT OR IGNORE INTO snapshots (playlist_url, video_id, first_seen) VALUES (?, ?, ?)',
+                    [(url, entry['id'], now) for entry in new_entries]
+                )
+
+            conn.execute(
+                'UPDATE playlists SET title = ?, last_checked = ?, next_check = ?, '
+                'last_new = ?, last_error = NULL WHERE url = ?',
+                (title, now, self._next_check(now), len(new_entries), url)
+            )
+            return len(new_entries)
+
+        except Exception as e:
+            logger.error(f"Playlist check failed: {url} - {e}")
+            conn.execute(
+                'UPDATE playlists SET last_checked = ?, next_check = ?, last_error = ? WHERE url = ?',
+                (now, self._next_check(now), str(e), url)
+            )
+            return 0
+
+    def run_due(self):
+        """Check every playlist whose next check time has passed"""
+        self.sync_playlists()
+        due = self._connection().execute(
+            'SELECT url FROM playlists WHERE next_check <= ? ORDER BY next_check', (time.time(),)
+        ).fetchall()
+        for row in due:
+            self.check(row['url'])
+
+    def check_now(self, url=None):
+        """Make one or all playlists due on the next tick"""
+        self.sync_playlists()
+        query, params = 'UPDATE playlists SET next_check = 0', ()
+        if url:
+            query, params = query + ' WHERE url = ?', (url,)
+        self._connection().execute(query, params)
+        self._wakeup.set()
+
+    def status(self):
+        """Describe the monitored playlists"""
+        rows = self._connection().execute(
+            'SELECT p.*, COUNT(s.video_id) AS known_entries FROM playlists p '
+            'LEFT JOIN snapshots s ON s.playlist_url = p.url GROUP BY p.url ORDER BY p.next_check'
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def start(self):
+        """Start the background polling thread"""
+        def monitor_loop():
+            while True:
+                try:
+                    self.run_due()
+                except Exception as e:
+                    logger.error(f"Playlist monitor error: {e}")
+                self._wakeup.wait(TICK_INTERVAL)
+                self._wakeup.clear()
+
+        thread = threading.Thread(target=monitor_loop, name='playlist-monitor', daemon=True)
+        thread.start()
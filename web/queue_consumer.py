@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Download Queue Consumer
+Drains the /api/queue batch file into the download scheduler
+"""
+
+import fcntl
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from archive import extract_video_id
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    url TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    off_peak INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    job_id TEXT,
+    added_at REAL NOT NULL,
+    dispatched_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_pending ON entries (status, priority DESC, id);
+"""
+
+PRIORITIES = {'high': 10, 'normal': 0, 'low': -10}
+
+# Finished entries are kept this long to catch duplicates, in seconds
+DISPATCHED_RETENTION = 7 * 86400
+
+# Job statuses that end a dispatched entry without a download, so its URL may be queued again
+RELEASED_STATUSES = ('error', 'cancelled')
+
+# Seconds between looking at the queue file
+TICK_INTERVAL = 5
+
+
+def parse_priority(value):
+    """Turn 'high'/'normal'/'low' or a number into an integer priority"""
+    if isinstance(value, str) and value.lower() in PRIORITIES:
+        return PRIORITIES[value.lower()]
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f'Invalid priority: {value!r}')
+
+
+def parse_window(value):
+    """Parse 'HH:MM-HH:MM' into two minutes-after-midnight, or None"""
+    match = re.fullmatch(r'\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*', value or '')
+    if not match:
+        return None
+    h1, m1, h2, m2 = (int(group) for group in match.groups())
+    return h1 * 60 + m1, h2 * 60 + m2
+
+
+def entry_key(url):
+    """Key that identifies the same video or playlist across URL spellings"""
+    playlist = re.search(r'[?&]list=([\w-]+)', url)
+    if 'playlist?' in url and playlist:
+        return f'playlist:{playlist.group(1)}'
+    video_id = extract_video_id(url)
+    if video_id:
+        return f'video:{video_id}'
+    return f'url:{url.strip()}'
+
+
+def append_entries(queue_file, entries):
+    """Append entries to the queue file, safe against concurrent writers and the consumer.
+
+    Writers and the consumer take an exclusive flock. The consumer claims the
+    file by renaming it, so a writer that opened it before the rename sees a
+    different inode once it gets the lock and reopens the path.
+    """
+    os.makedirs(os.path.dirname(queue_file) or '.', exist_ok=True)
+    lines = ''.join(json.dumps(entry) + '\n' for entry in entries)
+    while True:
+        with open(queue_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino != os.stat(queue_file).st_ino:
+                    continue
+            except FileNotFoundError:
+                continue
+            f.write(lines)
+            f.flush()
+            return
+
+
+def parse_line(line):
+    """Read one queue file line: a bare URL or a JSON entry"""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        return entry if isinstance(entry, dict) and entry.get('url') else None
+    return {'url': line}
+
+
+class QueueConsumer:
+    """Move queue file entries into a durable, deduplicated queue and dispatch them.
+
+    Entries are claimed by atomically renaming the queue file under its lock,
+    recorded in SQLite keyed by video or playlist ID (later duplicates are
+    dropped) and then deleted. Only as many entries are handed to
+    `dispatch(url)` as keep the download backlog at `max_backlog`, highest
+    priority first, so a bulk import drains steadily instead of flooding the
+    scheduler. Off-peak entries wait for the configured window.
+
+    `job_status(job_id)` reports how a dispatched entry's job is doing: a job
+    that completed keeps its key for DISPATCHED_RETENTION so duplicates are
+    still dropped, while one that failed or was cancelled gives its key up so
+    the URL can be queued again.
+    """
+
+    def __init__(self, queue_file, db_path, dispatch, backlog, max_backlog=4,
+                 off_peak_window=None, playlists_off_peak=True, job_status=None):
+        self.queue_file = queue_file
+        self.db_path = db_path
+        self.dispatch = dispatch
+        self.backlog = backlog
+        self.job_status = job_status
+        self.max_backlog = max(1, max_backlog)
+        self.window = parse_window(off_peak_window)
+        self.playlists_off_peak = playlists_off_peak
+        self.duplicates = 0
+        self.released = 0
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def in_off_peak(self, now=None):
+        """Whether the off-peak window is open (always, when none is set)"""
+        if not self.window:
+            return True
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        start, end = self.window
+        if start <= end:
+            return start <= minute < end
+        return minute >= start or minute < end
+
+    def claim(self):
+        """Rename the queue file away under its lock and return the claimed path"""
+        try:
+            f = open(self.queue_file, 'r')
+        except FileNotFoundError:
+            return None
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                # Another consumer may have claimed it while we waited for the lock
+                if os.fstat(f.fileno()).st_ino != os.stat(self.queue_file).st_ino:
+                    return None
+            except FileNotFoundError:
+                return None
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            claimed = f'{self.queue_file}.{int(time.time() * 1000)}.claimed'
+            os.rename(self.queue_file, claimed)
+        return claimed
+
+    def ingest(self, path):
+        """Record a claimed file's entries and delete it; safe to repeat after a crash"""
+        rows = []
+        with open(path) as f:
+            for line in f:
+                entry = parse_line(line)
+                if entry is None:
+                    continue
+                url = entry['url'].strip()
+                try:
+                    priority = parse_priority(entry.get('priority'))
+                except ValueError as e:
+                    logger.warning(f"Queue entry {url}: {e}, using normal priority")
+                    priority = 0
+                key = entry_key(url)
+                off_peak = entry.get('off_peak')
+                if off_peak is None:
+                    off_peak = self.playlists_off_peak and key.startswith('playlist:')
+                rows.append((key, url, priority, int(bool(off_peak)), entry.get('added_at') or time.time()))
+
+        conn = self._connection()
+        before = conn.total_changes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR IGNORE INTO entries (key, url, priority, off_peak, added_at) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        added = conn.total_changes - before
+        self.duplicates += len(rows) - added
+        os.remove(path)
+        if rows:
+            logger.info(f"Queued {added} entries from the queue file ({len(rows) - added} duplicates)")
+        return added
+
+    def dispatch_due(self):
+        """Hand pending entries to the downloader while the backlog has room"""
+        room = self.max_backlog - self.backlog()
+        if room <= 0:
+            return 0
+        conn = self._connection()
+        query = "SELECT id, url FROM entries WHERE status = 'pending'"
+        if not self.in_off_peak():
+            query += ' AND off_peak = 0'
+        rows = conn.execute(query + ' ORDER BY priority DESC, id LIMIT ?', (room,)).fetchall()
+        for row in rows:
+            job_id = self.dispatch(row['url'])
+            conn.execute(
+                "UPDATE entries SET status = 'dispatched', job_id = ?, dispatched_at = ? WHERE id = ?",
+                (job_id, time.time(), row['id'])
+            )
+        return len(rows)
+
+    def settle(self):
+        """Mark dispatched entries whose jobs completed and release those that did not"""
+        if self.job_status is None:
+            return 0
+        conn = self._connection()
+        rows = conn.execute("SELECT id, job_id FROM entries WHERE status = 'dispatched'").fetchall()
+        released = 0
+        for row in rows:
+            status = self.job_status(row['job_id']) if row['job_id'] else None
+            if status == 'completed':
+                conn.execute("UPDATE entries SET status = 'done' WHERE id = ?", (row['id'],))
+            elif status in RELEASED_STATUSES:
+                conn.execute('DELETE FROM entries WHERE id = ?', (row['id'],))
+                released += 1
+        self.released += released
+        return released
+
+    def run_once(self):
+        """Claim new queue file entries and dispatch what is due"""
+        # Files claimed before a crash are ingested first; INSERT OR IGNORE makes it idempotent
+        for path in sorted(glob.glob(f'{glob.escape(self.queue_file)}.*.claimed')):
+            self.ingest(path)
+        claimed = self.claim()
+        if claimed:
+            self.ingest(claimed)
+        self.settle()
+        self._connection().execute(
+            "DELETE FROM entries WHERE status IN ('dispatched', 'done') AND dispatched_at < ?",
+            (time.time() - DISPATCHED_RETENTION,)
+        )
+        return self.dispatch_due()
+
+    def add(self, entries):
+        """Append entries to the queue file and wake the consumer"""
+        append_entries(self.queue_file, entries)
+        self._wakeup.set()
+
+    def status(self):
+        """Describe the pending entries"""
+        conn = self._connection()
+        pending = conn.execute(
+            "SELECT COUNT(*) AS total, COALESCE(SUM(off_peak), 0) AS off_peak FROM entries WHERE status = 'pending'"
+        ).fetchone()
+        by_priority = conn.execute(
+            "SELECT priority, COUNT(*) AS count FROM entries WHERE status = 'pending' "
+            "GROUP BY priority ORDER BY priority DESC"
+        ).fetchall()
+        return {
+            'pending': pending['total'],
+            'pending_off_peak': pending['off_peak'],
+            'by_priority': {str(row['priority']): row['count'] for row in by_priority},
+            'dispatched': conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE status = 'dispatched'"
+            ).fetchone()[0],
+            'duplicates_dropped': self.duplicates,
+            'released': self.released,
+            'off_peak_window': '{:02d}:{:02d}-{:02d}:{:02d}'.format(
+                *divmod(self.window[0], 60), *divmod(self.window[1], 60)
+            ) if self.window else None,
+            'off_peak_open': self.in_off_peak(),
+            'max_backlog': self.max_backlog,
+        }
+
+    def start(self):
+        """Start the background consumer thread"""
+        def consume_loop():
+            while True:
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logger.error(f"Queue consumer error: {e}")
+                self._wakeup.wait(TICK_INTERVAL)
+                self._wakeup.clear()
+
+        thread = threading.Thread(target=consume_loop, name='queue-consumer', daemon=True)
+        thread.start()
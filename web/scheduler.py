@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Download Scheduler
+Bounded, resizable worker pool with a FIFO backlog and job cancellation
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when it has been cancelled"""
+
+
+class DownloadScheduler:
+    """Run download jobs on a bounded pool of worker threads.
+
+    Jobs are started in submission order. At most ``max_workers`` jobs run at
+    the same time; everything else waits in the backlog until a worker frees up.
+    With ``max_queued`` set the backlog is bounded and ``submit_wait`` blocks
+    the producer until there is room, so an upstream stage can't run ahead.
+    """
+
+    def __init__(self, max_workers=2, on_start=None, on_cancel=None, name='download',
+                 max_queued=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_queued = max(1, int(max_queued)) if max_queued else None
+        self.name = name
+        self.on_start = on_start
+        self.on_cancel = on_cancel
+        self._backlog = OrderedDict()
+        self._running = {}
+        self._cancelled = set()
+        self._condition = threading.Condition()
+        self._workers = []
+        self._stopping = False
+
+    def start(self):
+        """Start the worker threads"""
+        with self._condition:
+            if self._workers:
+                return
+            self._stopping = False
+            self._spawn_workers()
+        logger.info(f"Started {self.max_workers} {self.name} workers")
+
+    def _spawn_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f'{self.name}-worker-{len(self._workers)}',
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def resize(self, max_workers):
+        """Change how many jobs may run at once.
+
+        Growing starts jobs from the backlog right away; shrinking lets running
+        jobs finish and holds the backlog until fewer than max_workers run.
+        """
+        with self._condition:
+            self.max_workers = max(1, int(max_workers))
+            if self._workers:
+                self._spawn_workers()
+            self._condition.notify_all()
+        return self.max_workers
+
+    def stop(self):
+        """Ask the workers to exit once their current job is done"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+    def submit(self, job_id, func, *args, **kwargs):
+        """Add a job to the end of the backlog"""
+        with self._condition:
+            if job_id in self._backlog or job_id in self._running:
+                return False
+            self._cancelled.discard(job_id)
+            self._backlog[job_id] = (func, args, kwargs)
+            self._condition.notify_all()
+        return True
+
+    def submit_wait(self, job_id, func, *args, **kwargs):
+        """Add a job once the bounded backlog has room for it"""
+        with self._condition:
+            while (self.max_queued and len(self._backlog) >= self.max_queued
+                   and not self._stopping):
+                self._condition.wait()
+            # The condition's lock is reentrant, so the check and the add are one step
+            return self.submit(job_id, func, *args, **kwargs)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job.
+
+        Returns 'queued' or 'running' depending on where the job was found,
+        or None if the scheduler does not know about it.
+        """
+        with self._condition:
+            if job_id in self._backlog:
+                del self._backlog[job_id]
+                self._condition.notify_all()
+                return 'queued'
+            if job_id not in self._running:
+                return None
+            self._cancelled.add(job_id)
+
+        if self.on_cancel:
+            try:
+                self.on_cancel(job_id)
+            except Exception as e:
+                logger.error(f"Cancel hook failed for {job_id}: {e}")
+        return 'running'
+
+    def is_cancelled(self, job_id):
+        """Check whether a running job has been asked to stop"""
+        with self._condition:
+            return job_id in self._cancelled
+
+    def position(self, job_id):
+        """Return the 1-based backlog position of a job, or None"""
+        with self._condition:
+            for index, queued_id in enumerate(self._backlog, start=1):
+                if queued_id == job_id:
+                    return index
+        return None
+
+    def snapshot(self):
+        """Describe the current backlog and running jobs"""
+        with self._condition:
+            return {
+                'max_workers': self.max_workers,
+                'max_queued': self.max_queued,
+                'running': list(self._running),
+                'queued': list(self._backlog)
+            }
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                while ((not self._backlog or len(self._running) >= self.max_workers)
+                       and not self._stopping):
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                job_id, (func, args, kwargs) = self._backlog.popitem(last=False)
+                self._running[job_id] = threading.current_thread().name
+                # Wake producers waiting in submit_wait
+                self._condition.notify_all()
+
+            try:
+                if self.on_start:
+                    self.on_start(job_id)
+                func(*args, **kwargs)
+            except JobCancelled:
+                logger.info(f"Job cancelled: {job_id}")
+            except Exception as e:
+                logger.error(f"Job {job_id} crashed: {e}")
+            finally:
+                with self._condition:
+                    self._running.pop(job_id, None)
+                    self._cancelled.discard(job_id)
+                    # An idle worker may be held back by a smaller pool size
+                    self._condition.notify_all()